@@ -1,8 +1,18 @@
+from decimal import Decimal
+
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import Q, Sum, Value
+from django.db.models.functions import Coalesce
 
-from app_accounts.models import CourierScore, TelegramGroup
+from app_accounts.models import (
+    CourierScore,
+    DailyScore,
+    ScoreRollupBuild,
+    ScoreSource,
+    TelegramGroup,
+)
 
 User = get_user_model()
 
@@ -73,3 +83,85 @@ class TelegramGroupAdmin(admin.ModelAdmin):
     list_display = ("title", "chat_id", "group_type", "created_at")
     search_fields = ("title", "chat_id", "group_type")
     list_filter = ("group_type", "created_at")
+
+
+@admin.register(DailyScore)
+class DailyScoreAdmin(admin.ModelAdmin):
+    """
+    Ведомость за любой период: фильтр по датам (day__gte/day__lte),
+    городу и источнику, над списком — итоги выборки по сотрудникам.
+    Строки только читаются, их пишет build_score_rollups.
+    """
+
+    list_display = ("day", "user", "city", "source", "points", "entries")
+    list_filter = ("source", "city")
+    search_fields = ("user__username", "user__phone_number")
+    date_hierarchy = "day"
+    list_select_related = ("user", "city")
+    leaderboard_size = 20
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context=extra_context)
+
+        try:
+            queryset = response.context_data["cl"].queryset.order_by()
+            zero = Value(Decimal("0.00"))
+            response.context_data["total_points"] = queryset.aggregate(
+                total=Coalesce(Sum("points"), zero)
+            )["total"]
+            response.context_data["leaderboard"] = (
+                queryset.values("user__username")
+                .annotate(
+                    order_points=Coalesce(
+                        Sum("points", filter=Q(source=ScoreSource.ORDERS)), zero
+                    ),
+                    cargo_points=Coalesce(
+                        Sum("points", filter=Q(source=ScoreSource.CARGO)), zero
+                    ),
+                    points=Sum("points"),
+                )
+                .order_by("-points", "user__username")[: self.leaderboard_size]
+            )
+            response.context_data["day_range"] = {
+                "gte": request.GET.get("day__gte", ""),
+                "lte": request.GET.get("day__lte", ""),
+                # остальные фильтры сохраняются при смене периода
+                "params": [
+                    (key, value)
+                    for key, value in request.GET.items()
+                    if key not in ("day__gte", "day__lte", "p")
+                ],
+            }
+        except (AttributeError, KeyError):
+            pass
+
+        return response
+
+
+@admin.register(ScoreRollupBuild)
+class ScoreRollupBuildAdmin(admin.ModelAdmin):
+    list_display = (
+        "started_at",
+        "mode",
+        "first_day",
+        "last_day",
+        "days",
+        "rows",
+        "finished_at",
+    )
+    list_filter = ("mode",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
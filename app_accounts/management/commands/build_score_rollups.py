@@ -0,0 +1,46 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from app_accounts.score_rollups import build_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересобирает DailyScore — баллы сотрудников по дням и городам. "
+        "Без параметров — только дни, затронутые с прошлой сборки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="first_day",
+            type=date.fromisoformat,
+            help="Rebuild days starting from YYYY-MM-DD",
+        )
+        parser.add_argument(
+            "--to",
+            dest="last_day",
+            type=date.fromisoformat,
+            help="Rebuild days up to YYYY-MM-DD inclusive (default: today)",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Rebuild the whole table",
+        )
+
+    def handle(self, *args, **options):
+        build = build_rollups(
+            first_day=options["first_day"],
+            last_day=options["last_day"],
+            full=options["full"],
+        )
+        period = f" ({build.first_day} — {build.last_day})" if build.first_day else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{build.get_mode_display()}: rebuilt {build.days} days{period}, "
+                f"{build.rows} rows in "
+                f"{(build.finished_at - build.started_at).total_seconds():.1f}s."
+            )
+        )
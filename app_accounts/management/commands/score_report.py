@@ -0,0 +1,69 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app_accounts.score_rollups import score_totals
+from app_cargo.registry import cargo_registry
+
+GROUPINGS = {
+    "user": ("user__username",),
+    "city": ("city__name",),
+    "day": ("day",),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Итоги баллов за период по сотрудникам, городам или дням "
+        "(читает DailyScore, см. build_score_rollups)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="first_day",
+            type=date.fromisoformat,
+            help="First day, YYYY-MM-DD (default: first day of current month)",
+        )
+        parser.add_argument(
+            "--to",
+            dest="last_day",
+            type=date.fromisoformat,
+            help="Last day inclusive, YYYY-MM-DD (default: today)",
+        )
+        parser.add_argument(
+            "--by", choices=sorted(GROUPINGS), default="user", help="Group rows by"
+        )
+        parser.add_argument("--city", help="Only this city")
+        parser.add_argument(
+            "--limit", type=int, default=0, help="Show only top N rows (default: all)"
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        first_day = options["first_day"] or today.replace(day=1)
+        last_day = options["last_day"] or today
+
+        filters = {}
+        if options["city"]:
+            city = cargo_registry.city_by_name(options["city"])
+            if city is None:
+                raise CommandError(f"Unknown city: {options['city']!r}")
+            filters["city"] = city
+
+        group_by = GROUPINGS[options["by"]]
+        rows = score_totals(first_day, last_day, group_by=group_by, **filters)
+        if options["limit"]:
+            rows = rows[: options["limit"]]
+
+        self.stdout.write(
+            f"{'':<4}{options['by']:<24}{'orders':>12}{'cargo':>12}{'total':>12}"
+        )
+        for place, row in enumerate(rows, start=1):
+            self.stdout.write(
+                f"{place:<4}{str(row[group_by[0]] or '—'):<24}"
+                f"{row['order_points'] or 0:>12.2f}{row['cargo_points'] or 0:>12.2f}"
+                f"{row['points'] or 0:>12.2f}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Period {first_day} — {last_day}."))
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:30
+
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокирует запись в большие таблицы,
+    # но не может выполняться внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ("app_accounts", "0006_user_city"),
+        ("app_cargo", "0008_alter_city_options_alter_city_name"),
+        ("app_orders", "0015_order_created_at_idx"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="courierscore",
+            index=models.Index(
+                fields=["user", "order"], name="courierscore_user_order_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="user",
+            index=models.Index(
+                condition=models.Q(("chat_id__isnull", False)),
+                fields=["chat_id"],
+                name="user_chat_id_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="user",
+            index=models.Index(
+                condition=models.Q(("phone_number__isnull", False)),
+                fields=["phone_number"],
+                name="user_phone_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="user",
+            index=models.Index(
+                django.db.models.functions.text.Upper("email"),
+                name="user_email_upper_idx",
+            ),
+        ),
+    ]
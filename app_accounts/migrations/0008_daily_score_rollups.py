@@ -0,0 +1,157 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_accounts", "0007_hot_lookup_indexes"),
+        ("app_cargo", "0009_workdistribution_workdist_scanned_at_idx"),
+        ("app_orders", "0018_videoblob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyScore",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(verbose_name="День")),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[("orders", "Заказы"), ("cargo", "Грузы")],
+                        max_length=10,
+                        verbose_name="Источник",
+                    ),
+                ),
+                (
+                    "points",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="Баллы"
+                    ),
+                ),
+                (
+                    "entries",
+                    models.PositiveIntegerField(
+                        help_text="Сколько строк CourierScore/WorkDistribution вошло в сумму",
+                        verbose_name="Записей",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Баллы за день",
+                "verbose_name_plural": "Баллы по дням",
+            },
+        ),
+        migrations.CreateModel(
+            name="ScoreRollupBuild",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "mode",
+                    models.CharField(
+                        choices=[
+                            ("incremental", "Инкремент"),
+                            ("range", "Период"),
+                            ("full", "Полная"),
+                        ],
+                        max_length=12,
+                        verbose_name="Режим",
+                    ),
+                ),
+                ("started_at", models.DateTimeField(verbose_name="Начало")),
+                ("finished_at", models.DateTimeField(verbose_name="Конец")),
+                (
+                    "first_day",
+                    models.DateField(blank=True, null=True, verbose_name="С"),
+                ),
+                (
+                    "last_day",
+                    models.DateField(blank=True, null=True, verbose_name="По"),
+                ),
+                (
+                    "days",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Дней пересчитано"
+                    ),
+                ),
+                (
+                    "rows",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Строк записано"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Сборка баллов по дням",
+                "verbose_name_plural": "Сборки баллов по дням",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="courierscore",
+            index=models.Index(
+                fields=["created_at"], name="courierscore_created_at_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="dailyscore",
+            name="city",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="daily_scores",
+                to="app_cargo.city",
+                verbose_name="Город",
+            ),
+        ),
+        migrations.AddField(
+            model_name="dailyscore",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="daily_scores",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="Сотрудник",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dailyscore",
+            index=models.Index(fields=["user", "day"], name="dailyscore_user_day_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="dailyscore",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("city__isnull", False)),
+                fields=("day", "user", "city", "source"),
+                name="dailyscore_day_user_city_source_uniq",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="dailyscore",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("city__isnull", True)),
+                fields=("day", "user", "source"),
+                name="dailyscore_day_user_nocity_uniq",
+            ),
+        ),
+    ]
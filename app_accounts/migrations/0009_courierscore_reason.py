@@ -0,0 +1,69 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+PREPARATION_TYPES = ("shipment", "packing")
+
+
+def mark_preparation_scores(apps, schema_editor):
+    """
+    Баллы за подготовку раньше ничем не отличались от баллов за доставку.
+    Подготовкой считаем баллы исполнителей OrderPreparation заказа; если
+    исполнитель сам и доставил заказ, первая его строка — за доставку
+    (consume_orders создаёт её до начисления за подготовку).
+    """
+    CourierScore = apps.get_model("app_accounts", "CourierScore")
+    OrderHistory = apps.get_model("app_orders", "OrderHistory")
+    OrderPreparation = apps.get_model("app_orders", "OrderPreparation")
+
+    executors = set(
+        OrderPreparation.objects.filter(
+            preparation_type__in=PREPARATION_TYPES, executor__isnull=False
+        ).values_list("order_code", "executor_id")
+    )
+    if not executors:
+        return
+    couriers = set(
+        OrderHistory.objects.filter(
+            action="COMPLETED",
+            user_type="MERCHANT_USER",
+            processed_by__isnull=False,
+        ).values_list("order_id", "processed_by_id")
+    )
+    rows = {}
+    for pk, order_id, order_code, user_id in (
+        CourierScore.objects.order_by("pk")
+        .values_list("pk", "order_id", "order__order_code", "user_id")
+        .iterator()
+    ):
+        if (order_code, user_id) in executors:
+            rows.setdefault((order_id, user_id), []).append(pk)
+
+    preparation = []
+    for key, pks in rows.items():
+        preparation.extend(pks[1:] if key in couriers else pks)
+    for start in range(0, len(preparation), 1000):
+        CourierScore.objects.filter(pk__in=preparation[start : start + 1000]).update(
+            reason="preparation"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_accounts", "0008_daily_score_rollups"),
+        ("app_orders", "0018_videoblob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="courierscore",
+            name="reason",
+            field=models.CharField(
+                choices=[("delivery", "Доставка"), ("preparation", "Подготовка")],
+                default="delivery",
+                max_length=20,
+            ),
+        ),
+        migrations.RunPython(mark_preparation_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_accounts", "0009_courierscore_reason"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StaleScoreDay",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(unique=True, verbose_name="День")),
+                ("marked_at", models.DateTimeField(verbose_name="Отмечен")),
+            ],
+            options={
+                "verbose_name": "День к пересборке",
+                "verbose_name_plural": "Дни к пересборке",
+            },
+        ),
+    ]
@@ -1,7 +1,10 @@
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Upper
+from django.utils import timezone
 
 from app_orders.models import Order
 from app_cargo.models import City
@@ -18,11 +21,85 @@ class User(AbstractUser):
         related_name="employees",
     )  # город сотрудника
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # консьюмеры и бот ищут сотрудника по chat_id / телефону / email;
+            # у большинства записей одно из полей пустое — в индекс не берём
+            models.Index(
+                fields=["chat_id"],
+                name="user_chat_id_idx",
+                condition=Q(chat_id__isnull=False),
+            ),
+            models.Index(
+                fields=["phone_number"],
+                name="user_phone_idx",
+                condition=Q(phone_number__isnull=False),
+            ),
+            # email__iexact в Postgres превращается в UPPER(email) = UPPER(%s)
+            models.Index(Upper("email"), name="user_email_upper_idx"),
+        ]
+
     def __str__(self):
         # Можно выводить либо username, либо (username + телефон)
         return f"{self.username} ({self.phone_number or 'no phone'})"
 
 
+POINTS_UPDATE_CHUNK = 500
+POINTS_QUANTUM = Decimal("0.01")
+
+
+def quantize_points(points) -> Decimal:
+    """
+    Баллы в том виде, в каком их сохранит CourierScore.points
+    (два знака, Postgres округляет половину от нуля). Итог заказа
+    считаем из того же значения, иначе доли вроде 1/3 накапливают расхождение.
+    """
+    return Decimal(points).quantize(POINTS_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def add_order_points(deltas: dict):
+    """
+    Прибавляет к Order.points_total изменения {order_id: delta}
+    одним UPDATE на каждые POINTS_UPDATE_CHUNK заказов.
+    Через F(), чтобы параллельные начисления не терялись.
+    """
+    items = [(order_id, delta) for order_id, delta in deltas.items() if delta]
+    field = Order._meta.get_field("points_total")
+    # CASE на тысячи веток проверяется для каждой строки — режем на пачки
+    for start in range(0, len(items), POINTS_UPDATE_CHUNK):
+        chunk = dict(items[start : start + POINTS_UPDATE_CHUNK])
+        Order.objects.filter(pk__in=chunk).update(
+            points_total=F("points_total")
+            + Case(
+                *[
+                    When(pk=order_id, then=Value(delta))
+                    for order_id, delta in chunk.items()
+                ],
+                output_field=field,
+            )
+        )
+
+
+class CourierScoreQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create не шлёт post_save, поэтому итог по заказам правим здесь
+        objs = list(objs)
+        for score in objs:
+            score.points = quantize_points(score.points)
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            deltas = {}
+            for score in created:
+                deltas[score.order_id] = deltas.get(score.order_id, 0) + score.points
+            add_order_points(deltas)
+        return created
+
+
+class CourierScoreReason(models.TextChoices):
+    DELIVERY = "delivery", "Доставка"
+    PREPARATION = "preparation", "Подготовка"
+
+
 class CourierScore(models.Model):
     """
     Хранит информацию о том, кому и за какой заказ
@@ -38,8 +115,24 @@ class CourierScore(models.Model):
         decimal_places=2,
         default=Decimal("1.00"),
     )  # Количество баллов
+    # за подготовку баллы пересчитываются (app_orders.scoring), за доставку — нет
+    reason = models.CharField(
+        max_length=20,
+        choices=CourierScoreReason.choices,
+        default=CourierScoreReason.DELIVERY,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CourierScoreQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # проверка «балл за этот заказ уже начислен» в consume_orders
+            models.Index(fields=["user", "order"], name="courierscore_user_order_idx"),
+            # build_score_rollups читает баллы по дням
+            models.Index(fields=["created_at"], name="courierscore_created_at_idx"),
+        ]
+
     def __str__(self):
         return f"Score {self.points} for {self.user} (order: {self.order.order_code})"
 
@@ -60,3 +153,121 @@ class TelegramGroup(models.Model):
 
     def __str__(self):
         return f"{self.title} (chat_id={self.chat_id})"
+
+
+class ScoreSource(models.TextChoices):
+    ORDERS = "orders", "Заказы"
+    CARGO = "cargo", "Грузы"
+
+
+class DailyScore(models.Model):
+    """
+    Баллы сотрудника за день в городе: сумма CourierScore.points (заказы)
+    или WorkDistribution.score_share (грузы). Заполняется командой
+    build_score_rollups, отчёты за период читают только эту таблицу.
+    """
+
+    day = models.DateField(verbose_name="День")
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="daily_scores",
+        verbose_name="Сотрудник",
+    )
+    # для заказов — город сотрудника на момент сборки, для грузов — город работы
+    city = models.ForeignKey(
+        City,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="daily_scores",
+        verbose_name="Город",
+    )
+    source = models.CharField(
+        max_length=10, choices=ScoreSource.choices, verbose_name="Источник"
+    )
+    points = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Баллы")
+    entries = models.PositiveIntegerField(
+        verbose_name="Записей",
+        help_text="Сколько строк CourierScore/WorkDistribution вошло в сумму",
+    )
+
+    class Meta:
+        verbose_name = "Баллы за день"
+        verbose_name_plural = "Баллы по дням"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "user", "city", "source"],
+                condition=Q(city__isnull=False),
+                name="dailyscore_day_user_city_source_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["day", "user", "source"],
+                condition=Q(city__isnull=True),
+                name="dailyscore_day_user_nocity_uniq",
+            ),
+        ]
+        indexes = [
+            # ведомость по одному сотруднику за период
+            models.Index(fields=["user", "day"], name="dailyscore_user_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.user}: {self.points} ({self.get_source_display()})"
+
+
+class StaleScoreDay(models.Model):
+    """
+    День, баллы которого изменились задним числом: CourierScore удалили
+    или поправили. Новые строки инкремент находит по created_at, а эти
+    дни — здесь (см. dirty_days в app_accounts.score_rollups).
+    """
+
+    day = models.DateField(unique=True, verbose_name="День")
+    marked_at = models.DateTimeField(verbose_name="Отмечен")
+
+    class Meta:
+        verbose_name = "День к пересборке"
+        verbose_name_plural = "Дни к пересборке"
+
+    def __str__(self):
+        return f"{self.day} (отмечен {self.marked_at:%Y-%m-%d %H:%M})"
+
+
+def mark_stale_days(moments):
+    """Отмечает дни указанных created_at для следующей сборки DailyScore."""
+    days = {timezone.localdate(moment) for moment in moments if moment is not None}
+    if not days:
+        return
+    now = timezone.now()
+    StaleScoreDay.objects.bulk_create(
+        [StaleScoreDay(day=day, marked_at=now) for day in days],
+        update_conflicts=True,
+        unique_fields=["day"],
+        update_fields=["marked_at"],
+    )
+
+
+class ScoreRollupBuild(models.Model):
+    """Журнал запусков build_score_rollups."""
+
+    class Mode(models.TextChoices):
+        INCREMENTAL = "incremental", "Инкремент"
+        RANGE = "range", "Период"
+        FULL = "full", "Полная"
+
+    mode = models.CharField(max_length=12, choices=Mode.choices, verbose_name="Режим")
+    # для инкремента берётся начало последней сборки, кроме пересборок за период
+    started_at = models.DateTimeField(verbose_name="Начало")
+    finished_at = models.DateTimeField(verbose_name="Конец")
+    first_day = models.DateField(blank=True, null=True, verbose_name="С")
+    last_day = models.DateField(blank=True, null=True, verbose_name="По")
+    days = models.PositiveIntegerField(default=0, verbose_name="Дней пересчитано")
+    rows = models.PositiveIntegerField(default=0, verbose_name="Строк записано")
+
+    class Meta:
+        verbose_name = "Сборка баллов по дням"
+        verbose_name_plural = "Сборки баллов по дням"
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M}: {self.days} дн., {self.rows} строк"
@@ -0,0 +1,211 @@
+"""
+Сборка и чтение DailyScore — баллов сотрудников по дням и городам.
+
+Баллы лежат в двух местах: CourierScore.points (заказы) и
+WorkDistribution.score_share (грузы). Ведомость за месяц по сырым
+строкам — это проход по всем начислениям периода, поэтому отчёты
+читают DailyScore, а build_rollups (команда build_score_rollups, по
+cron) пересобирает в ней только «грязные» дни:
+  • дни, в которые появились новые CourierScore;
+  • дни удалённых и изменённых CourierScore — сигналы отмечают их
+    в StaleScoreDay (так пересчёт подготовки убирает старые доли);
+  • дни всех долей работ, к которым добавился участник: scan_qr
+    пересчитывает доли и прежним участникам, в том числе вчерашним.
+Каждый такой день пересобирается целиком (DELETE + INSERT из GROUP BY),
+так что повторный запуск безопасен. QuerySet.update() и delete() без
+сигналов (raw SQL) дни не отмечают, как и Order.points_total, — после
+таких правок нужна пересборка за период.
+Границы дней — в TIME_ZONE проекта.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from app_accounts.models import (
+    CourierScore,
+    DailyScore,
+    ScoreRollupBuild,
+    ScoreSource,
+    StaleScoreDay,
+)
+from app_cargo.models import WorkDistribution
+
+# запас на транзакции, закоммиченные позже записанного в них created_at
+WATERMARK_OVERLAP = timedelta(minutes=10)
+# столько подряд идущих дней пересобирается в одной транзакции
+DAYS_PER_TRANSACTION = 31
+
+
+def day_bounds(first_day, last_day):
+    """[начало first_day, начало дня после last_day) в текущем часовом поясе."""
+    start = timezone.make_aware(datetime.combine(first_day, time.min))
+    end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min))
+    return start, end
+
+
+def day_range(first_day, last_day):
+    return [
+        first_day + timedelta(days=n) for n in range((last_day - first_day).days + 1)
+    ]
+
+
+def daily_source_rows(start, end):
+    """(источник, строки day/user/city/points/entries) из сырых таблиц."""
+    orders = (
+        CourierScore.objects.filter(created_at__gte=start, created_at__lt=end)
+        .annotate(day=TruncDate("created_at"))
+        .values("day", "user", city=F("user__city"))
+        .annotate(points=Sum("points"), entries=Count("pk"))
+        .order_by()
+    )
+    cargo = (
+        WorkDistribution.objects.filter(scanned_at__gte=start, scanned_at__lt=end)
+        .annotate(day=TruncDate("scanned_at"))
+        .values("day", user=F("employee"), city=F("work_unit__city"))
+        .annotate(points=Sum("score_share"), entries=Count("pk"))
+        .order_by()
+    )
+    return ((ScoreSource.ORDERS, orders), (ScoreSource.CARGO, cargo))
+
+
+def dirty_days(since) -> set:
+    """Дни, суммы которых могли измениться после since."""
+    days = set(
+        CourierScore.objects.filter(created_at__gte=since)
+        .annotate(day=TruncDate("created_at"))
+        .values_list("day", flat=True)
+        .distinct()
+    )
+    days.update(
+        StaleScoreDay.objects.filter(marked_at__gte=since).values_list("day", flat=True)
+    )
+    touched = WorkDistribution.objects.filter(scanned_at__gte=since).values("work_unit")
+    days.update(
+        WorkDistribution.objects.filter(work_unit__in=touched)
+        .annotate(day=TruncDate("scanned_at"))
+        .values_list("day", flat=True)
+        .distinct()
+    )
+    return days
+
+
+def day_runs(days):
+    """Отсортированные дни -> отрезки (первый, последний) подряд идущих дней."""
+    run = []
+    for day in sorted(days):
+        if run and (
+            day - run[-1] != timedelta(days=1) or len(run) >= DAYS_PER_TRANSACTION
+        ):
+            yield run[0], run[-1]
+            run = []
+        run.append(day)
+    if run:
+        yield run[0], run[-1]
+
+
+def rebuild_days(days) -> int:
+    """Пересобирает DailyScore за указанные дни, возвращает число строк."""
+    rows = 0
+    for first_day, last_day in day_runs(days):
+        start, end = day_bounds(first_day, last_day)
+        with transaction.atomic():
+            DailyScore.objects.filter(day__gte=first_day, day__lte=last_day).delete()
+            created = DailyScore.objects.bulk_create(
+                [
+                    DailyScore(
+                        day=row["day"],
+                        user_id=row["user"],
+                        city_id=row["city"],
+                        source=source,
+                        points=row["points"],
+                        entries=row["entries"],
+                    )
+                    for source, queryset in daily_source_rows(start, end)
+                    for row in queryset
+                ],
+                batch_size=1000,
+            )
+        rows += len(created)
+    return rows
+
+
+def first_score_day():
+    """День самого раннего начисления или None, если начислений нет."""
+    moments = [
+        CourierScore.objects.aggregate(first=Min("created_at"))["first"],
+        WorkDistribution.objects.aggregate(first=Min("scanned_at"))["first"],
+    ]
+    moments = [moment for moment in moments if moment is not None]
+    return timezone.localdate(min(moments)) if moments else None
+
+
+def build_rollups(first_day=None, last_day=None, full=False) -> ScoreRollupBuild:
+    """
+    Без аргументов — инкремент с прошлой сборки (первая сборка — полная).
+    С first_day/last_day — пересборка периода, full — всей таблицы.
+    """
+    started_at = timezone.now()
+    previous = (
+        ScoreRollupBuild.objects.exclude(mode=ScoreRollupBuild.Mode.RANGE)
+        .order_by("-started_at")
+        .first()
+    )
+    if first_day is None and last_day is None and not full and previous is None:
+        full = True
+
+    if full:
+        mode = ScoreRollupBuild.Mode.FULL
+        first_day, last_day = first_score_day(), timezone.localdate()
+        # дни вне периода начислений (удалённые заказы и грузы)
+        stale = DailyScore.objects.all()
+        if first_day is not None:
+            stale = stale.filter(Q(day__lt=first_day) | Q(day__gt=last_day))
+        stale.delete()
+        days = day_range(first_day, last_day) if first_day is not None else []
+    elif first_day is not None or last_day is not None:
+        mode = ScoreRollupBuild.Mode.RANGE
+        first_day = first_day or first_score_day() or timezone.localdate()
+        last_day = last_day or timezone.localdate()
+        days = day_range(first_day, last_day)
+    else:
+        mode = ScoreRollupBuild.Mode.INCREMENTAL
+        days = dirty_days(previous.started_at - WATERMARK_OVERLAP)
+        first_day, last_day = min(days, default=None), max(days, default=None)
+
+    rows = rebuild_days(days)
+    if mode != ScoreRollupBuild.Mode.RANGE:
+        # отметки старше окна следующего инкремента ему уже не нужны
+        StaleScoreDay.objects.filter(
+            marked_at__lt=started_at - WATERMARK_OVERLAP
+        ).delete()
+    return ScoreRollupBuild.objects.create(
+        mode=mode,
+        started_at=started_at,
+        finished_at=timezone.now(),
+        first_day=first_day,
+        last_day=last_day,
+        days=len(days),
+        rows=rows,
+    )
+
+
+def score_totals(first_day, last_day, group_by=("user",), **filters):
+    """
+    Итоги за период из DailyScore, от большего к меньшему: баллы за заказы,
+    за грузы и всего. group_by — поля DailyScore (user, city, day, ...).
+    """
+    return (
+        DailyScore.objects.filter(day__gte=first_day, day__lte=last_day, **filters)
+        .values(*group_by)
+        .annotate(
+            order_points=Sum("points", filter=Q(source=ScoreSource.ORDERS)),
+            cargo_points=Sum("points", filter=Q(source=ScoreSource.CARGO)),
+            points=Sum("points"),
+            entries=Sum("entries"),
+        )
+        .order_by("-points", *group_by)
+    )
@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from app_accounts.models import (
+    CourierScore,
+    add_order_points,
+    mark_stale_days,
+    quantize_points,
+)
+from app_accounts.user_cache import user_cache
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    user_cache.invalidate(instance)
+
+
+# --- Order.points_total -------------------------------------------------
+# Обычные create/save/delete CourierScore меняют итог заказа на разницу.
+# bulk_create обрабатывает CourierScoreQuerySet, а QuerySet.update()
+# сигналов не шлёт — такие расхождения исправляет reconcile_points.
+# Дни удалённых и изменённых баллов отмечаются для сборки DailyScore.
+
+
+@receiver(pre_save, sender=CourierScore)
+def remember_score_before_save(sender, instance, **kwargs):
+    instance.points = quantize_points(instance.points)
+    instance._points_before = None
+    if instance.pk is not None:
+        instance._points_before = (
+            CourierScore.objects.filter(pk=instance.pk)
+            .values("order_id", "points", "created_at")
+            .first()
+        )
+
+
+@receiver(post_save, sender=CourierScore)
+def add_score_to_order(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = {instance.order_id: quantize_points(instance.points)}
+    before = getattr(instance, "_points_before", None)
+    if not created and before is not None:
+        deltas[before["order_id"]] = (
+            deltas.get(before["order_id"], 0) - before["points"]
+        )
+        mark_stale_days([before["created_at"], instance.created_at])
+    add_order_points(deltas)
+
+
+@receiver(post_delete, sender=CourierScore)
+def remove_score_from_order(sender, instance, **kwargs):
+    add_order_points({instance.order_id: -quantize_points(instance.points)})
+    mark_stale_days([instance.created_at])
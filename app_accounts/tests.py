@@ -1,3 +1,210 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Sum
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from app_accounts.models import CourierScore, DailyScore, ScoreRollupBuild, User
+from app_accounts.score_rollups import build_rollups, score_totals
+from app_accounts.user_cache import UserCache
+from app_cargo.models import CargoCostRate, City, WorkDistribution
+from app_cargo.ScanQR import scan_qr
+from app_orders.models import Order
+
+
+def at(day, hour):
+    return timezone.make_aware(datetime.combine(day, time(hour)))
+
+
+class ScoreRollupTest(TestCase):
+    """DailyScore сходится с сырыми CourierScore и WorkDistribution."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name="Алматы")
+        CargoCostRate.objects.create(
+            city=cls.city,
+            cost_per_mass_unit=Decimal("10.00"),
+            cost_per_volume_unit=Decimal("0.00"),
+        )
+        cls.users = [
+            User.objects.create_user(f"worker{i}", city=cls.city) for i in range(3)
+        ]
+        cls.order = Order.objects.create(order_code="A-1")
+
+    def score(self, user, points, when):
+        score = CourierScore.objects.create(user=user, order=self.order, points=points)
+        CourierScore.objects.filter(pk=score.pk).update(created_at=when)
+
+    def scan(self, user, cargo_id, when):
+        scan_qr(user, {"id": cargo_id, "m": 3, "v": 0, "city_from": "Алматы"})
+        WorkDistribution.objects.filter(
+            employee=user, work_unit__cargo__id_external=cargo_id
+        ).update(scanned_at=when)
+
+    def assert_matches_raw(self, first_day, last_day):
+        start, end = at(first_day, 0), at(last_day, 23)
+        for user in self.users:
+            raw = (
+                CourierScore.objects.filter(
+                    user=user, created_at__range=(start, end)
+                ).aggregate(s=Sum("points"))["s"]
+                or 0
+            ) + (
+                WorkDistribution.objects.filter(
+                    employee=user, scanned_at__range=(start, end)
+                ).aggregate(s=Sum("score_share"))["s"]
+                or 0
+            )
+            rolled = {
+                row["user"]: row["points"] for row in score_totals(first_day, last_day)
+            }.get(user.pk, 0)
+            self.assertEqual(rolled, raw, user)
+
+    def test_full_then_incremental(self):
+        day1, day2 = date(2026, 3, 31), date(2026, 4, 1)
+        self.score(self.users[0], Decimal("1.00"), at(day1, 10))
+        self.score(self.users[0], Decimal("2.50"), at(day2, 10))
+        self.score(self.users[1], Decimal("1.00"), at(day2, 23))
+        self.scan(self.users[1], 1, at(day1, 22))
+
+        build = build_rollups()
+        self.assertEqual(build.mode, ScoreRollupBuild.Mode.FULL)
+        self.assert_matches_raw(day1, day2)
+        self.assert_matches_raw(day2, day2)
+
+        # новый участник вчерашней работы меняет долю прежнего за day1
+        ScoreRollupBuild.objects.update(started_at=at(day2, 12))
+        self.scan(self.users[2], 1, timezone.now())
+        build = build_rollups()
+        self.assertEqual(build.mode, ScoreRollupBuild.Mode.INCREMENTAL)
+        self.assertIn(day1, (build.first_day, build.last_day))
+        self.assert_matches_raw(day1, timezone.localdate())
+        self.assertEqual(
+            DailyScore.objects.get(user=self.users[1], day=day1).points,
+            Decimal("15.00"),
+        )
+
+        # повторная сборка того же периода ничего не удваивает
+        build_rollups(first_day=day1, last_day=timezone.localdate())
+        self.assert_matches_raw(day1, timezone.localdate())
+
+    def test_deleted_and_edited_scores_rebuild_their_day(self):
+        day1, day2 = date(2026, 3, 30), date(2026, 3, 31)
+        self.score(self.users[0], Decimal("1.00"), at(day1, 10))
+        self.score(self.users[1], Decimal("2.00"), at(day2, 10))
+        build_rollups()
+        ScoreRollupBuild.objects.update(started_at=at(day2, 12))
+
+        CourierScore.objects.get(user=self.users[0]).delete()
+        edited = CourierScore.objects.get(user=self.users[1])
+        edited.points = Decimal("3.00")
+        edited.save()
+        build = build_rollups()
+
+        self.assertEqual(build.mode, ScoreRollupBuild.Mode.INCREMENTAL)
+        self.assertEqual((build.first_day, build.last_day), (day1, day2))
+        self.assertFalse(DailyScore.objects.filter(day=day1).exists())
+        self.assertEqual(DailyScore.objects.get(day=day2).points, Decimal("3.00"))
+        self.assert_matches_raw(day1, day2)
+
+    def test_report_and_admin(self):
+        day = date(2026, 4, 1)
+        self.score(self.users[0], Decimal("4.00"), at(day, 9))
+        self.scan(self.users[1], 7, at(day, 9))
+        call_command("build_score_rollups", stdout=StringIO())
+
+        out = StringIO()
+        call_command(
+            "score_report", "--from", "2026-04-01", "--to", "2026-04-30", stdout=out
+        )
+        lines = out.getvalue().splitlines()
+        self.assertIn("worker1", lines[1])
+        # два знака при любом бэкенде, пустой источник — 0.00
+        self.assertEqual(lines[1].split()[2:], ["0.00", "30.00", "30.00"])
+        self.assertIn("worker0", lines[2])
+
+        admin = User.objects.create_superuser("admin", password="x")
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse("admin:app_accounts_dailyscore_changelist"),
+            {"day__gte": "2026-04-01", "day__lte": "2026-04-30"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["total_points"], Decimal("34.00"))
+        self.assertEqual(
+            [row["user__username"] for row in response.context["leaderboard"]],
+            ["worker1", "worker0"],
+        )
+
+
+class UserCacheTest(TestCase):
+    """В кэш попадают только закоммиченные пользователи."""
+
+    def setUp(self):
+        self.cache = UserCache()
+
+    def test_rolled_back_user_is_not_cached(self):
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic():
+                user = User.objects.create_user("ghost", chat_id=42)
+                self.assertEqual(self.cache.get_by_chat_id(42), user)
+                1 / 0
+        self.assertEqual(self.cache.stats()["size"], 0)
+        self.assertIsNone(self.cache.get_by_chat_id(42))
+
+    def test_committed_user_is_cached(self):
+        user = User.objects.create_user(
+            "courier", chat_id=7, phone_number="87010000007"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.cache.get_by_phone("+77010000007"), user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get_by_phone("87010000007"), user)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+        # сигнал post_save сбрасывает глобальный кэш, а не этот экземпляр
+        self.cache.invalidate(user)
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+
+class PointsTotalTest(TestCase):
+    """Order.points_total совпадает с суммой сохранённых CourierScore.points."""
+
+    def setUp(self):
+        self.order = Order.objects.create(order_code="THIRDS")
+        self.users = [User.objects.create_user(f"packer{n}") for n in range(3)]
+
+    def assert_total_matches(self):
+        self.order.refresh_from_db()
+        stored = CourierScore.objects.filter(order=self.order).aggregate(
+            total=Sum("points")
+        )["total"] or Decimal("0.00")
+        self.assertEqual(self.order.points_total, stored)
+
+    def test_shares_of_three(self):
+        third = Decimal(1) / Decimal(3)
+        scores = CourierScore.objects.bulk_create(
+            [CourierScore(user=u, order=self.order, points=third) for u in self.users]
+        )
+        self.assert_total_matches()
+        self.assertEqual(self.order.points_total, Decimal("0.99"))
+
+        single = CourierScore.objects.create(
+            user=self.users[0], order=self.order, points=Decimal(2) / Decimal(3)
+        )
+        self.assert_total_matches()
+
+        single.points = Decimal("0.125")  # половина округляется вверх, как в Postgres
+        single.save()
+        self.assert_total_matches()
 
-# Create your tests here.
+        for score in scores + [single]:
+            score.delete()
+            self.assert_total_matches()
+        self.assertEqual(self.order.points_total, Decimal("0.00"))
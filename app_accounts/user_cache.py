@@ -0,0 +1,144 @@
+"""
+Кэш пользователей для консьюмеров: поиск по chat_id, email и телефону.
+
+Держит в памяти процесса последние найденные User (LRU + TTL),
+сбрасывается сигналами post_save/post_delete модели User
+(см. app_accounts.signals). Сигналы работают только внутри процесса,
+поэтому изменения из админки другие процессы увидят не позже TTL.
+
+Найденное внутри транзакции попадает в кэш только после её коммита:
+пользователь, созданный в откатившейся пачке consume_orders, в БД
+не существует, и ссылка на него из кэша ломала бы следующие записи.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+
+def normalize_phone(phone) -> str:
+    """Оставляет только цифры, казахстанскую «8» в начале меняет на «7»."""
+    digits = re.sub(r"\D", "", str(phone or ""))
+    if len(digits) == 11 and digits.startswith("8"):
+        digits = "7" + digits[1:]
+    return digits
+
+
+class UserCache:
+    def __init__(self, maxsize: int = 2048, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, user)
+        self._keys_by_pk = {}  # user.pk -> set(key), для инвалидации
+
+    # --- публичный API ---------------------------------------------------
+
+    def get_by_chat_id(self, chat_id):
+        if chat_id in (None, ""):
+            return None
+        return self._lookup(("chat_id", int(chat_id)), chat_id=chat_id)
+
+    def get_by_email(self, email):
+        if not email:
+            return None
+        return self._lookup(
+            ("email", email.strip().lower()), email__iexact=email.strip()
+        )
+
+    def get_by_phone(self, phone):
+        normalized = normalize_phone(phone)
+        if not normalized:
+            return None
+        # в базе телефоны лежат как придётся: 7701..., +7701..., 8701...
+        variants = {str(phone).strip(), normalized, f"+{normalized}"}
+        if len(normalized) == 11 and normalized.startswith("7"):
+            variants.add("8" + normalized[1:])
+        return self._lookup(("phone", normalized), phone_number__in=variants)
+
+    def invalidate(self, user):
+        """Убирает из кэша все ключи, которые указывают на user."""
+        with self._lock:
+            for key in self._keys_by_pk.pop(user.pk, set()):
+                self._entries.pop(key, None)
+            # новые значения полей тоже могли быть закэшированы за другим pk
+            for key in self._keys_for(user):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_pk.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._entries),
+        }
+
+    # --- внутреннее -----------------------------------------------------
+
+    @staticmethod
+    def _keys_for(user):
+        keys = []
+        if user.chat_id is not None:
+            keys.append(("chat_id", int(user.chat_id)))
+        if user.email:
+            keys.append(("email", user.email.strip().lower()))
+        if normalize_phone(user.phone_number):
+            keys.append(("phone", normalize_phone(user.phone_number)))
+        return keys
+
+    def _lookup(self, key, **filters):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+
+        # промахи не кэшируем: пользователя могут завести/привязать в любой момент
+        user = get_user_model().objects.filter(**filters).first()
+        if user is not None:
+            # вне atomic выполнится сразу, при откате — не выполнится вовсе
+            transaction.on_commit(partial(self._remember, key, user, now + self.ttl))
+        return user
+
+    def _remember(self, key, user, expires_at):
+        with self._lock:
+            self._store(key, user, expires_at)
+
+    def _store(self, key, user, expires_at):
+        self._drop(key)
+        self._entries[key] = (expires_at, user)
+        self._keys_by_pk.setdefault(user.pk, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._keys_by_pk.get(entry[1].pk)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_pk[entry[1].pk]
+
+
+user_cache = UserCache()
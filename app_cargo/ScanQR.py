@@ -1,5 +1,15 @@
 from decimal import Decimal
 
+from django.db import transaction
+from django.db.models import (
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    OuterRef,
+    Subquery,
+    Value,
+)
+
 from app_accounts.models import User
 
 from app_cargo.models import (
@@ -8,14 +18,13 @@ from app_cargo.models import (
     City,
     WorkUnit,
     WorkDistribution,
-    CargoCostRate,
 )
+from app_cargo.registry import cargo_registry
 
 
 def calculate_score(city: City, mass: float, volume: float) -> Decimal:
-    try:
-        rate = CargoCostRate.objects.get(city=city)
-    except CargoCostRate.DoesNotExist:
+    rate = cargo_registry.rate_for(city)
+    if rate is None:
         raise ValueError(f"Для города '{city.name}' не найдены тарифы CargoCostRate")
 
     mass_score = Decimal(mass) * rate.cost_per_mass_unit
@@ -23,65 +32,80 @@ def calculate_score(city: City, mass: float, volume: float) -> Decimal:
     return mass_score + volume_score
 
 
-def scan_qr(employee: User, qr_data: dict):
+def scan_qr(employee: User, qr_data: dict) -> bool:
+    """
+    Учитывает скан QR груза сотрудником и делит баллы работы поровну
+    между всеми участниками. False — сотрудник уже был учтён.
+    """
     mass = qr_data.get("m", 0)
     volume = qr_data.get("v", 0)
     id_external = qr_data["id"]
 
-    # Определение города сканирования
-    employee_city = employee.city
+    # Города — из справочника в памяти (app_cargo.registry), без запросов
+    employee_city = cargo_registry.city(employee.city_id)
 
     city_from = qr_data.get("city_from")
     city_to = qr_data.get("city_to")
+    from_city = cargo_registry.city_by_name(city_from)
+    to_city = cargo_registry.city_by_name(city_to)
 
     # Определение, работа это погрузка или разгрузка
-    if city_from and city_from == employee_city.name:
+    if employee_city is not None and from_city == employee_city:
         work_type = WorkType.LOAD
-    elif city_to and city_to == employee_city.name:
+    elif employee_city is not None and to_city == employee_city:
         work_type = WorkType.UNLOAD
-    elif city_from and city_from == employee_city.name:
-        work_type = WorkType.LOAD
     else:
         raise ValueError(
             f"Сотрудник {employee!r} из {employee_city!r} не задействован в маршруте {city_from or '—'} → {city_to or '—'}"
         )
 
-    # Создаём груз, если ещё не существует
-    cargo, _ = Cargo.objects.get_or_create(
-        id_external=id_external,
-        defaults={
-            "mass": mass,
-            "volume": volume,
-            "city_from": City.objects.filter(name=city_from).first(),
-            "city_to": City.objects.filter(name=city_to).first(),
-        },
-    )
-
-    # Ищем или создаём WorkUnit
-    work_unit, created = WorkUnit.objects.get_or_create(
-        cargo=cargo,
-        city=employee_city,
-        work_type=work_type,
-        defaults={
-            "mass_units": mass,
-            "volume_units": volume,
-            "total_score": calculate_score(employee_city, mass, volume),
-        },
-    )
-
-    # Проверяем — участвовал ли сотрудник
-    if WorkDistribution.objects.filter(work_unit=work_unit, employee=employee).exists():
-        return  # ничего не меняем, он уже учтён
-
-    # Добавляем нового участника
-    WorkDistribution.objects.create(
-        work_unit=work_unit, employee=employee, score_share=0
-    )
+    # Всё сканирование — одна транзакция, а строка WorkUnit заблокирована
+    # до её конца: параллельные сканы одного груза идут по очереди и
+    # всегда видят полный список участников.
+    with transaction.atomic():
+        # Создаём груз, если ещё не существует
+        cargo, _ = Cargo.objects.get_or_create(
+            id_external=id_external,
+            defaults={
+                "mass": mass,
+                "volume": volume,
+                "city_from": from_city,
+                "city_to": to_city,
+            },
+        )
 
-    # Перерасчёт долей
-    participants = work_unit.distributions.all()
-    new_share = work_unit.total_score / participants.count()
+        # Ищем или создаём WorkUnit; тариф считаем только при создании
+        work_unit, _ = WorkUnit.objects.select_for_update().get_or_create(
+            cargo=cargo,
+            city=employee_city,
+            work_type=work_type,
+            defaults={
+                "mass_units": mass,
+                "volume_units": volume,
+                "total_score": lambda: calculate_score(employee_city, mass, volume),
+            },
+        )
 
-    for dist in participants:
-        dist.score_share = new_share
-        dist.save()
+        # Добавляем нового участника; если он уже учтён — ничего не меняем
+        _, created = WorkDistribution.objects.get_or_create(
+            work_unit=work_unit, employee=employee, defaults={"score_share": 0}
+        )
+        if not created:
+            return False
+
+        # Перерасчёт долей одним UPDATE:
+        # score_share = total_score / (число участников)
+        participants = (
+            WorkDistribution.objects.filter(work_unit=OuterRef("work_unit"))
+            .order_by()
+            .values("work_unit")
+            .annotate(n=Count("*"))
+            .values("n")
+        )
+        WorkDistribution.objects.filter(work_unit=work_unit).update(
+            score_share=ExpressionWrapper(
+                Value(work_unit.total_score) / Subquery(participants),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            )
+        )
+    return True
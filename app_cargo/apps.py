@@ -5,3 +5,6 @@ class AppCargoConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "app_cargo"
     # verbose_name = ""
+
+    def ready(self):
+        from app_cargo import signals  # noqa: F401
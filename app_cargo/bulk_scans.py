@@ -0,0 +1,279 @@
+"""
+Пакетный импорт сканов QR, накопленных терминалом склада без связи.
+
+Вместо scan_qr на каждый скан:
+  • сотрудники ищутся одним запросом, города и тарифы — из cargo_registry;
+  • по пачке один раз читаются существующие Cargo, WorkUnit (под
+    select_for_update, как в scan_qr) и их участники;
+  • сканы «проигрываются» по порядку в памяти, после чего новые строки
+    пишутся bulk_create, а доли всех затронутых работ пересчитываются
+    одним UPDATE.
+Итог совпадает с последовательной обработкой тех же сообщений
+work_qr_queue: скан, на котором scan_qr упал бы, пропускается целиком.
+"""
+
+import json
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    OuterRef,
+    Subquery,
+)
+
+from app_cargo.models import Cargo, WorkDistribution, WorkType, WorkUnit
+from app_cargo.registry import cargo_registry
+from app_cargo.ScanQR import calculate_score
+
+User = get_user_model()
+
+# столько сканов обрабатываем в одной транзакции
+SCAN_BATCH_SIZE = 1000
+
+
+@dataclass
+class ScanImportSummary:
+    scans: int = 0
+    applied: int = 0  # сотрудник добавлен к работе
+    repeated: int = 0  # сотрудник уже был учтён
+    skipped: int = 0  # не операция «work»
+    cargos_created: int = 0
+    work_units_created: int = 0
+    # (номер скана, текст ошибки)
+    errors: list = field(default_factory=list)
+
+    def merge(self, other: "ScanImportSummary"):
+        for name in (
+            "applied",
+            "repeated",
+            "skipped",
+            "cargos_created",
+            "work_units_created",
+        ):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.errors.extend(other.errors)
+
+    def __str__(self):
+        return (
+            f"scans {self.scans}: applied {self.applied}, "
+            f"repeated {self.repeated}, skipped {self.skipped}, "
+            f"errors {len(self.errors)}; created cargos {self.cargos_created}, "
+            f"work units {self.work_units_created}"
+        )
+
+
+def read_scans(lines):
+    """Сканы из JSON-массива или из JSON Lines (по сообщению на строку)."""
+    lines = iter(lines)
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith("["):
+            rest = "".join(
+                l.decode("utf-8") if isinstance(l, bytes) else l for l in lines
+            )
+            yield from json.loads(line + rest)
+            return
+        yield json.loads(stripped)
+
+
+def import_scans(scans, batch_size: int = SCAN_BATCH_SIZE) -> ScanImportSummary:
+    """Применяет сканы (сообщения work_qr_queue) пачками по batch_size."""
+    summary = ScanImportSummary()
+    batch = []
+    for scan in scans:
+        batch.append((summary.scans, scan))
+        summary.scans += 1
+        if len(batch) >= batch_size:
+            summary.merge(_import_batch(batch))
+            batch = []
+    if batch:
+        summary.merge(_import_batch(batch))
+    return summary
+
+
+def _import_batch(batch) -> ScanImportSummary:
+    employees = _resolve_employees(batch)
+    for attempt in range(2):
+        try:
+            return _apply_batch(batch, employees)
+        except IntegrityError:
+            # тот же груз только что создал живой scan_qr — перечитываем
+            if attempt:
+                raise
+
+
+def _resolve_employees(batch):
+    chat_ids = set()
+    for _, scan in batch:
+        try:
+            chat_ids.add(int(scan.get("userId")))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    employees = {}
+    # как user_cache.get_by_chat_id: при дублях chat_id — первый по pk
+    for user in User.objects.filter(chat_id__in=chat_ids).order_by("-pk"):
+        employees[user.chat_id] = user
+    return employees
+
+
+def _plan_scan(scan, employees):
+    """То же, что scan_qr до транзакции: сотрудник, тип работы, ключ работы."""
+    employee = employees.get(int(scan.get("userId")))
+    if employee is None:
+        raise User.DoesNotExist(scan.get("userId"))
+    qr_data = scan["qrData"]
+    employee_city = cargo_registry.city(employee.city_id)
+    city_from = qr_data.get("city_from")
+    city_to = qr_data.get("city_to")
+    from_city = cargo_registry.city_by_name(city_from)
+    to_city = cargo_registry.city_by_name(city_to)
+
+    if employee_city is not None and from_city == employee_city:
+        work_type = WorkType.LOAD
+    elif employee_city is not None and to_city == employee_city:
+        work_type = WorkType.UNLOAD
+    else:
+        raise ValueError(
+            f"Сотрудник {employee!r} из {employee_city!r} не задействован в маршруте {city_from or '—'} → {city_to or '—'}"
+        )
+    return {
+        "employee": employee,
+        "id_external": qr_data["id"],
+        "mass": qr_data.get("m", 0),
+        "volume": qr_data.get("v", 0),
+        "city": employee_city,
+        "city_from": from_city,
+        "city_to": to_city,
+        "work_type": work_type,
+    }
+
+
+def _apply_batch(batch, employees) -> ScanImportSummary:
+    summary = ScanImportSummary()
+    plans = []
+    for index, scan in batch:
+        if scan.get("operation") != "work":
+            summary.skipped += 1
+            continue
+        try:
+            plans.append((index, _plan_scan(scan, employees)))
+        except Exception as e:
+            summary.errors.append((index, f"{type(e).__name__}: {e}"))
+
+    with transaction.atomic():
+        cargos = {
+            cargo.id_external: cargo
+            for cargo in Cargo.objects.filter(
+                id_external__in={plan["id_external"] for _, plan in plans}
+            )
+        }
+        # те же блокировки, что берёт scan_qr, в одном порядке — без дедлоков
+        work_units = {
+            (wu.cargo_id, wu.city_id, wu.work_type): wu
+            for wu in WorkUnit.objects.select_for_update()
+            .filter(cargo__in=cargos.values())
+            .order_by("pk")
+        }
+        participants = set(
+            WorkDistribution.objects.filter(
+                work_unit__in=work_units.values()
+            ).values_list("work_unit_id", "employee_id")
+        )
+
+        # Проигрываем сканы по порядку. Новые Cargo/WorkUnit — объекты без pk,
+        # ключ работы для них — (id_external, город, тип).
+        new_cargos, new_work_units = {}, {}
+        new_participants = []  # (WorkUnit, id сотрудника)
+        seen = set()
+        for index, plan in plans:
+            cargo = cargos.get(plan["id_external"]) or new_cargos.get(
+                plan["id_external"]
+            )
+            wu_key = (plan["id_external"], plan["city"].pk, plan["work_type"])
+            work_unit = new_work_units.get(wu_key)
+            if work_unit is None and cargo is not None and cargo.pk is not None:
+                work_unit = work_units.get(
+                    (cargo.pk, plan["city"].pk, plan["work_type"])
+                )
+            if work_unit is None:
+                try:
+                    total_score = calculate_score(
+                        plan["city"], plan["mass"], plan["volume"]
+                    )
+                except ValueError as e:
+                    # scan_qr откатил бы и создание груза
+                    summary.errors.append((index, f"ValueError: {e}"))
+                    continue
+                if cargo is None:
+                    cargo = new_cargos[plan["id_external"]] = Cargo(
+                        id_external=plan["id_external"],
+                        mass=plan["mass"],
+                        volume=plan["volume"],
+                        city_from=plan["city_from"],
+                        city_to=plan["city_to"],
+                    )
+                work_unit = new_work_units[wu_key] = WorkUnit(
+                    cargo=cargo,
+                    city=plan["city"],
+                    work_type=plan["work_type"],
+                    mass_units=plan["mass"],
+                    volume_units=plan["volume"],
+                    total_score=total_score,
+                )
+
+            employee_id = plan["employee"].pk
+            if (wu_key, employee_id) in seen or (
+                work_unit.pk,
+                employee_id,
+            ) in participants:
+                summary.repeated += 1
+                continue
+            seen.add((wu_key, employee_id))
+            new_participants.append((work_unit, employee_id))
+            summary.applied += 1
+
+        # cargo_id у новых WorkUnit bulk_create возьмёт из уже вставленных Cargo
+        Cargo.objects.bulk_create(new_cargos.values())
+        WorkUnit.objects.bulk_create(new_work_units.values())
+        WorkDistribution.objects.bulk_create(
+            [
+                WorkDistribution(
+                    work_unit=work_unit,
+                    employee_id=employee_id,
+                    score_share=Decimal("0"),
+                )
+                for work_unit, employee_id in new_participants
+            ]
+        )
+        summary.cargos_created += len(new_cargos)
+        summary.work_units_created += len(new_work_units)
+
+        # доли всех затронутых работ — одним UPDATE, как в scan_qr
+        touched = {work_unit.pk for work_unit, _ in new_participants}
+        if touched:
+            count = (
+                WorkDistribution.objects.filter(work_unit=OuterRef("work_unit"))
+                .order_by()
+                .values("work_unit")
+                .annotate(n=Count("*"))
+                .values("n")
+            )
+            total = WorkUnit.objects.filter(pk=OuterRef("work_unit")).values(
+                "total_score"
+            )
+            WorkDistribution.objects.filter(work_unit__in=touched).update(
+                score_share=ExpressionWrapper(
+                    Subquery(total) / Subquery(count),
+                    output_field=DecimalField(max_digits=10, decimal_places=2),
+                )
+            )
+    return summary
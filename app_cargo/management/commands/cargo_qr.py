@@ -1,8 +1,13 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import pika
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections
 
 from app_accounts.models import User
+from app_accounts.user_cache import user_cache
 from app_cargo.ScanQR import scan_qr
 
 # --- Настройки RabbitMQ ---
@@ -24,57 +29,167 @@ RABBIT_PARAMS = pika.ConnectionParameters(
 )
 
 
+def process_work_scan(data: dict):
+    """
+    Обрабатывает одно сообщение work_qr_queue.
+    Возвращает (employee, qr_data) или None, если операция не «work».
+    Неизвестный сотрудник — User.DoesNotExist.
+    """
+    if data.get("operation") != "work":
+        return None
+
+    user_id = data.get("userId")
+    employee = user_cache.get_by_chat_id(user_id)
+    if employee is None:
+        raise User.DoesNotExist(user_id)
+
+    qr_data = data.get("qrData")  # ✅ Уже dict
+
+    scan_qr(employee, qr_data)
+    return employee, qr_data
+
+
+def scan_cargo_id(data):
+    """qrData.id разобранного сообщения; None, если его нет."""
+    qr_data = data.get("qrData") if isinstance(data, dict) else None
+    return qr_data.get("id") if isinstance(qr_data, dict) else None
+
+
+def cargo_key(body: bytes):
+    """qrData.id сообщения; None, если его не достать (битый JSON и т.п.)."""
+    try:
+        return scan_cargo_id(json.loads(body))
+    except ValueError:
+        return None
+
+
+class CargoLanes:
+    """
+    Пул из N однопоточных исполнителей. Сканы одного груза всегда попадают
+    в один и тот же поток и выполняются по порядку получения, сканы разных
+    грузов — параллельно.
+    """
+
+    def __init__(self, workers: int):
+        self.lanes = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"cargo_qr-{i}")
+            for i in range(workers)
+        ]
+
+    def submit(self, key, fn, *args):
+        lane = self.lanes[hash(str(key)) % len(self.lanes)]
+        return lane.submit(fn, *args)
+
+    def shutdown(self, wait: bool = True):
+        for lane in self.lanes:
+            lane.shutdown(wait=wait)
+
+
 class Command(BaseCommand):
     help = "Запускает потребителя RabbitMQ для обработки QR-сканирований"
 
-    def handle(self, *args, **kwargs):
-        self.stdout.write(self.style.SUCCESS(f"🟢 Подключение к очереди: {QUEUE_NAME}"))
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help=(
+                "Threads processing scans; scans of one cargo always go to the "
+                "same thread (default: 1, i.e. strictly sequential)"
+            ),
+        )
+        parser.add_argument(
+            "--prefetch",
+            type=int,
+            default=None,
+            help="Unacked messages to hold (default: 1, or 4 per worker)",
+        )
+
+    def handle(self, *args, **options):
+        workers = max(options["workers"], 1)
+        prefetch = options["prefetch"] or (1 if workers == 1 else 4 * workers)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"🟢 Подключение к очереди: {QUEUE_NAME} "
+                f"(workers={workers}, prefetch={prefetch})"
+            )
+        )
+        self.lanes = CargoLanes(workers) if workers > 1 else None
+        connection = None
         try:
             connection = pika.BlockingConnection(RABBIT_PARAMS)
             channel = connection.channel()
             channel.queue_declare(queue=QUEUE_NAME, durable=True)
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue=QUEUE_NAME, on_message_callback=self.callback)
+            channel.basic_qos(prefetch_count=prefetch)
+            on_message = self.callback
+            if self.lanes is not None:
+                on_message = partial(self.dispatch, connection)
+            channel.basic_consume(queue=QUEUE_NAME, on_message_callback=on_message)
             channel.start_consuming()
         except KeyboardInterrupt:
             self.stdout.write(self.style.WARNING("🛑 Остановлено вручную"))
         except Exception as e:
             self.stderr.write(f"❌ Ошибка подключения: {str(e)}")
+        finally:
+            if self.lanes is not None:
+                # дорабатываем принятые сообщения и отправляем их ack
+                self.lanes.shutdown(wait=True)
+                if connection is not None and connection.is_open:
+                    connection.process_data_events(time_limit=0)
+            if connection is not None and connection.is_open:
+                connection.close()
 
     def callback(self, ch, method, properties, body):
+        self.process(body)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def dispatch(self, connection, ch, method, properties, body):
+        """Отдаёт сообщение в поток его груза; ack — после коммита scan_qr."""
+        self.lanes.submit(
+            cargo_key(body), self.process_in_lane, connection, ch, method, body
+        )
+
+    def process_in_lane(self, connection, ch, method, body):
+        close_old_connections()
+        try:
+            self.process(body)
+        finally:
+            close_old_connections()
+        # pika не потокобезопасна: ack выполнит поток соединения
+        ack = partial(ch.basic_ack, delivery_tag=method.delivery_tag)
+        try:
+            connection.add_callback_threadsafe(ack)
+        except Exception as e:
+            # соединение закрыто — брокер вернёт сообщение, повторный скан
+            # scan_qr не засчитает
+            self.stderr.write(f"❌ Не удалось подтвердить сообщение: {str(e)}")
+
+    def process(self, body):
+        data = {}
         try:
             raw = body.decode("utf-8")
             data = json.loads(raw)
 
-            if data.get("operation") != "work":
+            result = process_work_scan(data)
+            if result is None:
                 self.stdout.write(
                     self.style.WARNING("⛔ Пропущено: неизвестная операция")
                 )
-                ch.basic_ack(delivery_tag=method.delivery_tag)
                 return
 
-            user_id = data.get("userId")
-            employee = User.objects.get(chat_id=user_id)
-
-            qr_data = data.get("qrData")  # ✅ Уже dict
-
-            scan_qr(employee, qr_data)
-
+            employee, qr_data = result
             self.stdout.write(
                 self.style.SUCCESS(
                     f"✅ Обработан QR: {qr_data.get('id')} для {employee.username}"
                 )
             )
-            ch.basic_ack(delivery_tag=method.delivery_tag)
 
         except User.DoesNotExist:
             self.stderr.write(f"❌ Неизвестный пользователь: {data.get('userId')}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
 
         except json.JSONDecodeError as e:
             self.stderr.write(f"❌ Неверный формат JSON: {str(e)}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
 
         except Exception as e:
             self.stderr.write(f"❌ Ошибка обработки: {str(e)}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from app_cargo.bulk_scans import SCAN_BATCH_SIZE, import_scans, read_scans
+
+
+class Command(BaseCommand):
+    help = (
+        "Импортирует сканы QR, накопленные терминалом без связи: файл с "
+        "сообщениями work_qr_queue (JSON-массив или JSON Lines)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File with scans, '-' for stdin")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=SCAN_BATCH_SIZE,
+            help=f"Scans per transaction (default: {SCAN_BATCH_SIZE})",
+        )
+
+    def handle(self, *args, **options):
+        if options["path"] == "-":
+            summary = import_scans(read_scans(sys.stdin), options["batch_size"])
+        else:
+            with open(options["path"], encoding="utf-8") as fh:
+                summary = import_scans(read_scans(fh), options["batch_size"])
+
+        for index, error in summary.errors:
+            self.stderr.write(f" [!] scan #{index}: {error}")
+        self.stdout.write(self.style.SUCCESS(f" [√] {summary}"))
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_cargo", "0008_alter_city_options_alter_city_name"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="workdistribution",
+            index=models.Index(fields=["scanned_at"], name="workdist_scanned_at_idx"),
+        ),
+    ]
@@ -174,6 +174,10 @@ class WorkDistribution(models.Model):
 
     class Meta:
         unique_together = ("work_unit", "employee")
+        indexes = [
+            # build_score_rollups читает баллы по дням
+            models.Index(fields=["scanned_at"], name="workdist_scanned_at_idx"),
+        ]
         verbose_name = "Распределение работы и баллов сотрудника"
         verbose_name_plural = "Распределение работ и баллы сотрудников"
 
@@ -0,0 +1,73 @@
+"""
+Справочник городов и тарифов для подсчёта баллов за грузы.
+
+City и CargoCostRate меняются несколько раз в год, а читаются на каждом
+скане QR. Обе таблицы целиком загружаются в память процесса при первом
+обращении и перечитываются после post_save/post_delete этих моделей
+(см. app_cargo.signals). Сигналы работают только внутри процесса,
+поэтому правки из админки другие процессы увидят не позже TTL.
+"""
+
+import threading
+import time
+
+from app_cargo.models import CargoCostRate, City
+
+
+def normalize_city_name(name) -> str:
+    """« алматы  » и «Алматы» — один город."""
+    return " ".join(str(name or "").split()).casefold()
+
+
+class CargoRegistry:
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self.loads = 0
+
+        self._lock = threading.Lock()
+        self._expires_at = 0.0
+        self._cities = {}  # pk -> City
+        self._cities_by_name = {}  # нормализованное имя -> City
+        self._rates = {}  # city_id -> CargoCostRate
+
+    def city(self, city_id):
+        if city_id is None:
+            return None
+        return self._snapshot()[0].get(city_id)
+
+    def city_by_name(self, name):
+        if not name:
+            return None
+        return self._snapshot()[1].get(normalize_city_name(name))
+
+    def rate_for(self, city):
+        if city is None:
+            return None
+        return self._snapshot()[2].get(city.pk)
+
+    def invalidate(self):
+        with self._lock:
+            self._expires_at = 0.0
+
+    def _snapshot(self):
+        with self._lock:
+            if time.monotonic() >= self._expires_at:
+                self._load()
+            return self._cities, self._cities_by_name, self._rates
+
+    def _load(self):
+        cities = {city.pk: city for city in City.objects.all()}
+        # словари заменяются целиком: уже выданный снимок не меняется
+        self._cities = cities
+        self._cities_by_name = {
+            normalize_city_name(city.name): city for city in cities.values()
+        }
+        self._rates = {
+            rate.city_id: rate
+            for rate in CargoCostRate.objects.filter(city__isnull=False)
+        }
+        self._expires_at = time.monotonic() + self.ttl
+        self.loads += 1
+
+
+cargo_registry = CargoRegistry()
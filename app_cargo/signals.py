@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from app_cargo.models import CargoCostRate, City
+from app_cargo.registry import cargo_registry
+
+
+@receiver([post_save, post_delete], sender=City)
+@receiver([post_save, post_delete], sender=CargoCostRate)
+def invalidate_cargo_registry(sender, **kwargs):
+    cargo_registry.invalidate()
+    # до коммита другой поток мог успеть перечитать старые данные
+    transaction.on_commit(cargo_registry.invalidate)
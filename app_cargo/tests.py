@@ -1,3 +1,291 @@
-from django.test import TestCase
+import json
+import random
+import threading
+import time
+from decimal import Decimal
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from app_accounts.user_cache import user_cache
+from app_cargo.bulk_scans import import_scans
+from app_cargo.management.commands.cargo_qr import (
+    CargoLanes,
+    Command,
+    process_work_scan,
+)
+from app_cargo.models import Cargo, CargoCostRate, City, WorkDistribution, WorkUnit
+from app_cargo.registry import cargo_registry
+from app_cargo.ScanQR import calculate_score, scan_qr
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ScanQRConcurrencyTest(TransactionTestCase):
+    """Параллельные сканы одного груза не теряют участников и доли."""
+
+    workers = 8
+
+    def setUp(self):
+        User = get_user_model()
+        self.city = City.objects.create(name="Алматы")
+        CargoCostRate.objects.create(
+            city=self.city,
+            cost_per_mass_unit=Decimal("10.00"),
+            cost_per_volume_unit=Decimal("5.00"),
+        )
+        self.employees = [
+            User.objects.create_user(f"loader{i}", city=self.city)
+            for i in range(self.workers)
+        ]
+        # груз 2 т и 3 м³: 2 * 10 + 3 * 5 = 35 баллов
+        self.qr_data = {"id": 1001, "m": 2, "v": 3, "city_from": "Алматы"}
+
+    def scan_in_parallel(self, employees):
+        barrier = threading.Barrier(len(employees))
+        errors = []
+
+        def scan(employee):
+            try:
+                barrier.wait()
+                scan_qr(employee, self.qr_data)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=scan, args=(e,)) for e in employees]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_parallel_scans_of_same_cargo(self):
+        self.scan_in_parallel(self.employees)
+
+        work_unit = WorkUnit.objects.get()
+        self.assertEqual(work_unit.total_score, Decimal("35.00"))
+        shares = list(
+            WorkDistribution.objects.filter(work_unit=work_unit).values_list(
+                "score_share", flat=True
+            )
+        )
+        self.assertEqual(len(shares), self.workers)
+        # 35 / 8 = 4.375 -> 4.38 у всех, без «старых» долей
+        self.assertEqual(set(shares), {Decimal("4.38")})
+
+    def test_repeated_scans_by_same_employee(self):
+        self.scan_in_parallel(self.employees[:2] * 4)
+
+        shares = WorkDistribution.objects.values_list("score_share", flat=True)
+        self.assertEqual(sorted(shares), [Decimal("17.50"), Decimal("17.50")])
+        self.assertFalse(scan_qr(self.employees[0], self.qr_data))
+
+
+class CargoRegistryTest(TestCase):
+    """Города и тарифы читаются из памяти, а не на каждом скане."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.almaty = City.objects.create(name="Алматы")
+        cls.astana = City.objects.create(name="Астана")
+        cls.rate = CargoCostRate.objects.create(
+            city=cls.almaty,
+            cost_per_mass_unit=Decimal("10.00"),
+            cost_per_volume_unit=Decimal("5.00"),
+        )
+        cls.employees = [
+            User.objects.create_user(f"loader{i}", city=cls.almaty) for i in range(2)
+        ]
+
+    def setUp(self):
+        cargo_registry.invalidate()
+
+    def test_names_are_normalized(self):
+        self.assertEqual(cargo_registry.city_by_name("  алматы "), self.almaty)
+        self.assertEqual(cargo_registry.city_by_name("АСТАНА"), self.astana)
+        self.assertIsNone(cargo_registry.city_by_name("Шымкент"))
+
+    def test_scan_does_not_query_cities_or_rates(self):
+        scan_qr(self.employees[0], {"id": 1, "m": 1, "v": 1, "city_from": "Алматы"})
+        qr_data = {"id": 2, "m": 1, "v": 1, "city_from": "алматы", "city_to": "Астана"}
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(scan_qr(self.employees[1], qr_data))
+        tables = " ".join(query["sql"] for query in ctx.captured_queries)
+        self.assertNotIn('FROM "app_cargo_city"', tables)
+        self.assertNotIn('FROM "app_cargo_cargocostrate"', tables)
+        self.assertEqual(WorkUnit.objects.get(cargo__id_external=2).city, self.almaty)
+
+    def test_refreshed_after_save(self):
+        self.assertEqual(calculate_score(self.almaty, 1, 0), Decimal("10.00"))
+        self.rate.cost_per_mass_unit = Decimal("20.00")
+        self.rate.save()
+        self.assertEqual(calculate_score(self.almaty, 1, 0), Decimal("20.00"))
+
+        City.objects.filter(pk=self.astana.pk).update(name="Нур-Султан")
+        self.assertEqual(cargo_registry.city_by_name("Астана"), self.astana)
+        self.astana.name = "Нур-Султан"
+        self.astana.save()
+        self.assertIsNone(cargo_registry.city_by_name("Астана"))
+
+
+class ScanImportTest(TestCase):
+    """Пакетный импорт даёт то же, что и сканы по одному через очередь."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cities = [City.objects.create(name=name) for name in ("Алматы", "Астана")]
+        # у Шымкента нет тарифа — сканы туда падают, как и в scan_qr
+        cities.append(City.objects.create(name="Шымкент"))
+        for city, mass_rate in zip(cities[:2], ("10.00", "7.50")):
+            CargoCostRate.objects.create(
+                city=city,
+                cost_per_mass_unit=Decimal(mass_rate),
+                cost_per_volume_unit=Decimal("3.00"),
+            )
+        cls.employees = [
+            User.objects.create_user(f"loader{i}", chat_id=1000 + i, city=city)
+            for i, city in enumerate(cities * 3)
+        ]
+
+    def make_scans(self, count=300):
+        rng = random.Random(21)
+        names = ["Алматы", " астана ", "Шымкент", "Караганда", None]
+        scans = []
+        for _ in range(count):
+            scans.append(
+                {
+                    "operation": rng.choice(["work"] * 9 + ["other"]),
+                    "userId": rng.choice([e.chat_id for e in self.employees] + [1]),
+                    "qrData": {
+                        "id": rng.randint(1, 25),
+                        "m": rng.randint(1, 5),
+                        "v": rng.randint(1, 5),
+                        "city_from": rng.choice(names),
+                        "city_to": rng.choice(names),
+                    },
+                }
+            )
+        return scans
+
+    @staticmethod
+    def snapshot():
+        return (
+            sorted(
+                Cargo.objects.values_list(
+                    "id_external", "mass", "volume", "city_from", "city_to"
+                )
+            ),
+            sorted(
+                WorkUnit.objects.values_list(
+                    "cargo__id_external",
+                    "city",
+                    "work_type",
+                    "mass_units",
+                    "volume_units",
+                    "total_score",
+                )
+            ),
+            sorted(
+                WorkDistribution.objects.values_list(
+                    "work_unit__cargo__id_external",
+                    "work_unit__city",
+                    "work_unit__work_type",
+                    "employee",
+                    "score_share",
+                )
+            ),
+        )
+
+    def test_matches_sequential_replay(self):
+        scans = self.make_scans()
+        user_cache.clear()
+        failed = 0
+        for scan in scans:
+            try:
+                process_work_scan(scan)
+            except Exception:
+                failed += 1
+        expected = self.snapshot()
+        self.assertTrue(expected[2])
+        Cargo.objects.all().delete()
+
+        summary = import_scans(scans, batch_size=70)
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(len(summary.errors), failed)
+        self.assertEqual(
+            summary.applied + summary.repeated + summary.skipped + failed, len(scans)
+        )
+
+        # повторный импорт ничего не меняет
+        summary = import_scans(scans)
+        self.assertEqual(summary.applied, 0)
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_api_accepts_json_lines(self):
+        body = "\n".join(json.dumps(scan) for scan in self.make_scans(50))
+        response = self.client.post(
+            reverse("scan-import"), body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["scans"], 50)
+        self.assertEqual(WorkDistribution.objects.count(), response.json()["applied"])
+
+
+class CargoLanesTest(SimpleTestCase):
+    """cargo_qr --workers: сканы одного груза по порядку, ack после обработки."""
+
+    class FakeConnection:
+        def __init__(self):
+            self.callbacks = []
+
+        def add_callback_threadsafe(self, callback):
+            self.callbacks.append(callback)
+
+    class FakeChannel:
+        def __init__(self):
+            self.acked = []
+
+        def basic_ack(self, delivery_tag):
+            self.acked.append(delivery_tag)
+
+    def test_dispatch_keeps_order_per_cargo(self):
+        processed = []
+
+        def process(body):
+            data = json.loads(body)
+            # первый скан каждого груза самый медленный
+            time.sleep(0.02 if data["n"] < 4 else 0)
+            processed.append((data["qrData"]["id"], data["n"]))
+
+        command = Command()
+        command.lanes = CargoLanes(4)
+        command.process = process
+        connection, channel = self.FakeConnection(), self.FakeChannel()
+        for tag in range(40):
+            body = json.dumps({"n": tag, "qrData": {"id": tag % 4}}).encode()
+            command.dispatch(
+                connection, channel, SimpleNamespace(delivery_tag=tag), None, body
+            )
+        command.lanes.shutdown(wait=True)
+
+        for cargo_id in range(4):
+            order = [n for cid, n in processed if cid == cargo_id]
+            self.assertEqual(order, list(range(cargo_id, 40, 4)))
+        # ack только через поток соединения и только после обработки
+        self.assertEqual(channel.acked, [])
+        for callback in connection.callbacks:
+            callback()
+        self.assertEqual(sorted(channel.acked), list(range(40)))
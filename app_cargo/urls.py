@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .views import ScanImportView
+
+urlpatterns = [
+    path("api/cargo/scans/import/", ScanImportView.as_view(), name="scan-import"),
+]
@@ -1,3 +1,37 @@
-from django.shortcuts import render
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from .bulk_scans import import_scans, read_scans
+
+
+class ScanImportView(APIView):
+    """
+    Пакетная загрузка сканов терминала склада: тело — JSON-массив
+    сообщений work_qr_queue или JSON Lines. Ответ — итог импорта.
+    """
+
+    # тело читаем построчно из request.stream, парсеры DRF его не трогают
+    parser_classes = ()
+
+    def post(self, request, format=None):
+        try:
+            summary = import_scans(read_scans(request.stream or []))
+        except (ValueError, AttributeError) as e:
+            return Response(
+                {"detail": f"Неверный формат сканов: {e}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(
+            {
+                "scans": summary.scans,
+                "applied": summary.applied,
+                "repeated": summary.repeated,
+                "skipped": summary.skipped,
+                "cargos_created": summary.cargos_created,
+                "work_units_created": summary.work_units_created,
+                "errors": [
+                    {"index": index, "error": error} for index, error in summary.errors
+                ],
+            }
+        )
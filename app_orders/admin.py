@@ -2,8 +2,9 @@ from decimal import Decimal
 
 from django.contrib import admin
 
-from django.db.models import Sum, Value
-from django.db.models.functions import Coalesce
+from django.db.models import JSONField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, JSONObject
+from django.utils.html import format_html
 
 from app_orders.FiltersAdmin import (
     HasSentimentFilter,
@@ -17,6 +18,7 @@ from app_orders.models import (
     ConsumerSentiment,
     DeliveryProof,
     OrderPreparation,
+    VideoBlob,
 )
 
 
@@ -36,13 +38,37 @@ class ConsumerSentimentInline(admin.TabularInline):
     verbose_name_plural = "Отзывы курьеров"
 
 
+def video_preview(obj):
+    """
+    Превью вместо исходного видео: картинка-ссылка на сжатую копию.
+    Пока видео не обработано — просто ссылка на исходный файл.
+    """
+    if not obj.video:
+        return "-"
+    target = obj.rendition or obj.video
+    if obj.thumbnail:
+        return format_html(
+            '<a href="{}" target="_blank"><img src="{}" width="160" loading="lazy"></a>',
+            target.url,
+            obj.thumbnail.url,
+        )
+    return format_html(
+        '<a href="{}" target="_blank">{}</a>',
+        target.url,
+        obj.get_processing_status_display(),
+    )
+
+
+video_preview.short_description = "Видео"
+
+
 class DeliveryProofInline(admin.TabularInline):
     """Inline для подтверждения доставки (DeliveryProof)"""
 
     model = DeliveryProof
     # extra = 0
-    fields = ("courier", "video", "uploaded_at")
-    readonly_fields = ("uploaded_at",)
+    fields = ("courier", video_preview, "video", "uploaded_at")
+    readonly_fields = (video_preview, "uploaded_at")
     verbose_name = "Видео подтверждение"
     verbose_name_plural = "Видео подтверждения"
 
@@ -158,7 +184,7 @@ class OrderAdmin(admin.ModelAdmin):
             },
         ),
     )
-    readonly_fields = ("created_at", "updated_at", "raw_json")
+    readonly_fields = ("created_at", "updated_at", "raw_json", "points_total")
 
     def customer_full_name(self, obj):
         return f"{obj.customer_firstname} {obj.customer_lastname}".strip()
@@ -166,27 +192,32 @@ class OrderAdmin(admin.ModelAdmin):
     customer_full_name.short_description = "Покупатель"
 
     def show_merchant_users(self, obj):
-        user = obj.get_last_user_in_history()
-        return f"[{user.user_type}] {user.user_name} {user.user_phone}"
+        # last_history приходит из get_queryset, без запроса на каждую строку
+        history = obj.last_history
+        if not history or (history["type"] is None and history["name"] is None):
+            return self.get_empty_value_display()
+        return f"[{history['type']}] {history['name']} {history['phone']}"
 
     show_merchant_users.short_description = "Доставил"
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.annotate(  # points_sum появится на каждом объекте
-            points_sum=Coalesce(
-                Sum("scores__points"),  # суммируем связанные CourierScore
-                Value(Decimal("0.00")),  # если нет баллов → 0
+        last_history = OrderHistory.objects.filter(order=OuterRef("pk")).order_by(
+            "-create_date"
+        )
+        return qs.select_related("consumer_sentiment", "delivery_proof").annotate(
+            # последняя запись истории — для колонки «Доставил»; одним
+            # подзапросом на строку, поля собираем в JSON-объект
+            last_history=Subquery(
+                last_history.values(
+                    data=JSONObject(
+                        type="user_type", name="user_name", phone="user_phone"
+                    )
+                )[:1],
+                output_field=JSONField(),
             ),
         )
 
-    # ②  Выводим значение в колонке
-    def points_total(self, obj):
-        return obj.points_sum  # Decimal со 2 знаками после запятой
-
-    points_total.short_description = "Баллы"
-    points_total.admin_order_field = "points_sum"
-
     def changelist_view(self, request, extra_context=None):
         """
         Перегружаем changelist_view для добавления суммы баллов для текущей выборки.
@@ -195,8 +226,9 @@ class OrderAdmin(admin.ModelAdmin):
 
         try:
             queryset = response.context_data["cl"].queryset
+            # points_total — готовая сумма по заказу, join с CourierScore не нужен
             total_points = queryset.aggregate(
-                total_points=Coalesce(Sum("points_sum"), Value(Decimal("0.00")))
+                total_points=Coalesce(Sum("points_total"), Value(Decimal("0.00")))
             )["total_points"]
 
             # Добавляем в контекст итоговую сумму
@@ -232,8 +264,43 @@ class ConsumerSentimentAdmin(admin.ModelAdmin):
 
 @admin.register(DeliveryProof)
 class DeliveryProofAdmin(admin.ModelAdmin):
-    list_display = ("order", "courier", "video", "uploaded_at")
+    list_display = (
+        "order",
+        "courier",
+        video_preview,
+        "processing_status",
+        "duration",
+        "video_size",
+        "uploaded_at",
+    )
+    list_select_related = ("order", "courier")
+    list_filter = ("processing_status",)
     search_fields = ("order__order_code", "courier__username", "courier__phone_number")
+    readonly_fields = (
+        video_preview,
+        "processing_status",
+        "rendition",
+        "thumbnail",
+        "video_size",
+        "duration",
+        "video_sha256",
+        "processed_at",
+    )
+
+
+@admin.register(VideoBlob)
+class VideoBlobAdmin(admin.ModelAdmin):
+    list_display = ("name", "size", "ref_count", "created_at", "last_used_at")
+    list_filter = ("created_at",)
+    search_fields = ("name", "sha256")
+    readonly_fields = (
+        "name",
+        "sha256",
+        "size",
+        "ref_count",
+        "created_at",
+        "last_used_at",
+    )
 
 
 @admin.register(OrderPreparation)
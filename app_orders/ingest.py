@@ -0,0 +1,304 @@
+"""
+Пакетная запись заказов Kaspi в БД.
+
+Вместо get_or_create + save на каждую строку заказ, все его позиции
+и вся история пишутся несколькими INSERT ... ON CONFLICT DO UPDATE
+внутри одной транзакции.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from app_accounts.user_cache import user_cache
+from app_orders.models import Order, OrderEntry, OrderHistory
+
+User = get_user_model()
+
+ORDER_UPDATE_FIELDS = (
+    "customer_firstname",
+    "customer_lastname",
+    "phone_number",
+    "total_price",
+    "order_status",
+    "raw_json",
+    "updated_at",
+)
+ENTRY_UPDATE_FIELDS = (
+    "name",
+    "quantity",
+    "weight",
+    "base_price",
+    "total_price",
+    "master_product_code",
+    "master_product_url",
+    "master_product_name",
+    "merchant_product_sku",
+    "merchant_product_name",
+    "images",
+    "unit_code",
+    "unit_display_name",
+    "unit_type",
+    "raw_entry",
+)
+# сообщение без ключа images не стирает сохранённые картинки
+ENTRY_UPDATE_FIELDS_KEEP_IMAGES = tuple(
+    name for name in ENTRY_UPDATE_FIELDS if name != "images"
+)
+HISTORY_UPDATE_FIELDS = (
+    "user_type",
+    "user_name",
+    "user_email",
+    "user_phone",
+    "description",
+    "raw_data",
+)
+
+
+def ms_to_datetime(ms_val):
+    return datetime.utcfromtimestamp(ms_val / 1000.0)
+
+
+def link_merchant_user(hist_data: dict):
+    """
+    Пытается найти Django-пользователя по телефону или email,
+    если не находит — при желании можно создать,
+    либо вернуть None, если не хотим создавать автоматически.
+    """
+    user_type = hist_data.get("userType")
+    if user_type != "MERCHANT_USER":
+        return None
+
+    phone = hist_data.get("userPhone", "")
+    email = hist_data.get("userEmail", "")
+    username = hist_data.get("userName", "unknown_user")
+
+    # Пробуем поискать по email, потом по телефону (через общий кэш)
+    user = user_cache.get_by_email(email) or user_cache.get_by_phone(phone)
+    if user is not None:
+        return user
+
+    # Если тут вы хотите автоматически создавать пользователя:
+    # (иначе просто return None)
+    new_user = User.objects.create_user(
+        username=username.replace(" ", "_")[:30],  # ограничиваем длину
+        email=email,
+        password="some_default_password",  # обязательно указать или сгенерировать
+        phone_number=phone,
+    )
+    return new_user
+
+
+@dataclass
+class IngestSummary:
+    """Итог записи одного заказа: сколько строк вставлено, а сколько обновлено."""
+
+    order: Order
+    order_created: bool
+    entries_inserted: int = 0
+    entries_updated: int = 0
+    history_inserted: int = 0
+    history_updated: int = 0
+    # только что вставленные строки истории (уже с processed_by)
+    new_history: list = field(default_factory=list)
+
+    def __str__(self):
+        return (
+            f"order {self.order.order_code} "
+            f"{'inserted' if self.order_created else 'updated'}, "
+            f"entries +{self.entries_inserted}/~{self.entries_updated}, "
+            f"history +{self.history_inserted}/~{self.history_updated}"
+        )
+
+
+def _history_create_date(create_ms):
+    # Django и раньше интерпретировал наивную дату в текущей таймзоне,
+    # делаем то же самое явно, чтобы ключи совпадали с уже сохранёнными строками.
+    return timezone.make_aware(ms_to_datetime(create_ms))
+
+
+def _build_entry(order_obj, entry_data: dict) -> OrderEntry:
+    unit_data = entry_data.get("unit", {})
+    return OrderEntry(
+        order=order_obj,
+        entry_id=entry_data.get("entryId", None),
+        name=entry_data.get("name", ""),
+        quantity=entry_data.get("quantity", 1),
+        weight=entry_data.get("weight", 0.0),
+        base_price=entry_data.get("basePrice", 0),
+        total_price=entry_data.get("totalPrice", 0),
+        master_product_code=entry_data.get("masterProductCode", ""),
+        master_product_url=entry_data.get("masterProductUrl", ""),
+        master_product_name=entry_data.get("masterProductName", ""),
+        merchant_product_sku=entry_data.get("merchantProductSKU", ""),
+        merchant_product_name=entry_data.get("merchantProductName", ""),
+        images=entry_data.get("images"),
+        unit_code=unit_data.get("code", ""),
+        unit_display_name=unit_data.get("displayName", ""),
+        unit_type=unit_data.get("type", ""),
+        raw_entry=entry_data,
+    )
+
+
+def _entry_update_fields(obj: OrderEntry):
+    if "images" in obj.raw_entry:
+        return ENTRY_UPDATE_FIELDS
+    return ENTRY_UPDATE_FIELDS_KEEP_IMAGES
+
+
+def _build_history(order_obj, hist_data: dict, create_dt) -> OrderHistory:
+    return OrderHistory(
+        order=order_obj,
+        create_date=create_dt,
+        action=hist_data.get("action", ""),
+        user_type=hist_data.get("userType", ""),
+        user_name=hist_data.get("userName", ""),
+        user_email=hist_data.get("userEmail", ""),
+        user_phone=hist_data.get("userPhone", ""),
+        description=hist_data.get("description", ""),
+        raw_data=hist_data,
+    )
+
+
+def _upsert_order(message_data: dict):
+    order_code = message_data["orderCode"]
+    customer_info = message_data.get("customer", {})
+
+    existing = Order.objects.filter(order_code=order_code).values("created_at").first()
+    order_obj = Order(
+        order_code=order_code,
+        customer_firstname=customer_info.get("firstname", ""),
+        customer_lastname=customer_info.get("lastname", ""),
+        phone_number=customer_info.get("phoneNumber", ""),
+        total_price=message_data.get("totalPrice", 0),
+        order_status=message_data.get("orderStatus", ""),
+        raw_json=message_data,
+    )
+    Order.objects.bulk_create(
+        [order_obj],
+        update_conflicts=True,
+        unique_fields=["order_code"],
+        update_fields=ORDER_UPDATE_FIELDS,
+    )
+    order_created = existing is None
+    if not order_created:
+        # created_at при конфликте не перезаписывается в БД,
+        # возвращаем объекту настоящее значение.
+        order_obj.created_at = existing["created_at"]
+    return order_obj, order_created
+
+
+def _upsert_entries(order_obj, entries: list, summary: IngestSummary):
+    existing = dict(
+        OrderEntry.objects.filter(order=order_obj).values_list("entry_id", "pk")
+    )
+
+    # Повтор entryId внутри одного сообщения: последний побеждает,
+    # как и при последовательных get_or_create.
+    by_key = {}
+    for entry_data in entries:
+        obj = _build_entry(order_obj, entry_data)
+        by_key[obj.entry_id] = obj
+
+    # NULL в unique_together не конфликтует, поэтому позицию без entryId
+    # обновляем по pk, а не через ON CONFLICT.
+    null_entry = by_key.pop(None, None)
+    to_upsert = list(by_key.values())
+    if null_entry is not None:
+        if None in existing:
+            null_entry.pk = existing[None]
+            OrderEntry.objects.bulk_update(
+                [null_entry], _entry_update_fields(null_entry)
+            )
+            summary.entries_updated += 1
+        else:
+            to_upsert.append(null_entry)
+
+    groups = {}
+    for obj in to_upsert:
+        groups.setdefault(_entry_update_fields(obj), []).append(obj)
+    for update_fields, objs in groups.items():
+        OrderEntry.objects.bulk_create(
+            objs,
+            update_conflicts=True,
+            unique_fields=["order", "entry_id"],
+            update_fields=update_fields,
+        )
+    updated = sum(1 for obj in to_upsert if obj.entry_id in existing)
+    summary.entries_updated += updated
+    summary.entries_inserted += len(to_upsert) - updated
+
+
+def _upsert_history(order_obj, history_list: list, summary: IngestSummary):
+    existing = set(
+        OrderHistory.objects.filter(order=order_obj).values_list(
+            "create_date", "action"
+        )
+    )
+
+    by_key = {}
+    for hist_data in history_list:
+        create_ms = hist_data.get("createDate")
+        if create_ms is None:
+            continue
+        obj = _build_history(order_obj, hist_data, _history_create_date(create_ms))
+        by_key[(obj.create_date, obj.action)] = obj
+
+    # Один и тот же курьер встречается в истории много раз — ищем его один раз.
+    merchants = {}
+    merchant_rows, other_rows = [], []
+    for obj in by_key.values():
+        hist_data = obj.raw_data
+        if hist_data.get("userType") != "MERCHANT_USER":
+            other_rows.append(obj)
+            continue
+        user_key = (
+            hist_data.get("userEmail", ""),
+            hist_data.get("userPhone", ""),
+            hist_data.get("userName", "unknown_user"),
+        )
+        if user_key not in merchants:
+            merchants[user_key] = link_merchant_user(hist_data)
+        obj.processed_by = merchants[user_key]
+        merchant_rows.append(obj)
+
+    # processed_by перезаписываем только у строк MERCHANT_USER —
+    # у остальных привязку не трогаем, как и раньше.
+    for rows, update_fields in (
+        (merchant_rows, HISTORY_UPDATE_FIELDS + ("processed_by",)),
+        (other_rows, HISTORY_UPDATE_FIELDS),
+    ):
+        if not rows:
+            continue
+        OrderHistory.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["order", "create_date", "action"],
+            update_fields=update_fields,
+        )
+
+    for obj in by_key.values():
+        if (obj.create_date, obj.action) in existing:
+            summary.history_updated += 1
+        else:
+            summary.history_inserted += 1
+            summary.new_history.append(obj)
+
+
+def ingest_order(message_data: dict):
+    """
+    Записывает заказ из сообщения Kaspi вместе с позициями и историей.
+    Возвращает IngestSummary или None, если в сообщении нет orderCode.
+    """
+    if not message_data.get("orderCode"):
+        return None
+
+    with transaction.atomic():
+        order_obj, order_created = _upsert_order(message_data)
+        summary = IngestSummary(order=order_obj, order_created=order_created)
+        _upsert_entries(order_obj, message_data.get("entries", []), summary)
+        _upsert_history(order_obj, message_data.get("historyEntries", []), summary)
+    return summary
@@ -0,0 +1,253 @@
+import random
+import re
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import JSONField, OuterRef, Subquery
+from django.db.models.functions import JSONObject
+from django.utils import timezone
+
+from app_accounts.models import CourierScore
+from app_orders.models import Order, OrderHistory, OrderPreparation
+
+User = get_user_model()
+
+# Индексы, которые сравниваем: (модель, имя индекса из Meta.indexes)
+BENCH_INDEXES = (
+    (User, "user_chat_id_idx"),
+    (User, "user_phone_idx"),
+    (User, "user_email_upper_idx"),
+    (CourierScore, "courierscore_user_order_idx"),
+    (Order, "order_created_at_idx"),
+)
+
+PREFIX = "BENCH-"
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет БД тестовыми данными, снимает EXPLAIN ANALYZE горячих "
+        "запросов с новыми индексами и без них, затем откатывает всё. "
+        "DROP INDEX держит блокировку таблиц до конца — не запускать на проде."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20000)
+        parser.add_argument("--orders", type=int, default=100000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Run even when DEBUG is off",
+        )
+        parser.add_argument(
+            "--plans", action="store_true", help="Print full query plans"
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Benchmark needs PostgreSQL.")
+        if not settings.DEBUG and not options["force"]:
+            raise CommandError("DEBUG is off; pass --force if this is not production.")
+
+        self.repeat = options["repeat"]
+        self.show_plans = options["plans"]
+        with transaction.atomic():
+            sample = self.seed(options["users"], options["orders"])
+            queries = self.build_queries(sample)
+
+            after = self.measure(queries)
+            with connection.schema_editor(atomic=False) as editor:
+                for model, name in BENCH_INDEXES:
+                    index = next(i for i in model._meta.indexes if i.name == name)
+                    editor.remove_index(model, index)
+            self.analyze()
+            before = self.measure(queries)
+
+            self.report(queries, before, after)
+            transaction.set_rollback(True)
+        self.stdout.write("Rolled back: test data and dropped indexes restored.")
+
+    # --- данные ---------------------------------------------------------
+
+    def seed(self, users_count, orders_count):
+        self.stdout.write(f"Seeding {users_count} users, {orders_count} orders...")
+        rnd = random.Random(42)
+        now = timezone.now()
+
+        users = User.objects.bulk_create(
+            [
+                User(
+                    username=f"{PREFIX}{i}",
+                    email=f"Bench.User{i}@Example.com" if i % 3 else "",
+                    # как в жизни: телефоны в разном формате, у части нет
+                    phone_number=(
+                        rnd.choice(["7", "+7", "8"]) + f"70{i:08d}" if i % 4 else None
+                    ),
+                    chat_id=100000000 + i if i % 2 else None,
+                )
+                for i in range(users_count)
+            ],
+            batch_size=5000,
+        )
+
+        orders = Order.objects.bulk_create(
+            [Order(order_code=f"{PREFIX}{i}") for i in range(orders_count)],
+            batch_size=5000,
+        )
+        # created_at — auto_now_add, разносим даты на два года отдельным UPDATE
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Order._meta.db_table} "
+                "SET created_at = now() - random() * interval '730 days' "
+                "WHERE order_code LIKE %s",
+                [f"{PREFIX}%"],
+            )
+
+        history = []
+        scores = []
+        preparations = []
+        for order in orders:
+            for n, action in enumerate(("CREATED", "ASSEMBLED", "COMPLETED")):
+                history.append(
+                    OrderHistory(
+                        order=order,
+                        create_date=now - timedelta(hours=3 - n),
+                        action=action,
+                        user_type="MERCHANT_USER",
+                        user_name="bench",
+                        user_phone="77000000000",
+                    )
+                )
+            courier = rnd.choice(users)
+            scores.append(
+                CourierScore(user=courier, order=order, points=Decimal("1.00"))
+            )
+            for preparation_type in ("shipment", "packing"):
+                preparations.append(
+                    OrderPreparation(
+                        order_code=order.order_code,
+                        preparation_type=preparation_type,
+                        telegram_chat_id=str(courier.chat_id or 0),
+                        executor=courier,
+                    )
+                )
+        OrderHistory.objects.bulk_create(history, batch_size=5000)
+        CourierScore.objects.bulk_create(scores, batch_size=5000)
+        OrderPreparation.objects.bulk_create(preparations, batch_size=5000)
+        self.analyze()
+
+        return {
+            "user": users[len(users) // 2 + 1],
+            "order": orders[len(orders) // 2],
+            "score": scores[len(scores) // 2],
+            "now": now,
+        }
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            for model in (User, Order, OrderHistory, CourierScore, OrderPreparation):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+    # --- запросы --------------------------------------------------------
+
+    def build_queries(self, sample):
+        user = sample["user"]
+        order = sample["order"]
+        score = sample["score"]
+        now = sample["now"]
+        last_history = OrderHistory.objects.filter(order=OuterRef("pk")).order_by(
+            "-create_date"
+        )
+        phone = user.phone_number or "77000000000"
+        digits = phone.lstrip("+")
+        return [
+            ("User by chat_id", User.objects.filter(chat_id=user.chat_id)),
+            (
+                "User by phone variants",
+                User.objects.filter(
+                    phone_number__in=[phone, digits, f"+{digits}", "8" + digits[1:]]
+                ),
+            ),
+            (
+                "User by email iexact",
+                User.objects.filter(email__iexact=user.email.lower() or "x@x"),
+            ),
+            (
+                "OrderHistory upsert key",
+                OrderHistory.objects.filter(
+                    order=order, create_date=now, action="COMPLETED"
+                ),
+            ),
+            (
+                "Score exists (user, order)",
+                CourierScore.objects.filter(user=score.user, order=order)[:1],
+            ),
+            (
+                "Preparations of order",
+                OrderPreparation.objects.filter(
+                    order_code=order.order_code,
+                    preparation_type__in=("shipment", "packing"),
+                ),
+            ),
+            (
+                "Admin page: last 100 by date",
+                Order.objects.annotate(
+                    last_history=Subquery(
+                        last_history.values(
+                            data=JSONObject(
+                                type="user_type", name="user_name", phone="user_phone"
+                            )
+                        )[:1],
+                        output_field=JSONField(),
+                    )
+                ).order_by("-created_at")[:100],
+            ),
+            (
+                "Admin date_hierarchy: one month",
+                Order.objects.filter(
+                    created_at__gte=now - timedelta(days=60),
+                    created_at__lt=now - timedelta(days=30),
+                ).order_by("-created_at")[:100],
+            ),
+        ]
+
+    def measure(self, queries):
+        results = []
+        for title, queryset in queries:
+            timings = []
+            for _ in range(self.repeat):
+                plan = queryset.explain(analyze=True)
+                timings.append(
+                    float(re.search(r"Execution Time: ([\d.]+) ms", plan).group(1))
+                )
+            results.append((min(timings), plan))
+        return results
+
+    def report(self, queries, before, after):
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'query':<34} {'before, ms':>11} {'after, ms':>10}  plan after"
+        )
+        for (title, _), (before_ms, before_plan), (after_ms, after_plan) in zip(
+            queries, before, after
+        ):
+            # первая строка плана с узлом сканирования — что реально выбрал планировщик
+            scan = next(
+                (
+                    line.strip().lstrip("-> ").split("  (")[0]
+                    for line in after_plan.splitlines()
+                    if "Scan" in line
+                ),
+                after_plan.splitlines()[0],
+            )
+            self.stdout.write(
+                f"{title:<34} {before_ms:>11.3f} {after_ms:>10.3f}  {scan}"
+            )
+            if self.show_plans:
+                self.stdout.write(f"--- before ---\n{before_plan}")
+                self.stdout.write(f"--- after ---\n{after_plan}\n")
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+import aio_pika
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from app_accounts.user_cache import user_cache
+from app_cargo.management.commands.cargo_qr import (
+    QUEUE_NAME as RABBIT_QUEUE_WORK_QR,
+    process_work_scan,
+    scan_cargo_id,
+)
+from app_orders.management.commands.consume_feedback import (
+    RABBIT_QUEUE_FEEDBACK,
+    save_feedback,
+)
+from app_orders.management.commands.consume_orders import (
+    REQUEUE_DELAY_SECONDS,
+    TRANSIENT_ERRORS,
+    Command as ConsumeOrdersCommand,
+    dead_letter_queue,
+)
+from app_orders.management.commands.consume_qr_events import (
+    RABBIT_QR_EVENTS,
+    save_preparation,
+)
+from app_orders.video_processing import RABBIT_QUEUE_VIDEO, process_video_message
+
+log = logging.getLogger(__name__)
+
+RABBIT_QUEUE_ORDERS = "orders_queue"
+
+# Сколько сообщений каждой очереди обрабатываем одновременно.
+# video_processing последовательно — ffmpeg грузит CPU.
+DEFAULT_CONCURRENCY = {
+    RABBIT_QUEUE_ORDERS: 4,
+    RABBIT_QUEUE_FEEDBACK: 4,
+    RABBIT_QR_EVENTS: 10,
+    RABBIT_QUEUE_WORK_QR: 4,
+    RABBIT_QUEUE_VIDEO: 1,
+}
+
+# Очередь -> ключ сообщения: сообщения с одним ключом обрабатываются
+# по порядку получения, с разными — параллельно (в пределах concurrency).
+ORDERING_KEYS = {
+    # scan_qr сам держит блокировку работы, но первый скан груза задаёт
+    # его массу и маршрут, поэтому сканы одного груза идут по очереди
+    RABBIT_QUEUE_WORK_QR: scan_cargo_id,
+}
+
+
+def run_db_handler(handler, data):
+    """Выполняется в пуле потоков: у каждого потока своё соединение с БД."""
+    close_old_connections()
+    try:
+        return handler(data)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        "Один asyncio-процесс вместо consume_orders, consume_feedback, "
+        "consume_qr_events и cargo_qr, плюс обработка видео: слушает все "
+        "очереди с отдельным лимитом параллельности на каждую."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            action="append",
+            default=[],
+            metavar="QUEUE=N",
+            help=(
+                "Per-queue limit of messages in flight, may be repeated "
+                f"(defaults: {DEFAULT_CONCURRENCY})"
+            ),
+        )
+        parser.add_argument(
+            "--db-threads",
+            type=int,
+            default=8,
+            help="Size of the thread pool that runs DB work (default: 8)",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = dict(DEFAULT_CONCURRENCY)
+        for item in options["concurrency"]:
+            queue_name, _, value = item.partition("=")
+            if queue_name not in concurrency or not value.isdigit():
+                raise CommandError(f"Bad --concurrency value: {item!r}")
+            concurrency[queue_name] = int(value)
+
+        orders_command = ConsumeOrdersCommand(stdout=self.stdout, stderr=self.stderr)
+        self.handlers = {
+            RABBIT_QUEUE_ORDERS: orders_command.save_order_to_db,
+            RABBIT_QUEUE_FEEDBACK: save_feedback,
+            RABBIT_QR_EVENTS: save_preparation,
+            RABBIT_QUEUE_WORK_QR: process_work_scan,
+            RABBIT_QUEUE_VIDEO: process_video_message,
+        }
+        self.in_flight = set()
+        self.executor = ThreadPoolExecutor(
+            max_workers=options["db_threads"], thread_name_prefix="consume_all-db"
+        )
+        try:
+            asyncio.run(self.run(concurrency))
+        finally:
+            self.executor.shutdown(wait=True)
+        self.stdout.write(
+            self.style.SUCCESS(f" [*] Stopped. User cache: {user_cache.stats()}")
+        )
+
+    async def run(self, concurrency):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        connection = await aio_pika.connect_robust(
+            host=settings.RABBITMQ_HOST,
+            port=settings.RABBITMQ_PORT,
+            login=settings.RABBITMQ_USER,
+            password=settings.RABBITMQ_PASSWORD,
+        )
+        async with connection:
+            consumers = []
+            for queue_name, limit in concurrency.items():
+                # свой канал на очередь, чтобы prefetch ограничивал именно её
+                channel = await connection.channel()
+                await channel.set_qos(prefetch_count=limit)
+                await channel.declare_queue(dead_letter_queue(queue_name), durable=True)
+                queue = await channel.declare_queue(queue_name, durable=True)
+                consumer_tag = await queue.consume(
+                    self.make_callback(queue_name, channel)
+                )
+                consumers.append((queue, consumer_tag))
+                self.stdout.write(
+                    self.style.SUCCESS(f" [*] {queue_name}: concurrency={limit}")
+                )
+
+            await stop.wait()
+
+            # Перестаём принимать новые сообщения и дожидаемся тех, что уже
+            # в работе; неподтверждённые вернутся в очередь при закрытии канала.
+            self.stdout.write(
+                f" [*] Shutting down, waiting for {len(self.in_flight)} messages..."
+            )
+            for queue, consumer_tag in consumers:
+                await queue.cancel(consumer_tag)
+            if self.in_flight:
+                await asyncio.gather(*self.in_flight, return_exceptions=True)
+
+    def make_callback(self, queue_name, channel):
+        handler = self.handlers[queue_name]
+        ordering_key = ORDERING_KEYS.get(queue_name)
+        # последняя задача каждого ключа: следующая ждёт её завершения
+        tails = {}
+
+        async def on_message(message: aio_pika.abc.AbstractIncomingMessage):
+            task = asyncio.current_task()
+            self.in_flight.add(task)
+            key = previous = None
+            try:
+                try:
+                    data = json.loads(message.body)
+                except ValueError:
+                    # повтор не поможет — отбрасываем
+                    log.exception("[%s] Malformed message %r", queue_name, message.body)
+                    await message.reject(requeue=False)
+                    return
+                if ordering_key is not None:
+                    # до первого await: очередь ключа встаёт в порядке получения
+                    key = ordering_key(data)
+                    previous = tails.get(key)
+                    tails[key] = task
+                if previous is not None:
+                    # исход предыдущего сообщения не важен, ждём только порядок
+                    await asyncio.gather(previous, return_exceptions=True)
+                try:
+                    await asyncio.get_running_loop().run_in_executor(
+                        self.executor, run_db_handler, handler, data
+                    )
+                except TRANSIENT_ERRORS:
+                    log.exception("[%s] Transient error, requeueing", queue_name)
+                    await asyncio.sleep(REQUEUE_DELAY_SECONDS)
+                    await message.nack(requeue=True)
+                except Exception as e:
+                    log.exception("[%s] Error processing message", queue_name)
+                    await self.dead_letter(channel, queue_name, message, e)
+                else:
+                    await message.ack()
+            finally:
+                self.in_flight.discard(task)
+                if ordering_key is not None and tails.get(key) is task:
+                    del tails[key]
+
+        return on_message
+
+    async def dead_letter(self, channel, queue_name, message, error):
+        """Перекладывает сообщение в <queue>.dlq с текстом ошибки, затем ack."""
+        try:
+            await channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=message.body,
+                    content_type=message.content_type,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    headers={
+                        **(message.headers or {}),
+                        "x-error": repr(error)[:1000],
+                        "x-original-queue": queue_name,
+                    },
+                ),
+                routing_key=dead_letter_queue(queue_name),
+            )
+        except Exception:
+            log.exception("[%s] Dead-lettering failed, requeueing", queue_name)
+            await message.nack(requeue=True)
+            return
+        await message.ack()
@@ -8,6 +8,7 @@ import pika
 
 from app_orders.models import Order, ConsumerSentiment
 from app_accounts.models import CourierScore
+from app_accounts.user_cache import user_cache
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -25,6 +26,55 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
+def save_feedback(data: dict):
+    """
+    Сохраняет ИНП из сообщения feedback_queue и начисляет курьеру балл.
+    Возвращает (order_code, created).
+    """
+    # Извлекаем данные
+    order_code = data.get("orderCode")
+    rating_str = data.get("rating")
+    courier_chat_id = data.get("courierChatId")
+    comment = data.get("comment", "")
+
+    # Преобразуем текстовую оценку в значение, которое хранится в модели.
+    # Предположим, что в модели мы используем:
+    # 'excellent' для "Отлично" и 'not_excellent' для "Не отлично"
+    if rating_str == "Отлично":
+        sentiment_value = "excellent"
+    elif rating_str == "Не отлично":
+        sentiment_value = "not_excellent"
+    else:
+        sentiment_value = rating_str  # или можно обработать иначе
+
+    if not order_code:
+        raise ValueError("Не указан orderCode в сообщении.")
+
+    # Получаем заказ по order_code
+    order = Order.objects.get(order_code=order_code)
+    # Получаем курьера по chat_id
+    courier = user_cache.get_by_chat_id(courier_chat_id)
+    if courier is None:
+        raise User.DoesNotExist(f"Курьер с chat_id={courier_chat_id} не найден.")
+
+    # Создаем или обновляем ConsumerSentiment (OneToOneField: один отзыв на заказ)
+    with transaction.atomic():
+        obj, created = ConsumerSentiment.objects.update_or_create(
+            order=order,
+            defaults={
+                "courier": courier,
+                "sentiment": sentiment_value,
+                "comment": comment,
+            },
+        )
+        CourierScore.objects.create(
+            user=courier,
+            order=order,
+            points=1,
+        )
+    return order_code, created
+
+
 class Command(BaseCommand):
     help = "Слушает очередь feedback_queue и сохраняет ConsumerSentiment для заказов."
 
@@ -46,45 +96,7 @@ class Command(BaseCommand):
                 data = json.loads(body.decode("utf-8"))
                 logger.info(f"Получено сообщение: {data}")
 
-                # Извлекаем данные
-                order_code = data.get("orderCode")
-                rating_str = data.get("rating")
-                courier_chat_id = data.get("courierChatId")
-                comment = data.get("comment", "")
-
-                # Преобразуем текстовую оценку в значение, которое хранится в модели.
-                # Предположим, что в модели мы используем:
-                # 'excellent' для "Отлично" и 'not_excellent' для "Не отлично"
-                if rating_str == "Отлично":
-                    sentiment_value = "excellent"
-                elif rating_str == "Не отлично":
-                    sentiment_value = "not_excellent"
-                else:
-                    sentiment_value = rating_str  # или можно обработать иначе
-
-                if not order_code:
-                    raise ValueError("Не указан orderCode в сообщении.")
-
-                # Получаем заказ по order_code
-                order = Order.objects.get(order_code=order_code)
-                # Получаем курьера по chat_id
-                courier = User.objects.get(chat_id=courier_chat_id)
-
-                # Создаем или обновляем ConsumerSentiment (OneToOneField: один отзыв на заказ)
-                with transaction.atomic():
-                    obj, created = ConsumerSentiment.objects.update_or_create(
-                        order=order,
-                        defaults={
-                            "courier": courier,
-                            "sentiment": sentiment_value,
-                            "comment": comment,
-                        },
-                    )
-                    CourierScore.objects.create(
-                        user=courier,
-                        order=order,
-                        points=1,
-                    )
+                order_code, created = save_feedback(data)
                 self.stdout.write(
                     self.style.SUCCESS(
                         f"ИНП для заказа {order_code} {'создан' if created else 'обновлён'}."
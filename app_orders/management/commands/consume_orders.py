@@ -1,82 +1,31 @@
 import json
+import time
 import pika
 
-from decimal import Decimal
+from functools import partial
 
 from django.core.management.base import BaseCommand
-from datetime import datetime
-from app_orders.models import Order, OrderEntry, OrderHistory, OrderPreparation
-from app_accounts.models import CourierScore
-from django.contrib.auth import get_user_model
+from django.db import InterfaceError, OperationalError, transaction
+from pika.exceptions import AMQPError
+from core.rabbitmq import get_publisher
+from app_orders.ingest import ingest_order
+from app_orders.scoring import give_out_points
+from app_accounts.models import CourierScore, CourierScoreReason
 
+# БД или брокер временно недоступны — сообщение вернётся в очередь
+TRANSIENT_ERRORS = (
+    OperationalError,
+    InterfaceError,
+    AMQPError,
+    ConnectionError,
+    TimeoutError,
+)
+# пауза перед возвратом, чтобы не крутить сообщение, пока БД лежит
+REQUEUE_DELAY_SECONDS = 5
 
-User = get_user_model()
 
-
-def ms_to_datetime(ms_val):
-    return datetime.utcfromtimestamp(ms_val / 1000.0)
-
-
-def give_out_points(order_code, order_obj):
-    preparation_type_list = ("shipment", "packing")
-
-    for preparation_type in preparation_type_list:
-        pre_orders = OrderPreparation.objects.filter(
-            order_code=order_code, preparation_type=preparation_type
-        )
-
-        pre_orders_count = pre_orders.count()
-
-        if pre_orders_count == 0:
-            continue
-
-        points = Decimal("1") / Decimal(pre_orders_count)
-
-        for pre_order in pre_orders:
-            if pre_order.executor:
-
-                CourierScore.objects.create(
-                    user=pre_order.executor,
-                    order=order_obj,
-                    points=points,
-                )
-
-
-def link_merchant_user(hist_data: dict):
-    """
-    Пытается найти Django-пользователя по телефону или email,
-    если не находит — при желании можно создать,
-    либо вернуть None, если не хотим создавать автоматически.
-    """
-    user_type = hist_data.get("userType")
-    if user_type != "MERCHANT_USER":
-        return None
-
-    phone = hist_data.get("userPhone", "")
-    email = hist_data.get("userEmail", "")
-    username = hist_data.get("userName", "unknown_user")
-
-    # Пробуем поискать по email
-    if email:
-        qs = User.objects.filter(email=email)
-        if qs.exists():
-            return qs.first()
-
-    # Если не нашли по email, пробуем по телефону (если модель хранит phone_number)
-    if phone:
-        qs = User.objects.filter(phone_number=phone)
-        if qs.exists():
-            return qs.first()
-
-    # Если тут вы хотите автоматически создавать пользователя:
-    # (иначе просто return None)
-    new_user = User.objects.create_user(
-        username=username.replace(" ", "_")[:30],  # ограничиваем длину
-        email=email,
-        password="some_default_password",  # обязательно указать или сгенерировать
-        phone_number=phone,
-    )
-    return new_user
+def dead_letter_queue(queue_name: str) -> str:
+    return f"{queue_name}.dlq"
 
 
 def publish_message_to_rabbitmq(
@@ -89,27 +38,13 @@ def publish_message_to_rabbitmq(
     password: str = "guest",
 ):
     """
-    Подключаемся к RabbitMQ, объявляем очередь, отправляем туда сообщение.
-    В реальном проекте обычно переиспользуют connection/channel
-    вместо открытия/закрытия на каждое сообщение.
+    Отправляем сообщение в очередь через общий на процесс издатель:
+    соединение и канал переиспользуются между сообщениями.
     """
-    credentials = pika.PlainCredentials(username, password)
-    connection_params = pika.ConnectionParameters(
-        host=host, port=port, credentials=credentials
+    publisher = get_publisher(
+        host=host, port=port, username=username, password=password
     )
-    connection = pika.BlockingConnection(connection_params)
-    channel = connection.channel()
-
-    channel.queue_declare(queue=queue_name, durable=True)
-
-    body_str = json.dumps(message_body, ensure_ascii=False)
-    channel.basic_publish(
-        exchange="",
-        routing_key=queue_name,
-        body=body_str,
-        properties=pika.BasicProperties(delivery_mode=2),  # persistent
-    )
-    connection.close()
+    publisher.publish(message_body, queue_name)
 
 
 class Command(BaseCommand):
@@ -146,6 +81,21 @@ class Command(BaseCommand):
             default="guest",
             help="RabbitMQ password (default: guest)",
         )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1,
+            help=(
+                "How many messages to save in one DB transaction and ack at once "
+                "(default: 1, i.e. one message at a time)"
+            ),
+        )
+        parser.add_argument(
+            "--max-wait-ms",
+            type=int,
+            default=500,
+            help="Max time to wait for a batch to fill up, in ms (default: 500)",
+        )
 
     def handle(self, *args, **options):
         queue_name = options["queue"]
@@ -153,6 +103,8 @@ class Command(BaseCommand):
         port = options["port"]
         username = options["username"]
         password = options["password"]
+        batch_size = max(options["batch_size"], 1)
+        max_wait_ms = options["max_wait_ms"]
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -170,6 +122,7 @@ class Command(BaseCommand):
 
         # Объявляем очередь на всякий случай (idempotent)
         channel.queue_declare(queue=queue_name, durable=True)
+        channel.queue_declare(queue=dead_letter_queue(queue_name), durable=True)
 
         self.stdout.write(
             self.style.SUCCESS(f" [*] Waiting for messages. Press CTRL+C to exit.")
@@ -177,152 +130,147 @@ class Command(BaseCommand):
 
         # Определяем колбэк на получение сообщений
         def callback(ch, method, properties, body):
-            try:
-                message_data = json.loads(body)
-                self.stdout.write(f" [x] Received message: {message_data}")
-
-                # Сохраняем в БД
-                self.save_order_to_db(message_data)
-
-                # Подтверждаем получение
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-            except Exception as e:
-                self.stderr.write(f" [!] Error processing message: {e}")
-                # Не делаем ack => сообщение вернется в очередь
-
-        channel.basic_qos(prefetch_count=1)
-        channel.basic_consume(queue=queue_name, on_message_callback=callback)
+            self.stdout.write(f" [x] Received message: {body!r}")
+            # пачка из одного сообщения: те же ack, возврат и DLQ
+            self.process_batch(ch, queue_name, [(method.delivery_tag, body)])
 
         try:
-            channel.start_consuming()
+            if batch_size > 1:
+                self.consume_batches(channel, queue_name, batch_size, max_wait_ms)
+            else:
+                channel.basic_qos(prefetch_count=1)
+                channel.basic_consume(queue=queue_name, on_message_callback=callback)
+                channel.start_consuming()
         except KeyboardInterrupt:
             channel.stop_consuming()
+            channel.cancel()
         connection.close()
 
+    def consume_batches(self, channel, queue_name, batch_size, max_wait_ms):
+        """
+        Копит до batch_size сообщений (или пока не пройдёт max_wait_ms),
+        сохраняет их одной транзакцией и подтверждает одним ack(multiple=True).
+        """
+        self.stdout.write(
+            self.style.SUCCESS(
+                f" [*] Batch mode: batch_size={batch_size}, max_wait_ms={max_wait_ms}"
+            )
+        )
+        max_wait = max_wait_ms / 1000.0
+        channel.basic_qos(prefetch_count=batch_size)
+
+        batch = []
+        deadline = None
+        for method, properties, body in channel.consume(
+            queue_name, inactivity_timeout=max_wait
+        ):
+            if method is not None:
+                batch.append((method.delivery_tag, body))
+                if deadline is None:
+                    deadline = time.monotonic() + max_wait
+
+            if batch and (
+                method is None
+                or len(batch) >= batch_size
+                or time.monotonic() >= deadline
+            ):
+                self.process_batch(channel, queue_name, batch)
+                batch, deadline = [], None
+
+    def process_batch(self, channel, queue_name, batch):
+        failed = self.save_batch(batch)
+        failed_tags = {tag for tag, _, _ in failed}
+        transient = [tag for tag, _, e in failed if isinstance(e, TRANSIENT_ERRORS)]
+
+        if transient:
+            # БД или брокер недоступны — возвращаем в очередь, но не сразу,
+            # чтобы не крутить сообщения, пока сбой не прошёл
+            time.sleep(REQUEUE_DELAY_SECONDS)
+            for tag in transient:
+                channel.basic_nack(delivery_tag=tag, requeue=True)
+        # «Ядовитые» сообщения откладываем в <queue>.dlq по одному, чтобы они
+        # не крутились в очереди вечно и не мешали подтвердить остальные.
+        for tag, body, error in failed:
+            if not isinstance(error, TRANSIENT_ERRORS):
+                self.dead_letter(channel, queue_name, tag, body, error)
+
+        ok_tags = [tag for tag, _ in batch if tag not in failed_tags]
+        if ok_tags:
+            channel.basic_ack(delivery_tag=max(ok_tags), multiple=True)
+        self.stdout.write(
+            f" [√] Batch done: {len(ok_tags)} saved, {len(transient)} requeued, "
+            f"{len(failed) - len(transient)} dead-lettered"
+        )
+
+    def dead_letter(self, channel, queue_name, delivery_tag, body, error):
+        """Перекладывает сообщение в <queue>.dlq с текстом ошибки, затем ack."""
+        self.stderr.write(f" [!] Dead-lettering message: {body!r}")
+        try:
+            channel.basic_publish(
+                exchange="",
+                routing_key=dead_letter_queue(queue_name),
+                body=body,
+                properties=pika.BasicProperties(
+                    content_type="application/json",
+                    delivery_mode=pika.DeliveryMode.Persistent,
+                    headers={
+                        "x-error": repr(error)[:1000],
+                        "x-original-queue": queue_name,
+                    },
+                ),
+            )
+        except AMQPError as e:
+            self.stderr.write(f" [!] Dead-lettering failed ({e}), requeueing")
+            channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+            return
+        channel.basic_ack(delivery_tag=delivery_tag)
+
+    def save_batch(self, batch):
+        """
+        Сохраняет пачку одной транзакцией. Если она падает — делит пополам
+        и пробует половины отдельно, пока не найдёт сломанные сообщения.
+        Временные сбои (TRANSIENT_ERRORS) не делит: упала бы любая половина.
+        Возвращает список (delivery_tag, body, ошибка), которые сохранить
+        не удалось.
+        """
+        try:
+            with transaction.atomic():
+                for _, body in batch:
+                    self.save_order_to_db(json.loads(body))
+            return []
+        except TRANSIENT_ERRORS as e:
+            self.stderr.write(f" [!] Batch of {len(batch)} hit a transient error: {e}")
+            return [(tag, body, e) for tag, body in batch]
+        except Exception as e:
+            if len(batch) == 1:
+                self.stderr.write(f" [!] Error processing message: {e}")
+                return [(tag, body, e) for tag, body in batch]
+            self.stderr.write(f" [!] Batch of {len(batch)} failed ({e}), bisecting...")
+            middle = len(batch) // 2
+            return self.save_batch(batch[:middle]) + self.save_batch(batch[middle:])
+
     def save_order_to_db(self, message_data: dict):
-        # --- Сохраняем сам Order и OrderEntry (пример как раньше)
-        order_code = message_data.get("orderCode")
-        if not order_code:
+        # --- Сохраняем Order, OrderEntry и OrderHistory пачкой
+        summary = ingest_order(message_data)
+        if summary is None:
             self.stdout.write(" [!] orderCode отсутствует, пропускаем.")
             return
+        self.stdout.write(f" [√] {summary}")
 
-        customer_info = message_data.get("customer", {})
-        delivery_info = message_data.get("delivery", {})
-        firstname = customer_info.get("firstname", "")
-        lastname = customer_info.get("lastname", "")
-        phone_number = customer_info.get("phoneNumber", "")
-
-        total_price = message_data.get("totalPrice", 0)
-        order_status = message_data.get("orderStatus", "")
-
-        order_obj, created = Order.objects.get_or_create(
-            order_code=order_code,
-            defaults={
-                "customer_firstname": firstname,
-                "customer_lastname": lastname,
-                "phone_number": phone_number,
-                "total_price": total_price,
-                "order_status": order_status,
-                "raw_json": message_data,
-            },
-        )
-        if not created:
-            # если уже есть
-            order_obj.customer_firstname = firstname
-            order_obj.customer_lastname = lastname
-            order_obj.phone_number = phone_number
-            order_obj.total_price = total_price
-            order_obj.order_status = order_status
-            order_obj.raw_json = message_data
-            order_obj.save()
-
-        # --- Сохраняем entries
-        entries = message_data.get("entries", [])
-        for entry_data in entries:
-            entry_id = entry_data.get("entryId", None)  # может быть int или None
-
-            # Собираем данные
-            defaults = {
-                "name": entry_data.get("name", ""),
-                "quantity": entry_data.get("quantity", 1),
-                "weight": entry_data.get("weight", 0.0),
-                "base_price": entry_data.get("basePrice", 0),
-                "total_price": entry_data.get("totalPrice", 0),
-                "master_product_code": entry_data.get("masterProductCode", ""),
-                "master_product_url": entry_data.get("masterProductUrl", ""),
-                "master_product_name": entry_data.get("masterProductName", ""),
-                "merchant_product_sku": entry_data.get("merchantProductSKU", ""),
-                "merchant_product_name": entry_data.get("merchantProductName", ""),
-                "raw_entry": entry_data,
-            }
-
-            # Если есть images
-            if "images" in entry_data:
-                defaults["images"] = entry_data["images"]
-
-            # Если есть unit
-            unit_data = entry_data.get("unit", {})
-            defaults["unit_code"] = unit_data.get("code", "")
-            defaults["unit_display_name"] = unit_data.get("displayName", "")
-            defaults["unit_type"] = unit_data.get("type", "")
-
-            # Создаём или обновляем
-            oe, oe_created = OrderEntry.objects.get_or_create(
-                order=order_obj, entry_id=entry_id, defaults=defaults
-            )
-            if not oe_created:
-                # Обновим поля, если что-то изменилось
-                for field_name, field_value in defaults.items():
-                    setattr(oe, field_name, field_value)
-                oe.save()
-
-        # --- теперь history
-        history_list = message_data.get("historyEntries", [])
-        for hist_data in history_list:
-            action = hist_data.get("action", "")
-            user_type = hist_data.get("userType", "")
-            create_ms = hist_data.get("createDate")
-            if create_ms is None:
-                continue
-            create_dt = ms_to_datetime(create_ms)
-
-            oh, oh_created = OrderHistory.objects.get_or_create(
-                order=order_obj,
-                create_date=create_dt,
-                action=action,
-                defaults={
-                    "user_type": user_type,
-                    "user_name": hist_data.get("userName", ""),
-                    "user_email": hist_data.get("userEmail", ""),
-                    "user_phone": hist_data.get("userPhone", ""),
-                    "description": hist_data.get("description", ""),
-                    "raw_data": hist_data,
-                },
-            )
-            if not oh_created:
-                # обновим
-                oh.user_type = user_type
-                oh.user_name = hist_data.get("userName", "")
-                oh.user_email = hist_data.get("userEmail", "")
-                oh.user_phone = hist_data.get("userPhone", "")
-                oh.description = hist_data.get("description", "")
-                oh.raw_data = hist_data
-
-            # Привяжем к Django-пользователю, если MERCHANT_USER
-            user_obj = link_merchant_user(hist_data)
-            if user_obj:
-                oh.processed_by = user_obj
-            oh.save()
+        for oh in summary.new_history:
+            user_obj = oh.processed_by
 
             # === Начисляем баллы, если нужно (action='COMPLETED', MERCHANT_USER, есть processed_by)
-            if (oh_created
-                and action == "COMPLETED"
-                and user_type == "MERCHANT_USER"
+            if (
+                oh.action == "COMPLETED"
+                and oh.user_type == "MERCHANT_USER"
                 and oh.processed_by
             ):
                 # проверим, нет ли уже score
                 already_exists = CourierScore.objects.filter(
-                    user=oh.processed_by, order=oh.order
+                    user=oh.processed_by,
+                    order=oh.order,
+                    reason=CourierScoreReason.DELIVERY,
                 ).exists()
                 if not already_exists:
                     CourierScore.objects.create(
@@ -336,30 +284,22 @@ class Command(BaseCommand):
 
                     # --- Теперь отправим сообщение в другую очередь (telegram_queue)
 
-                    # Сформируем тело сообщения
-                    # Пример: может пригодиться часть данных из message_data, а часть – из oh.order
-                    # Вы берёте поля, которые ваш телеграм-бот в будущем будет использовать.
-
+                    # Только ключи и то, что нужно для текста: клиента, адрес
+                    # и позиции бот читает по orderPK (app_orders.order_summary).
                     telegram_payload = {
-                        # "status": "COMPLETED",
-                        "orderCode": oh.order.order_code,
                         "orderPK": oh.order.pk,
-                        "courierName": oh.user_name,  # имя от Kaspi (MERCHANT_USER)
-                        "courierEmail": oh.user_email,
-                        "courierPK": user_obj.pk,
+                        "orderCode": oh.order.order_code,
                         "chat_id": user_obj.chat_id,
-                        "courierPhone": oh.user_phone,
-                        "customerName": f"{oh.order.customer_firstname} {oh.order.customer_lastname}",
-                        "deliveryAddress": "...",
-                        "firstname": firstname,
-                        "lastname": lastname,
-                        "phone_number": phone_number,
-                        "entries": entries,
-                        "delivery_info": delivery_info,
+                        "courierPK": user_obj.pk,
+                        "courierName": oh.user_name,  # имя от Kaspi (MERCHANT_USER)
                     }
-                    # отправляем
-                    publish_message_to_rabbitmq(
-                        message_body=telegram_payload,
+                    # отправляем только после коммита: в пакетном режиме
+                    # откатившаяся пачка не должна слать уведомления
+                    transaction.on_commit(
+                        partial(
+                            publish_message_to_rabbitmq,
+                            message_body=telegram_payload,
+                        )
                     )
                     self.stdout.write(
                         " [+] Отправили сообщение в очередь telegram_queue"
@@ -370,5 +310,6 @@ class Command(BaseCommand):
                     self.stdout.write(" [+] Цепочке подготовки заказа начислены баллы")
 
         self.stdout.write(
-            f" [√] History entries: {len(history_list)} для заказа {order_code}"
+            f" [√] History entries: {len(message_data.get('historyEntries', []))}"
+            f" для заказа {summary.order.order_code}"
         )
@@ -4,8 +4,8 @@ import logging
 import pika
 from django.core.management.base import BaseCommand
 from django.db import IntegrityError, transaction
-from django.contrib.auth import get_user_model
 
+from app_accounts.user_cache import user_cache
 from app_orders.models import OrderPreparation
 
 log = logging.getLogger(__name__)
@@ -31,15 +31,41 @@ RABBIT_PARAMS = pika.ConnectionParameters(
     credentials=CREDENTIALS,
 )
 
-User = get_user_model()
-
 
 def link_merchant_user(chat_id):
     if chat_id:
-        qs = User.objects.filter(chat_id=chat_id)
-        if qs.exists():
-            return qs.first()
-        return None
+        return user_cache.get_by_chat_id(chat_id)
+
+
+def save_preparation(payload: dict):
+    """
+    Сохраняет событие подготовки заказа из qr_events.
+    Возвращает True, если запись создана, и False для дубликата.
+    KeyError означает битое сообщение.
+    """
+    op = payload["operation"]
+    user_id = payload["userId"]
+    code = payload["qrData"]
+
+    try:
+        with transaction.atomic():
+            executor = link_merchant_user(user_id)
+            _, created = OrderPreparation.objects.get_or_create(
+                order_code=code,
+                preparation_type=op,
+                telegram_chat_id=user_id,
+                executor=executor,
+            )
+    except IntegrityError:
+        # ещё один «страховочный» сценарий на случай гонок
+        log.debug("IntegrityError – duplicate?")
+        return False
+
+    if created:
+        log.info("Saved %s / %s / %s", code, op, user_id)
+    else:
+        log.debug("Duplicate ignored: %s", payload)
+    return created
 
 
 class Command(BaseCommand):
@@ -54,36 +80,12 @@ class Command(BaseCommand):
         channel.basic_qos(prefetch_count=10)
 
         def callback(ch, method, properties, body):
-            # 1. Пытаемся распарсить JSON
+            # 1. Пытаемся распарсить JSON и 2. пишем в базу
             try:
-                payload = json.loads(body)
-                op = payload["operation"]
-                user_id = payload["userId"]
-                code = payload["qrData"]
+                save_preparation(json.loads(body))
             except (ValueError, KeyError) as exc:
                 log.warning("Bad message %s – %s", body, exc)
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-                return
-
-            # 2. Пишем в базу
-            try:
-                with transaction.atomic():
-                    executor = link_merchant_user(user_id)
-                    _, created = OrderPreparation.objects.get_or_create(
-                        order_code=code,
-                        preparation_type=op,
-                        telegram_chat_id=user_id,
-                        executor=executor,
-                    )
-                if created:
-                    log.info("Saved %s / %s / %s", code, op, user_id)
-                else:
-                    log.debug("Duplicate ignored: %s", payload)
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-            except IntegrityError:
-                # ещё один «страховочный» сценарий на случай гонок
-                log.debug("IntegrityError – duplicate?")
-                ch.basic_ack(delivery_tag=method.delivery_tag)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
 
         channel.basic_consume(queue=RABBIT_QR_EVENTS, on_message_callback=callback)
 
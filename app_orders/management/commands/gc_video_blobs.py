@@ -0,0 +1,132 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from app_orders.models import DeliveryProof, VideoBlob
+from app_orders.signals import BLOB_FIELDS
+from app_orders.storage import video_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет файлы видео доставки, на которые больше не ссылается "
+        "ни один DeliveryProof (VideoBlob.ref_count <= 0), и файлы "
+        "хранилища, для которых нет VideoBlob."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-hours",
+            type=int,
+            default=24,
+            help="Keep unreferenced blobs used within the last N hours",
+        )
+        parser.add_argument(
+            "--recount",
+            action="store_true",
+            help="Recompute ref_count from DeliveryProof before collecting",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be deleted",
+        )
+
+    def handle(self, *args, **options):
+        if options["recount"]:
+            fixed = self.recount()
+            self.stdout.write(f"Recounted references, fixed {fixed} blobs.")
+
+        cutoff = timezone.now() - timedelta(hours=options["grace_hours"])
+        candidates = VideoBlob.objects.filter(
+            ref_count__lte=0, last_used_at__lt=cutoff
+        ).values_list("pk", flat=True)
+
+        deleted = freed = 0
+        for blob_id in list(candidates):
+            with transaction.atomic():
+                # перепроверяем под блокировкой: storage._save мог успеть
+                # вернуть файл в оборот
+                blob = (
+                    VideoBlob.objects.select_for_update()
+                    .filter(pk=blob_id, ref_count__lte=0, last_used_at__lt=cutoff)
+                    .first()
+                )
+                if blob is None:
+                    continue
+                deleted += 1
+                freed += blob.size
+                if options["dry_run"]:
+                    self.stdout.write(f"Would delete {blob.name}")
+                    continue
+                blob.delete()
+                video_storage.delete(blob.name)
+
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(f"{verb} {deleted} blobs, {freed / 2**20:.1f} MB.")
+        )
+
+        orphans = freed = 0
+        for name in self.orphan_files(cutoff):
+            path = video_storage.path(name)
+            # перепроверяем: storage._save мог успеть завести строку
+            # и переложить файл заново (mtime станет свежим)
+            if (
+                os.path.getmtime(path) >= cutoff.timestamp()
+                or VideoBlob.objects.filter(name=name).exists()
+            ):
+                continue
+            orphans += 1
+            freed += os.path.getsize(path)
+            if options["dry_run"]:
+                self.stdout.write(f"Would delete orphaned {name}")
+                continue
+            video_storage.delete(name)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {orphans} orphaned files, {freed / 2**20:.1f} MB."
+            )
+        )
+
+    def orphan_files(self, cutoff):
+        """
+        Файлы в каталоге блобов без строки VideoBlob, не менявшиеся с cutoff.
+        Остаются после отката транзакции, сохранявшей видео. Свежие не трогаем:
+        их строка может быть ещё не закоммичена.
+        """
+        root = video_storage.path(video_storage.prefix)
+        names = []
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if os.path.getmtime(path) < cutoff.timestamp():
+                    relative = os.path.relpath(path, video_storage.location)
+                    names.append(relative.replace(os.sep, "/"))
+
+        orphans = []
+        for start in range(0, len(names), 1000):
+            chunk = names[start : start + 1000]
+            known = set(
+                VideoBlob.objects.filter(name__in=chunk).values_list("name", flat=True)
+            )
+            orphans.extend(name for name in chunk if name not in known)
+        return orphans
+
+    def recount(self) -> int:
+        counts = {}
+        for names in DeliveryProof.objects.values_list(*BLOB_FIELDS).iterator():
+            for name in names:
+                if name:
+                    counts[name] = counts.get(name, 0) + 1
+
+        fixed = 0
+        for blob in VideoBlob.objects.only("pk", "name", "ref_count").iterator():
+            actual = counts.get(blob.name, 0)
+            if blob.ref_count != actual:
+                VideoBlob.objects.filter(pk=blob.pk).update(ref_count=actual)
+                fixed += 1
+        return fixed
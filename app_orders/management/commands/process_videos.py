@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from app_orders.models import DeliveryProof
+from app_orders.video_processing import process_delivery_proof
+
+
+class Command(BaseCommand):
+    help = (
+        "Обрабатывает видео доставки, минуя очередь: старые записи "
+        "до появления обработки, потерянные сообщения и повтор ошибок."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Also retry videos whose processing failed",
+        )
+        parser.add_argument(
+            "--limit", type=int, default=None, help="Process at most N videos"
+        )
+
+    def handle(self, *args, **options):
+        statuses = ["pending"]
+        if options["retry_failed"]:
+            statuses.append("failed")
+        proofs = (
+            DeliveryProof.objects.filter(processing_status__in=statuses)
+            .exclude(video="")
+            .exclude(video__isnull=True)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        if options["limit"]:
+            proofs = proofs[: options["limit"]]
+
+        done = failed = 0
+        for proof_id in proofs:
+            try:
+                if process_delivery_proof(proof_id):
+                    done += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f" [!] DeliveryProof {proof_id}: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Processed {done}, failed {failed}."))
@@ -0,0 +1,74 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from app_accounts.models import CourierScore
+from app_orders.models import Order
+
+
+def actual_points():
+    """Сумма CourierScore.points заказа как выражение для annotate/update."""
+    order_points = (
+        CourierScore.objects.filter(order=OuterRef("pk"))
+        .values("order")
+        .annotate(total=Sum("points"))
+        .values("total")
+    )
+    return Coalesce(
+        Subquery(order_points, output_field=Order._meta.get_field("points_total")),
+        Value(Decimal("0.00")),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет Order.points_total с суммой CourierScore и исправляет "
+        "расхождения (первичное заполнение и починка после QuerySet.update)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=10000,
+            help="How many order ids to check per query (default: 10000)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report mismatches, do not update",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        bounds = Order.objects.aggregate(low=Min("pk"), high=Max("pk"))
+        if bounds["low"] is None:
+            self.stdout.write("No orders.")
+            return
+
+        checked = mismatched = 0
+        for start in range(bounds["low"], bounds["high"] + 1, chunk_size):
+            chunk = Order.objects.filter(pk__gte=start, pk__lt=start + chunk_size)
+            # расхождения ищем и чиним одним UPDATE на пачку,
+            # итог считается в том же запросе, что и запись
+            stale = chunk.annotate(actual=actual_points()).exclude(
+                points_total=F("actual")
+            )
+            checked += chunk.count()
+            if options["dry_run"]:
+                for order_code, points_total, actual in stale.values_list(
+                    "order_code", "points_total", "actual"
+                ):
+                    self.stdout.write(f" [!] {order_code}: {points_total} != {actual}")
+                    mismatched += 1
+            else:
+                mismatched += Order.objects.filter(pk__in=stale.values("pk")).update(
+                    points_total=actual_points()
+                )
+
+        verb = "found" if options["dry_run"] else "fixed"
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} orders, {verb} {mismatched}.")
+        )
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:18
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_history(apps, schema_editor):
+    """
+    До уникального ключа get_or_create при гонках мог записать одно событие
+    дважды. Оставляем самую раннюю строку, иначе ограничение не создастся.
+    """
+    OrderHistory = apps.get_model("app_orders", "OrderHistory")
+    duplicates = (
+        OrderHistory.objects.values("order", "create_date", "action")
+        .annotate(keep=Min("pk"), copies=Count("pk"))
+        .filter(copies__gt=1)
+        .order_by()
+    )
+    for row in duplicates.iterator():
+        OrderHistory.objects.filter(
+            order=row["order"], create_date=row["create_date"], action=row["action"]
+        ).exclude(pk=row["keep"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_orders", "0012_orderpreparation_uniq_prep_event"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_history, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="orderhistory",
+            constraint=models.UniqueConstraint(
+                fields=("order", "create_date", "action"),
+                name="uniq_order_history_event",
+            ),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:28
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_points_total(apps, schema_editor):
+    Order = apps.get_model("app_orders", "Order")
+    CourierScore = apps.get_model("app_accounts", "CourierScore")
+
+    order_points = (
+        CourierScore.objects.filter(order=OuterRef("pk"))
+        .values("order")
+        .annotate(total=Sum("points"))
+        .values("total")
+    )
+    Order.objects.filter(pk__in=CourierScore.objects.values("order_id")).update(
+        points_total=Coalesce(
+            Subquery(order_points, output_field=models.DecimalField()),
+            Value(Decimal("0.00")),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_orders", "0013_orderhistory_uniq_order_history_event"),
+        ("app_accounts", "0006_user_city"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="points_total",
+            field=models.DecimalField(
+                db_index=True,
+                decimal_places=2,
+                default=0,
+                max_digits=12,
+                verbose_name="Баллы",
+            ),
+        ),
+        migrations.RunPython(backfill_points_total, migrations.RunPython.noop),
+    ]
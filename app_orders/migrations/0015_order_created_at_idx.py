@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:30
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокирует запись в большие таблицы,
+    # но не может выполняться внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ("app_orders", "0014_order_points_total"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="order",
+            index=models.Index(fields=["created_at"], name="order_created_at_idx"),
+        ),
+    ]
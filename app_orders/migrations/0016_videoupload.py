@@ -0,0 +1,66 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:35
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_orders", "0015_order_created_at_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VideoUpload",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("filename", models.CharField(max_length=255)),
+                (
+                    "size",
+                    models.PositiveBigIntegerField(
+                        blank=True,
+                        help_text="Заявленный размер файла, если известен",
+                        null=True,
+                    ),
+                ),
+                (
+                    "received",
+                    models.PositiveBigIntegerField(
+                        default=0, help_text="Сколько байт уже записано"
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "courier",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="video_uploads",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="video_uploads",
+                        to="app_orders.order",
+                    ),
+                ),
+            ],
+        ),
+    ]
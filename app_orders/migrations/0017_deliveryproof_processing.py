@@ -0,0 +1,70 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_orders", "0016_videoupload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deliveryproof",
+            name="duration",
+            field=models.FloatField(
+                blank=True, help_text="Длительность видео, секунд", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="deliveryproof",
+            name="processed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="deliveryproof",
+            name="processing_status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "В очереди"),
+                    ("done", "Обработано"),
+                    ("failed", "Ошибка"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="deliveryproof",
+            name="rendition",
+            field=models.FileField(
+                blank=True,
+                help_text="Сжатая копия видео (H.264, до 720p)",
+                null=True,
+                upload_to="delivery_proofs/renditions/",
+            ),
+        ),
+        migrations.AddField(
+            model_name="deliveryproof",
+            name="thumbnail",
+            field=models.FileField(
+                blank=True,
+                help_text="Кадр-превью для админки",
+                null=True,
+                upload_to="delivery_proofs/thumbnails/",
+            ),
+        ),
+        migrations.AddField(
+            model_name="deliveryproof",
+            name="video_sha256",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="deliveryproof",
+            name="video_size",
+            field=models.PositiveBigIntegerField(
+                blank=True, help_text="Размер исходного файла, байт", null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:40
+
+import app_orders.storage
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_orders", "0017_deliveryproof_processing"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VideoBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("sha256", models.CharField(db_index=True, max_length=64)),
+                ("size", models.PositiveBigIntegerField()),
+                ("ref_count", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("last_used_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="deliveryproof",
+            name="rendition",
+            field=models.FileField(
+                blank=True,
+                help_text="Сжатая копия видео (H.264, до 720p)",
+                null=True,
+                storage=app_orders.storage.ContentAddressedStorage(),
+                upload_to="delivery_proofs/renditions/",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="deliveryproof",
+            name="thumbnail",
+            field=models.FileField(
+                blank=True,
+                help_text="Кадр-превью для админки",
+                null=True,
+                storage=app_orders.storage.ContentAddressedStorage(),
+                upload_to="delivery_proofs/thumbnails/",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="deliveryproof",
+            name="video",
+            field=models.FileField(
+                blank=True,
+                help_text="Видео-доказательство доставки (опционально). Допустимые форматы: mp4, mov, avi, mkv.",
+                null=True,
+                storage=app_orders.storage.ContentAddressedStorage(),
+                upload_to="delivery_proofs/",
+                validators=[
+                    django.core.validators.FileExtensionValidator(
+                        allowed_extensions=["mp4", "mov", "avi", "mkv"]
+                    )
+                ],
+            ),
+        ),
+    ]
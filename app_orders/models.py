@@ -1,4 +1,7 @@
+import uuid
+
 from django.db import models
+from django.db.models import F
 
 from django.conf import settings
 from django.core.validators import (
@@ -7,6 +10,8 @@ from django.core.validators import (
     FileExtensionValidator,
 )
 
+from app_orders.storage import video_storage
+
 
 class Order(models.Model):
     order_code = models.CharField(max_length=50, unique=True)
@@ -15,6 +20,12 @@ class Order(models.Model):
     phone_number = models.CharField(max_length=50, blank=True)
     total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     order_status = models.CharField(max_length=50, blank=True)
+    # Сумма CourierScore.points по заказу. Ведётся сигналами и
+    # CourierScoreQuerySet.bulk_create (app_accounts), сверяется
+    # командой reconcile_points.
+    points_total = models.DecimalField(
+        "Баллы", max_digits=12, decimal_places=2, default=0, db_index=True
+    )
 
     # Дополнительно можно хранить сырые данные (JSONField, если нужно)
     raw_json = models.JSONField(null=True, blank=True)
@@ -22,6 +33,12 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # date_hierarchy и сортировка по дате в админке
+            models.Index(fields=["created_at"], name="order_created_at_idx"),
+        ]
+
     def __str__(self):
         return f"Order {self.order_code} ({self.order_status})"
 
@@ -86,6 +103,15 @@ class OrderHistory(models.Model):
         related_name="order_history_entries",
     )
 
+    class Meta:
+        # ключ, по которому consume_orders делает upsert истории
+        constraints = [
+            models.UniqueConstraint(
+                fields=["order", "create_date", "action"],
+                name="uniq_order_history_event",
+            )
+        ]
+
     def __str__(self):
         return f"[{self.order.order_code}] {self.action} ({self.user_type})"
 
@@ -157,6 +183,7 @@ class DeliveryProof(models.Model):
     )
     video = models.FileField(
         upload_to="delivery_proofs/",
+        storage=video_storage,
         null=True,
         blank=True,
         validators=[
@@ -168,10 +195,106 @@ class DeliveryProof(models.Model):
         auto_now_add=True, help_text="Дата и время загрузки видео"
     )
 
+    # Заполняется фоновой обработкой (app_orders.video_processing)
+    PROCESSING_CHOICES = (
+        ("pending", "В очереди"),
+        ("done", "Обработано"),
+        ("failed", "Ошибка"),
+    )
+    processing_status = models.CharField(
+        max_length=10, choices=PROCESSING_CHOICES, default="pending"
+    )
+    rendition = models.FileField(
+        upload_to="delivery_proofs/renditions/",
+        storage=video_storage,
+        null=True,
+        blank=True,
+        help_text="Сжатая копия видео (H.264, до 720p)",
+    )
+    thumbnail = models.FileField(
+        upload_to="delivery_proofs/thumbnails/",
+        storage=video_storage,
+        null=True,
+        blank=True,
+        help_text="Кадр-превью для админки",
+    )
+    video_size = models.PositiveBigIntegerField(
+        null=True, blank=True, help_text="Размер исходного файла, байт"
+    )
+    duration = models.FloatField(
+        null=True, blank=True, help_text="Длительность видео, секунд"
+    )
+    video_sha256 = models.CharField(max_length=64, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
     def __str__(self):
         return f"Видео доставки для заказа {self.order.order_code}"
 
 
+class VideoBlob(models.Model):
+    """
+    Файл в контентно-адресуемом хранилище (app_orders.storage).
+    ref_count — сколько полей DeliveryProof (video, rendition, thumbnail)
+    на него ссылается; ведётся сигналами, сверяется gc_video_blobs --recount.
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} ссылок)"
+
+
+def change_blob_refs(added=(), removed=()):
+    """Меняет ref_count у VideoBlob; имена вне хранилища блобов игнорируются."""
+    deltas = {}
+    for name in added:
+        if name:
+            deltas[name] = deltas.get(name, 0) + 1
+    for name in removed:
+        if name:
+            deltas[name] = deltas.get(name, 0) - 1
+    for name, delta in deltas.items():
+        if delta:
+            VideoBlob.objects.filter(name=name).update(ref_count=F("ref_count") + delta)
+
+
+class VideoUpload(models.Model):
+    """
+    Незавершённая загрузка видео доставки по частям (см. app_orders.uploads).
+    Части дописываются во временный файл, после проверки размера и sha256
+    файл переносится в DeliveryProof.video, а запись удаляется.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name="video_uploads"
+    )
+    courier = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="video_uploads",
+    )
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(
+        null=True, blank=True, help_text="Заявленный размер файла, если известен"
+    )
+    received = models.PositiveBigIntegerField(
+        default=0, help_text="Сколько байт уже записано"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Загрузка {self.filename} для заказа {self.order.order_code}"
+
+
 class OrderPreparation(models.Model):
     order_code = models.CharField(max_length=50)
     preparation_type = models.CharField(max_length=20)
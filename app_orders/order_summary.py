@@ -0,0 +1,114 @@
+"""
+Краткая сводка заказа для телеграм-бота: клиент, телефон, адрес, позиции.
+
+В telegram_queue уходят только orderPK, chat_id и пара полей для
+отображения, а детали бот читает отсюда. Сводка собирается двумя
+узкими запросами к Order/OrderEntry (из raw_json берётся только адрес)
+и держится в памяти процесса (LRU + TTL): опрос курьеру и оповещение
+группам по одному заказу читают её из кэша.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.models.fields.json import KT
+
+from app_orders.models import Order, OrderEntry
+
+
+def format_price(value) -> str:
+    # 12990.00 -> "12990", 199.50 -> "199.5"
+    return f"{value.normalize():f}" if value is not None else "0"
+
+
+def load_order_summary(order_pk):
+    order = (
+        Order.objects.filter(pk=order_pk)
+        .values(
+            "pk",
+            "order_code",
+            "customer_firstname",
+            "customer_lastname",
+            "phone_number",
+            address=KT("raw_json__delivery__address__formattedAddress"),
+        )
+        .first()
+    )
+    if order is None:
+        return None
+    entries = OrderEntry.objects.filter(order_id=order_pk).order_by("entry_id", "pk")
+    return {
+        "pk": order["pk"],
+        "order_code": order["order_code"],
+        "customer_name": (
+            f"{order['customer_firstname']} {order['customer_lastname']}".strip()
+        ),
+        "phone_number": order["phone_number"],
+        "address": order["address"] or "",
+        "entries": [
+            {
+                "name": name,
+                "total_price": format_price(total_price),
+                "quantity": quantity,
+            }
+            for name, total_price, quantity in entries.values_list(
+                "name", "total_price", "quantity"
+            )
+        ],
+    }
+
+
+class OrderSummaryCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # order_pk -> (expires_at, summary)
+
+    def get(self, order_pk):
+        """Сводка заказа или None, если заказа нет."""
+        if order_pk in (None, ""):
+            return None
+        order_pk = int(order_pk)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(order_pk)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(order_pk)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(order_pk, None)
+            self.misses += 1
+
+        # промахи не кэшируем: заказ может появиться чуть позже уведомления
+        summary = load_order_summary(order_pk)
+        if summary is not None:
+            with self._lock:
+                self._entries[order_pk] = (now + self.ttl, summary)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return summary
+
+    def invalidate(self, order_pk):
+        with self._lock:
+            self._entries.pop(int(order_pk), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._entries),
+        }
+
+
+order_summary_cache = OrderSummaryCache()
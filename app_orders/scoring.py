@@ -0,0 +1,108 @@
+"""
+Начисление баллов цепочке подготовки заказа (OrderPreparation).
+
+Каждый тип подготовки (отгрузка, упаковка) стоит 1 балл, который делится
+поровну между всеми, кто отсканировал заказ на этом шаге.
+"""
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Min, Window
+
+from app_accounts.models import CourierScore, CourierScoreReason
+from app_orders.models import Order, OrderPreparation
+
+PREPARATION_TYPES = ("shipment", "packing")
+
+# сколько заказов берём в один запрос при пересчёте больших периодов
+CHUNK_SIZE = 1000
+
+
+def score_preparations(orders) -> list:
+    """
+    Начисляет баллы за подготовку сразу для пачки заказов:
+    один запрос с оконным COUNT по (order_code, preparation_type)
+    и один bulk_create для всех CourierScore.
+    Прежние баллы за подготовку этих заказов заменяются в той же транзакции,
+    так что повторный вызов (например, после позднего скана) их не удваивает.
+    Пересозданные строки сохраняют created_at прежних: баллы остаются в том
+    дне, когда были начислены, и DailyScore не переносит их на сегодня.
+    """
+    orders_by_code = {order.order_code: order for order in orders}
+    if not orders_by_code:
+        return []
+
+    with transaction.atomic():
+        # параллельный пересчёт тех же заказов ждёт здесь, а не удваивает баллы
+        list(
+            Order.objects.select_for_update()
+            .filter(pk__in=[order.pk for order in orders_by_code.values()])
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+
+        # Считаем всех участников шага, в том числе без executor:
+        # их доля просто никому не достаётся (как и раньше).
+        rows = (
+            OrderPreparation.objects.filter(
+                order_code__in=orders_by_code, preparation_type__in=PREPARATION_TYPES
+            )
+            .annotate(
+                participants=Window(
+                    Count("pk"), partition_by=[F("order_code"), F("preparation_type")]
+                )
+            )
+            .values_list("order_code", "executor_id", "participants")
+        )
+        scores = [
+            CourierScore(
+                user_id=executor_id,
+                order=orders_by_code[order_code],
+                points=Decimal("1") / Decimal(participants),
+                reason=CourierScoreReason.PREPARATION,
+            )
+            for order_code, executor_id, participants in rows
+            if executor_id
+        ]
+
+        previous = CourierScore.objects.filter(
+            order__in=orders_by_code.values(), reason=CourierScoreReason.PREPARATION
+        )
+        scored_at = {
+            (row["order"], row["user"]): row["created_at"]
+            for row in previous.values("order", "user")
+            .annotate(created_at=Min("created_at"))
+            .order_by()
+        }
+        # post_delete вычитает старые баллы из Order.points_total
+        previous.delete()
+        created = CourierScore.objects.bulk_create(scores)
+
+        # auto_now_add при вставке всегда ставит «сейчас» — возвращаем дату
+        backdated = []
+        for score in created:
+            created_at = scored_at.get((score.order_id, score.user_id))
+            if created_at is not None:
+                score.created_at = created_at
+                backdated.append(score)
+        CourierScore.objects.bulk_update(backdated, ["created_at"], batch_size=1000)
+        return created
+
+
+def give_out_points(order_code, order_obj):
+    return score_preparations([order_obj])
+
+
+def score_orders(order_codes) -> int:
+    """
+    Пересчёт для списка кодов заказов (например, за прошедший месяц).
+    Возвращает количество созданных CourierScore.
+    """
+    order_codes = list(order_codes)
+    created = 0
+    for start in range(0, len(order_codes), CHUNK_SIZE):
+        chunk = order_codes[start : start + CHUNK_SIZE]
+        orders = Order.objects.filter(order_code__in=chunk)
+        created += len(score_preparations(orders))
+    return created
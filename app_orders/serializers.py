@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import DeliveryProof, Order
 from app_accounts.models import CourierScore
+from .video_processing import enqueue_video_processing
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -36,8 +37,15 @@ class DeliveryProofCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({"courier_id": "Курьер не найден."})
 
         delivery_proof, created = DeliveryProof.objects.update_or_create(
-            order=order, defaults={"courier": courier, **validated_data}
+            order=order,
+            defaults={
+                "courier": courier,
+                "processing_status": "pending",
+                **validated_data,
+            },
         )
+        if delivery_proof.video:
+            enqueue_video_processing(delivery_proof)
         if created:
             CourierScore.objects.create(
                 user=courier,
@@ -45,3 +53,33 @@ class DeliveryProofCreateSerializer(serializers.ModelSerializer):
                 points=1,
             )
         return delivery_proof
+
+
+class VideoUploadStartSerializer(serializers.Serializer):
+    """Начало загрузки по частям: те же order_code и courier_id, что и выше."""
+
+    order_code = serializers.CharField()
+    courier_id = serializers.IntegerField()
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1, required=False)
+    # если клиент знает хэш, уже загруженное видео привяжется без передачи
+    sha256 = serializers.RegexField(r"^[0-9a-fA-F]{64}$", required=False)
+
+    def validate(self, attrs):
+        try:
+            order = Order.objects.get(order_code=attrs["order_code"])
+        except Order.DoesNotExist:
+            raise serializers.ValidationError(
+                {"order_code": "Заказ с таким кодом не найден."}
+            )
+        try:
+            courier = User.objects.get(chat_id=attrs["courier_id"])
+        except User.DoesNotExist:
+            raise serializers.ValidationError({"courier_id": "Курьер не найден."})
+        return {
+            "order": order,
+            "courier": courier,
+            "filename": attrs["filename"],
+            "size": attrs.get("size"),
+            "sha256": attrs.get("sha256"),
+        }
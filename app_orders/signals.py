@@ -0,0 +1,48 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from app_orders.models import DeliveryProof, change_blob_refs
+
+# поля DeliveryProof, которые хранятся в контентно-адресуемом хранилище
+BLOB_FIELDS = ("video", "rendition", "thumbnail")
+
+
+def stored_blob_names(pk) -> dict:
+    """Имена файлов из БД: объект в памяти может быть устаревшим."""
+    row = DeliveryProof.objects.filter(pk=pk).values(*BLOB_FIELDS).first()
+    return row or {}
+
+
+def saved_fields(update_fields):
+    if update_fields is None:
+        return BLOB_FIELDS
+    return [field for field in BLOB_FIELDS if field in update_fields]
+
+
+@receiver(pre_save, sender=DeliveryProof)
+def remember_blobs_before_save(sender, instance, raw=False, **kwargs):
+    instance._blobs_before = {}
+    if not raw and instance.pk is not None:
+        instance._blobs_before = stored_blob_names(instance.pk)
+
+
+@receiver(post_save, sender=DeliveryProof)
+def count_blob_refs_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    before = getattr(instance, "_blobs_before", {})
+    fields = saved_fields(update_fields)
+    change_blob_refs(
+        added=[getattr(instance, field).name for field in fields],
+        removed=[before.get(field) for field in fields],
+    )
+
+
+@receiver(pre_delete, sender=DeliveryProof)
+def remember_blobs_before_delete(sender, instance, **kwargs):
+    instance._blobs_before = stored_blob_names(instance.pk)
+
+
+@receiver(post_delete, sender=DeliveryProof)
+def release_blobs_on_delete(sender, instance, **kwargs):
+    change_blob_refs(removed=getattr(instance, "_blobs_before", {}).values())
@@ -0,0 +1,82 @@
+"""
+Контентно-адресуемое хранилище для видео доставки.
+
+Имя файла — sha256 содержимого, поэтому одно и то же видео (курьер
+переотправил ролик, повторная загрузка) лежит на диске один раз.
+Для каждого файла есть VideoBlob со счётчиком ссылок из DeliveryProof;
+файлы без ссылок удаляет команда gc_video_blobs. Файл кладётся на место
+до коммита строки VideoBlob, поэтому после отката транзакции он остаётся
+без строки — такие файлы gc_video_blobs находит обходом каталога.
+"""
+
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def __init__(self, prefix="delivery_proofs/blobs", **kwargs):
+        super().__init__(**kwargs)
+        self.prefix = prefix
+
+    def get_available_name(self, name, max_length=None):
+        # одинаковое имя = одинаковое содержимое, суффиксы не нужны
+        return name
+
+    def blob_name(self, sha256: str, ext: str) -> str:
+        return posixpath.join(self.prefix, sha256[:2], f"{sha256}{ext}")
+
+    def _save(self, name, content):
+        from app_orders.models import VideoBlob
+
+        ext = os.path.splitext(name)[1].lower()
+        tmp_dir = os.path.join(self.location, "uploads_tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # хэш считаем на лету, пока пишем во временный файл
+        digest = hashlib.sha256()
+        size = 0
+        tmp = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        try:
+            with tmp:
+                if hasattr(content, "seek"):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+            name = self.blob_name(digest.hexdigest(), ext)
+
+            # Строка VideoBlob блокируется, пока сохраняем файл, а last_used_at
+            # не даёт gc_video_blobs удалить его до того, как на него сошлются.
+            with transaction.atomic():
+                blob, created = VideoBlob.objects.select_for_update().get_or_create(
+                    name=name, defaults={"sha256": digest.hexdigest(), "size": size}
+                )
+                if not created:
+                    blob.last_used_at = timezone.now()
+                    blob.save(update_fields=["last_used_at"])
+                # новая строка при уже лежащем файле — его оставила
+                # откатившаяся транзакция; перезаписываем, обновляя mtime
+                if created or not self.exists(name):
+                    path = self.path(name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    file_move_safe(tmp.name, path, allow_overwrite=True)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(path, self.file_permissions_mode)
+        finally:
+            # файл уже был или сохранение не удалось
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+        return name
+
+
+video_storage = ContentAddressedStorage()
@@ -1,3 +1,932 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from app_accounts.models import CourierScore, CourierScoreReason
+from app_accounts.user_cache import user_cache
+from app_orders.management.commands.consume_all import DEFAULT_CONCURRENCY
+from app_orders.management.commands.consume_all import Command as ConsumeAllCommand
+from app_orders.management.commands.consume_orders import (
+    Command as ConsumeOrdersCommand,
+)
+from app_orders.ingest import ingest_order
+from app_orders.models import (
+    ConsumerSentiment,
+    DeliveryProof,
+    Order,
+    OrderEntry,
+    OrderHistory,
+    OrderPreparation,
+    VideoBlob,
+    VideoUpload,
+)
+from app_orders.order_summary import OrderSummaryCache, load_order_summary
+from app_orders.scoring import give_out_points, score_orders, score_preparations
+from app_orders.storage import video_storage
+from app_orders.uploads import MAX_VIDEO_SIZE, append_chunk
+from app_orders.video_processing import (
+    RABBIT_QUEUE_VIDEO,
+    enqueue_video_processing,
+    process_video_message,
+)
+
+
+class OrderAdminChangelistQueriesTest(TestCase):
+    """Число запросов страницы списка заказов не зависит от числа строк."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        cls.courier = User.objects.create_user("courier", phone_number="77010000000")
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def create_orders(self, start, count):
+        now = timezone.now()
+        for i in range(start, start + count):
+            order = Order.objects.create(order_code=f"ORD{i}")
+            for create_date, user_type, user_name in (
+                (now - timedelta(hours=1), "KASPI_USER", "kaspi"),
+                (now, "MERCHANT_USER", f"courier{i}"),
+            ):
+                OrderHistory.objects.create(
+                    order=order,
+                    create_date=create_date,
+                    action="COMPLETED",
+                    user_type=user_type,
+                    user_name=user_name,
+                    user_phone="77010000000",
+                )
+            ConsumerSentiment.objects.create(
+                order=order, courier=self.courier, sentiment="excellent"
+            )
+            DeliveryProof.objects.create(order=order, courier=self.courier)
+            CourierScore.objects.create(user=self.courier, order=order)
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("admin:app_orders_order_changelist"))
+        self.assertEqual(response.status_code, 200)
+        self.sql = [query["sql"] for query in ctx.captured_queries]
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_is_constant(self):
+        self.create_orders(0, 2)
+        _, few = self.changelist_queries()
+
+        self.create_orders(2, 40)
+        response, many = self.changelist_queries()
+
+        self.assertEqual(few, many)
+        self.assertContains(response, "[MERCHANT_USER] courier41 77010000000")
+        self.assertEqual(response.context_data["total_points"], 42)
+
+    def test_last_history_is_one_subquery(self):
+        self.create_orders(0, 1)
+        self.changelist_queries()
+
+        history_table = OrderHistory._meta.db_table
+        (page,) = [sql for sql in self.sql if f'FROM "{history_table}"' in sql]
+        self.assertEqual(page.count(f'FROM "{history_table}"'), 1)
+
+    def test_order_without_history(self):
+        Order.objects.create(order_code="EMPTY")
+        response, _ = self.changelist_queries()
+        self.assertContains(response, "EMPTY")
+
+
+def kaspi_message(order_code="KSP1", entries=None, history=None):
+    return {
+        "orderCode": order_code,
+        "customer": {"firstname": "Айгерим", "lastname": "С.", "phoneNumber": "7701"},
+        "totalPrice": 1000,
+        "orderStatus": "COMPLETED",
+        "entries": entries if entries is not None else [],
+        "historyEntries": history if history is not None else [],
+    }
+
+
+class IngestOrderTest(TestCase):
+    """ingest_order: вставка и обновление заказа, позиций и истории."""
+
+    history = [
+        {"createDate": 1700000000000, "action": "CREATED", "userType": "KASPI_USER"},
+        {
+            "createDate": 1700000600000,
+            "action": "COMPLETED",
+            "userType": "MERCHANT_USER",
+            "userName": "Курьер Один",
+            "userEmail": "c1@example.com",
+            "userPhone": "87010000001",
+        },
+        {"action": "NO_DATE"},
+    ]
+    entries = [
+        {"entryId": 1, "name": "Чайник", "images": ["i"]},
+        {"entryId": 2, "name": "Кружка"},
+        {"entryId": None, "name": "Без id"},
+    ]
+
+    def test_summary_counts(self):
+        summary = ingest_order(
+            kaspi_message(entries=self.entries, history=self.history)
+        )
+        self.assertTrue(summary.order_created)
+        self.assertEqual((summary.entries_inserted, summary.entries_updated), (3, 0))
+        self.assertEqual((summary.history_inserted, summary.history_updated), (2, 0))
+        self.assertEqual(
+            [h.action for h in summary.new_history], ["CREATED", "COMPLETED"]
+        )
+        courier = summary.new_history[1].processed_by
+        self.assertEqual(courier.email, "c1@example.com")
+        self.assertIsNone(ingest_order({"entries": []}))
+
+    def test_reingest_updates_in_place(self):
+        ingest_order(kaspi_message(entries=self.entries, history=self.history))
+        entries = [
+            {"entryId": 1, "name": "Чайник 2"},  # без images
+            {"entryId": None, "name": "Без id, обновлено"},
+            {"entryId": 3, "name": "Новая"},
+        ]
+        summary = ingest_order(kaspi_message(entries=entries, history=self.history))
+
+        self.assertFalse(summary.order_created)
+        self.assertEqual((summary.entries_inserted, summary.entries_updated), (1, 2))
+        self.assertEqual((summary.history_inserted, summary.history_updated), (0, 2))
+        self.assertEqual(summary.new_history, [])
+        order = summary.order
+        self.assertEqual(order.entries.count(), 4)
+        self.assertEqual(order.history.count(), 2)
+        self.assertEqual(order.entries.get(entry_id=None).name, "Без id, обновлено")
+        kettle = order.entries.get(entry_id=1)
+        self.assertEqual(kettle.name, "Чайник 2")
+        self.assertEqual(kettle.images, ["i"])
+        # один пользователь на курьера, сколько бы раз заказ ни пришёл
+        self.assertEqual(
+            get_user_model().objects.filter(email="c1@example.com").count(), 1
+        )
+
+        ingest_order(kaspi_message(entries=[{"entryId": 1, "images": []}]))
+        self.assertEqual(order.entries.get(entry_id=1).images, [])
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acked, self.nacked, self.published = [], [], []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.nacked.append((delivery_tag, requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append((routing_key, body, properties.headers))
+
+
+@mock.patch("app_orders.management.commands.consume_orders.REQUEUE_DELAY_SECONDS", 0)
+@mock.patch("app_orders.management.commands.consume_orders.publish_message_to_rabbitmq")
+class ConsumeOrdersBatchTest(TransactionTestCase):
+    """
+    Пакетный режим consume_orders: битые сообщения находим делением пачки
+    и откладываем в DLQ, при сбое БД возвращаем всю пачку в очередь.
+    """
+
+    def setUp(self):
+        user_cache.clear()
+        self.command = ConsumeOrdersCommand(stdout=StringIO(), stderr=StringIO())
+
+    def message(self, order_code):
+        history = [
+            {
+                "createDate": 1700000600000,
+                "action": "COMPLETED",
+                "userType": "MERCHANT_USER",
+                "userName": "Курьер",
+                "userEmail": "courier@example.com",
+                "userPhone": "87010000009",
+            }
+        ]
+        return json.dumps(kaspi_message(order_code, history=history)).encode()
+
+    def test_bad_message_in_the_middle(self, publish):
+        batch = [
+            (1, self.message("A1")),
+            (2, self.message("A2")),
+            (3, b"{not json"),
+            (4, self.message("A3")),
+        ]
+        self.command.process_batch(channel := FakeChannel(), "orders_queue", batch)
+
+        self.assertEqual(channel.nacked, [])
+        ((queue, body, headers),) = channel.published
+        self.assertEqual((queue, body), ("orders_queue.dlq", b"{not json"))
+        self.assertIn("JSONDecodeError", headers["x-error"])
+        self.assertEqual(headers["x-original-queue"], "orders_queue")
+        self.assertEqual(channel.acked, [(3, False), (4, True)])
+        self.assertEqual(
+            sorted(Order.objects.values_list("order_code", flat=True)),
+            ["A1", "A2", "A3"],
+        )
+        # курьер из откатившейся пачки не должен остаться в кэше
+        self.assertEqual(CourierScore.objects.count(), 3)
+        self.assertEqual(get_user_model().objects.count(), 1)
+        self.assertEqual(publish.call_count, 3)
+
+    def test_database_outage_requeues_whole_batch(self, publish):
+        batch = [(tag, self.message(f"B{tag}")) for tag in (1, 2, 3)]
+        with mock.patch.object(
+            self.command,
+            "save_order_to_db",
+            side_effect=OperationalError("server closed the connection"),
+        ) as save:
+            self.command.process_batch(channel := FakeChannel(), "orders_queue", batch)
+
+        # сбой не из-за сообщений — пачку не делим и ничего не теряем
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(channel.nacked, [(1, True), (2, True), (3, True)])
+        self.assertEqual(channel.acked, [])
+        self.assertEqual(channel.published, [])
+        self.assertFalse(Order.objects.exists())
+        publish.assert_not_called()
+
+    def test_every_message_failing_goes_to_dlq(self, publish):
+        batch = [(tag, self.message(f"B{tag}")) for tag in (1, 2, 3)]
+        with mock.patch.object(
+            self.command, "save_order_to_db", side_effect=DatabaseError("boom")
+        ):
+            self.command.process_batch(channel := FakeChannel(), "orders_queue", batch)
+
+        self.assertEqual(
+            [body for _, body, _ in channel.published], [b for _, b in batch]
+        )
+        self.assertEqual(channel.acked, [(1, False), (2, False), (3, False)])
+        self.assertEqual(channel.nacked, [])
+        publish.assert_not_called()
+
+
+class FakeIncomingMessage:
+    def __init__(self, body):
+        self.body = body
+        self.headers = {}
+        self.content_type = "application/json"
+        self.outcome = None
+
+    async def ack(self):
+        self.outcome = "ack"
+
+    async def nack(self, requeue=True):
+        self.outcome = f"nack(requeue={requeue})"
+
+    async def reject(self, requeue=False):
+        self.outcome = f"reject(requeue={requeue})"
+
+
+@mock.patch("app_orders.management.commands.consume_all.REQUEUE_DELAY_SECONDS", new=0)
+class ConsumeAllCallbackTest(SimpleTestCase):
+    """consume_all теряет только битый JSON, сбои БД возвращает в очередь."""
+
+    def deliver(self, body, handler):
+        command = ConsumeAllCommand()
+        command.handlers = {"orders_queue": handler}
+        command.in_flight = set()
+        command.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(command.executor.shutdown)
+        channel = mock.Mock()
+        channel.default_exchange.publish = mock.AsyncMock()
+        message = FakeIncomingMessage(body)
+        with self.assertLogs("app_orders.management.commands.consume_all"):
+            asyncio.run(command.make_callback("orders_queue", channel)(message))
+        return message, channel.default_exchange.publish
+
+    def test_malformed_json_is_dropped(self):
+        message, publish = self.deliver(b"{oops", mock.Mock())
+        self.assertEqual(message.outcome, "reject(requeue=False)")
+        publish.assert_not_called()
+
+    def test_transient_error_is_requeued(self):
+        handler = mock.Mock(side_effect=OperationalError("server closed"))
+        message, publish = self.deliver(b'{"orderCode": "1"}', handler)
+        self.assertEqual(message.outcome, "nack(requeue=True)")
+        publish.assert_not_called()
+
+    def test_handler_error_goes_to_dead_letter_queue(self):
+        handler = mock.Mock(side_effect=KeyError("orderCode"))
+        message, publish = self.deliver(b'{"orderCode": "1"}', handler)
+        self.assertEqual(message.outcome, "ack")
+        dead = publish.call_args
+        self.assertEqual(dead.kwargs["routing_key"], "orders_queue.dlq")
+        self.assertEqual(dead.args[0].body, b'{"orderCode": "1"}')
+        self.assertIn("KeyError", dead.args[0].headers["x-error"])
+
+    def test_failed_dead_lettering_requeues(self):
+        with mock.patch("aio_pika.Message", side_effect=ConnectionError("gone")):
+            message, _ = self.deliver(b"{}", mock.Mock(side_effect=KeyError("x")))
+        self.assertEqual(message.outcome, "nack(requeue=True)")
+
+
+class ConsumeAllOrderingTest(SimpleTestCase):
+    """work_qr_queue: сканы одного груза по порядку, разных — параллельно."""
+
+    def test_scans_of_one_cargo_keep_order(self):
+        done = []
+
+        def handler(data):
+            time.sleep(data["delay"])
+            done.append((data["qrData"]["id"], data["n"]))
+
+        command = ConsumeAllCommand()
+        command.handlers = {"work_qr_queue": handler}
+        command.in_flight = set()
+        command.executor = ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(command.executor.shutdown)
+        callback = command.make_callback("work_qr_queue", mock.Mock())
+        messages = [
+            FakeIncomingMessage(
+                json.dumps({"qrData": {"id": cargo}, "n": n, "delay": delay}).encode()
+            )
+            for cargo, n, delay in [("A", 1, 0.2), ("A", 2, 0), ("B", 1, 0)]
+        ]
+
+        async def deliver():
+            # aio-pika тоже запускает по задаче на сообщение, в порядке получения
+            tasks = [asyncio.create_task(callback(message)) for message in messages]
+            await asyncio.gather(*tasks)
+
+        asyncio.run(deliver())
+
+        self.assertEqual(done, [("B", 1), ("A", 1), ("A", 2)])
+        self.assertEqual([m.outcome for m in messages], ["ack"] * 3)
+        self.assertGreater(DEFAULT_CONCURRENCY["work_qr_queue"], 1)
+
+
+class PreparationScoringTest(TestCase):
+    """Доли за подготовку и повторный пересчёт без удвоения."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.packers = [User.objects.create_user(f"packer{i}") for i in range(4)]
+        cls.shipper = User.objects.create_user("shipper")
+        cls.courier = User.objects.create_user("courier")
+        cls.order = Order.objects.create(order_code="PREP1")
+        CourierScore.objects.create(user=cls.courier, order=cls.order)
+        for i, packer in enumerate(cls.packers[:3]):
+            cls.prepare("packing", str(i), packer)
+        cls.prepare("shipment", "s1", cls.shipper)
+        # отсканировал неизвестный — его доля никому не достаётся
+        cls.prepare("shipment", "s2", None)
+
+    @classmethod
+    def prepare(cls, preparation_type, chat_id, executor):
+        OrderPreparation.objects.create(
+            order_code=cls.order.order_code,
+            preparation_type=preparation_type,
+            telegram_chat_id=chat_id,
+            executor=executor,
+        )
+
+    def preparation_points(self):
+        return sorted(
+            CourierScore.objects.filter(
+                order=self.order, reason=CourierScoreReason.PREPARATION
+            ).values_list("user__username", "points")
+        )
+
+    def test_window_count_split(self):
+        self.assertEqual(len(score_preparations([self.order])), 4)
+        self.assertEqual(
+            self.preparation_points(),
+            [
+                ("packer0", Decimal("0.33")),
+                ("packer1", Decimal("0.33")),
+                ("packer2", Decimal("0.33")),
+                ("shipper", Decimal("0.50")),
+            ],
+        )
+
+    def test_rescoring_replaces_previous_shares(self):
+        self.assertEqual(score_orders(["PREP1"]), 4)
+        first = self.preparation_points()
+        points_total = Order.objects.get(pk=self.order.pk).points_total
+        self.assertEqual(score_orders(["PREP1", "MISSING"]), 4)
+
+        self.assertEqual(self.preparation_points(), first)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).points_total, points_total)
+        self.assertEqual(CourierScore.objects.filter(order=self.order).count(), 5)
+
+        # поздний скан: доли пересчитываются, старые 0.33 не остаются
+        self.prepare("packing", "3", self.packers[3])
+        give_out_points(self.order.order_code, self.order)
+        packing = [p for name, p in self.preparation_points() if name != "shipper"]
+        self.assertEqual(packing, [Decimal("0.25")] * 4)
+        # балл курьера за доставку пересчёт не трогает
+        self.assertEqual(
+            CourierScore.objects.get(user=self.courier).reason,
+            CourierScoreReason.DELIVERY,
+        )
+
+    def test_rescoring_keeps_original_day(self):
+        score_preparations([self.order])
+        scored_at = timezone.now() - timedelta(days=40)
+        CourierScore.objects.filter(order=self.order).update(created_at=scored_at)
+
+        # поздний скан: новый участник получает балл сегодня, прежние — в свой день
+        self.prepare("packing", "3", self.packers[3])
+        score_orders(["PREP1"])
+
+        days = dict(
+            CourierScore.objects.filter(
+                order=self.order, reason=CourierScoreReason.PREPARATION
+            ).values_list("user__username", "created_at")
+        )
+        self.assertEqual(days.pop("packer3").date(), timezone.now().date())
+        self.assertEqual(set(days.values()), {scored_at})
+
+
+class TempMediaMixin:
+    """
+    MEDIA_ROOT и каталог незавершённых загрузок — во временной папке,
+    постановка видео в очередь — в mock вместо RabbitMQ из настроек.
+    """
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.enterContext(
+            mock.patch(
+                "app_orders.uploads.UPLOAD_DIR",
+                os.path.join(media.name, "uploads_tmp"),
+            )
+        )
+        self.publisher = self.enterContext(
+            mock.patch("app_orders.video_processing.get_publisher")
+        )
+
+
+VIDEO = b"\x00\x00\x00\x18ftypmp42" + bytes(range(256)) * 40
+
+
+class ChunkedUploadTest(TempMediaMixin, TestCase):
+    """Протокол загрузки видео по частям (app_orders.uploads)."""
+
+    def setUp(self):
+        super().setUp()
+        self.order = Order.objects.create(order_code="VID1")
+        self.courier = get_user_model().objects.create_user("courier", chat_id=77)
+
+    def start(self, **data):
+        return self.client.post(
+            reverse("upload-video-start"),
+            {"order_code": "VID1", "courier_id": 77, "filename": "proof.mp4", **data},
+            content_type="application/json",
+        )
+
+    def put(self, upload_id, offset, body):
+        return self.client.put(
+            reverse("upload-video-chunk", args=[upload_id]),
+            body,
+            content_type="application/octet-stream",
+            headers={"Upload-Offset": str(offset)},
+        )
+
+    def complete(self, upload_id, sha256):
+        return self.client.post(
+            reverse("upload-video-complete", args=[upload_id]),
+            {"sha256": sha256},
+            content_type="application/json",
+        )
+
+    def test_resumed_upload(self):
+        response = self.start(size=len(VIDEO))
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.json()["upload_id"]
+
+        self.assertEqual(self.put(upload_id, 0, VIDEO[:4000]).json(), {"offset": 4000})
+        # обрыв: клиент переспрашивает, откуда продолжать
+        status = self.client.get(reverse("upload-video-chunk", args=[upload_id]))
+        self.assertEqual(status.json(), {"offset": 4000, "size": len(VIDEO)})
+        with self.assertLogs("django.request", "WARNING"):
+            conflict = self.put(upload_id, 1000, VIDEO[1000:])
+        self.assertEqual((conflict.status_code, conflict.json()["offset"]), (409, 4000))
+        self.put(upload_id, 4000, VIDEO[4000:])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.complete(upload_id, hashlib.sha256(VIDEO).hexdigest())
+        self.assertEqual(response.status_code, 201)
+        proof = DeliveryProof.objects.get(order=self.order)
+        with proof.video.open("rb") as fh:
+            self.assertEqual(fh.read(), VIDEO)
+        self.assertEqual(CourierScore.objects.filter(order=self.order).count(), 1)
+        self.assertFalse(VideoUpload.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "uploads_tmp")), [])
+        self.publisher.return_value.publish.assert_called_once_with(
+            {"delivery_proof_id": proof.pk, "video": proof.video.name},
+            RABBIT_QUEUE_VIDEO,
+        )
+
+    def test_incomplete_and_corrupted_uploads(self):
+        upload_id = self.start(size=len(VIDEO)).json()["upload_id"]
+        self.put(upload_id, 0, VIDEO[:100])
+
+        sha256 = hashlib.sha256(VIDEO).hexdigest()
+        with self.assertLogs("django.request", "WARNING"):
+            response = self.complete(upload_id, sha256)
+        self.assertEqual((response.status_code, response.json()["offset"]), (400, 100))
+
+        self.put(upload_id, 100, VIDEO[100:-1] + b"!")
+        with self.assertLogs("django.request", "WARNING"):
+            response = self.complete(upload_id, sha256)
+        self.assertEqual(response.status_code, 400)
+        # испорченную загрузку начинают заново
+        self.assertFalse(VideoUpload.objects.exists())
+        self.assertFalse(DeliveryProof.objects.exists())
+
+    def test_rejected_before_upload(self):
+        with self.assertLogs("django.request", "WARNING"):
+            self.assertEqual(self.start(size=MAX_VIDEO_SIZE + 1).status_code, 413)
+            self.assertEqual(self.start(filename="proof.exe").status_code, 400)
+
+        upload_id = self.start(size=10).json()["upload_id"]
+        with self.assertLogs("django.request", "WARNING"):
+            self.assertEqual(self.put(upload_id, 0, VIDEO[:11]).status_code, 413)
+            self.assertEqual(self.put(upload_id, "x", b"").status_code, 400)
+
+    def test_empty_chunk_is_rejected(self):
+        upload_id = self.start(size=len(VIDEO)).json()["upload_id"]
+        with self.assertLogs("django.request", "WARNING"):
+            response = self.put(upload_id, 0, b"")
+        self.assertEqual(response.status_code, 400)
+
+    def test_body_is_read_without_row_lock(self):
+        upload_id = self.start(size=len(VIDEO)).json()["upload_id"]
+        body = BytesIO(VIDEO[:4000])
+        locked_while_reading = []
+
+        def read(size):
+            locked_while_reading.append(
+                any("FOR UPDATE" in q["sql"] for q in queries.captured_queries)
+            )
+            return BytesIO.read(body, size)
+
+        body.read = read
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(append_chunk(upload_id, 0, body), 4000)
+        self.assertEqual(set(locked_while_reading), {False})
+        # строка блокируется уже после чтения — на сверку смещения
+        self.assertTrue(any("FOR UPDATE" in q["sql"] for q in queries.captured_queries))
+
+    def test_failed_chunk_is_discarded(self):
+        upload_id = self.start(size=len(VIDEO)).json()["upload_id"]
+        self.put(upload_id, 0, VIDEO[:100])
+        with self.assertLogs("django.request", "WARNING"):
+            self.assertEqual(self.put(upload_id, 100, VIDEO * 2).status_code, 413)
+
+        path = os.path.join(self.media_root, "uploads_tmp", f"{upload_id}.part")
+        self.assertEqual(os.path.getsize(path), 100)
+        self.assertEqual(
+            self.put(upload_id, 100, VIDEO[100:]).json()["offset"], len(VIDEO)
+        )
+
+    def test_known_video_is_attached_without_upload(self):
+        upload_id = self.start().json()["upload_id"]
+        self.put(upload_id, 0, VIDEO)
+        self.complete(upload_id, hashlib.sha256(VIDEO).hexdigest())
+        other = Order.objects.create(order_code="VID2")
+
+        response = self.start(
+            order_code="VID2", sha256=hashlib.sha256(VIDEO).hexdigest()
+        )
+
+        self.assertTrue(response.json()["complete"])
+        self.assertEqual(
+            DeliveryProof.objects.get(order=other).video.name,
+            DeliveryProof.objects.get(order=self.order).video.name,
+        )
+        self.assertFalse(VideoUpload.objects.exists())
+
+
+def fake_ffmpeg_output(src, dst, *args):
+    with open(dst, "wb") as fh:
+        fh.write(b"converted " + os.path.basename(dst).encode())
+
+
+class VideoProcessingTest(TempMediaMixin, TestCase):
+    """Фоновая обработка видео доставки (app_orders.video_processing)."""
+
+    def setUp(self):
+        super().setUp()
+        order = Order.objects.create(order_code="VID1")
+        self.proof = DeliveryProof(order=order)
+        self.proof.video.save("proof.mp4", ContentFile(VIDEO))
+
+    def process(self, ffmpeg=True, **patches):
+        patches = {
+            "probe_duration": mock.Mock(return_value=12.5),
+            "make_rendition": fake_ffmpeg_output,
+            "make_thumbnail": fake_ffmpeg_output,
+            **patches,
+        }
+        with mock.patch.multiple("app_orders.video_processing", **patches), mock.patch(
+            "app_orders.video_processing.shutil.which",
+            return_value="/usr/bin/ffmpeg" if ffmpeg else None,
+        ):
+            return process_video_message({"delivery_proof_id": self.proof.pk})
+
+    def test_enqueued_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            enqueue_video_processing(self.proof)
+        self.publisher.assert_not_called()
+        callbacks[0]()
+
+        self.publisher.return_value.publish.assert_called_once_with(
+            {"delivery_proof_id": self.proof.pk, "video": self.proof.video.name},
+            RABBIT_QUEUE_VIDEO,
+        )
+
+    def test_rendition_and_thumbnail(self):
+        self.process()
+
+        self.proof.refresh_from_db()
+        self.assertEqual(self.proof.processing_status, "done")
+        self.assertEqual(self.proof.video_size, len(VIDEO))
+        self.assertEqual(self.proof.video_sha256, hashlib.sha256(VIDEO).hexdigest())
+        self.assertEqual(self.proof.duration, 12.5)
+        with self.proof.rendition.open("rb") as fh:
+            self.assertTrue(fh.read().startswith(b"converted"))
+        self.assertTrue(self.proof.thumbnail.name.endswith(".jpg"))
+        # update() сигналов не шлёт — ссылки на копию и превью учтены вручную
+        self.assertEqual(
+            VideoBlob.objects.get(name=self.proof.rendition.name).ref_count, 1
+        )
+
+    def test_without_ffmpeg_only_size_and_hash(self):
+        with self.assertLogs("app_orders.video_processing", "WARNING"):
+            self.process(ffmpeg=False)
+
+        self.proof.refresh_from_db()
+        self.assertEqual(self.proof.processing_status, "done")
+        self.assertEqual(self.proof.video_size, len(VIDEO))
+        self.assertFalse(self.proof.rendition)
+
+    def test_ffmpeg_failure_marks_failed(self):
+        error = subprocess.CalledProcessError(1, "ffmpeg")
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.process(make_rendition=mock.Mock(side_effect=error))
+
+        self.proof.refresh_from_db()
+        self.assertEqual(self.proof.processing_status, "failed")
+
+    def test_result_dropped_if_video_replaced(self):
+        def replace_video(src, dst, *args):
+            DeliveryProof.objects.filter(pk=self.proof.pk).update(video="other.mp4")
+            fake_ffmpeg_output(src, dst)
+
+        self.process(make_rendition=replace_video)
+
+        self.proof.refresh_from_db()
+        self.assertEqual(self.proof.processing_status, "pending")
+        self.assertFalse(self.proof.rendition)
+
+    def test_process_videos_command(self):
+        DeliveryProof.objects.filter(pk=self.proof.pk).update(
+            processing_status="failed"
+        )
+        out = StringIO()
+
+        with mock.patch("app_orders.video_processing.shutil.which", return_value=None):
+            call_command("process_videos", stdout=out)
+            self.assertIn("Processed 0", out.getvalue())
+            with self.assertLogs("app_orders.video_processing", "WARNING"):
+                call_command("process_videos", "--retry-failed", stdout=out)
+
+        self.assertIn("Processed 1, failed 0", out.getvalue())
+        self.proof.refresh_from_db()
+        self.assertEqual(self.proof.processing_status, "done")
+
+
+class VideoBlobStorageTest(TempMediaMixin, TestCase):
+    """Одинаковые видео лежат на диске один раз; gc_video_blobs убирает ничьи."""
+
+    def setUp(self):
+        super().setUp()
+        self.proofs = [
+            DeliveryProof.objects.create(order=Order.objects.create(order_code=code))
+            for code in ("VID1", "VID2")
+        ]
+
+    def attach(self, proof, content, filename="proof.mp4"):
+        proof.video.save(filename, ContentFile(content))
+        return proof.video.name
+
+    def blob(self, name):
+        return VideoBlob.objects.get(name=name)
+
+    def gc(self, *args):
+        out = StringIO()
+        call_command("gc_video_blobs", *args, stdout=out)
+        return out.getvalue()
+
+    def test_same_content_is_stored_once(self):
+        first = self.attach(self.proofs[0], VIDEO, "a.MP4")
+        second = self.attach(self.proofs[1], VIDEO, "b.mp4")
+
+        sha256 = hashlib.sha256(VIDEO).hexdigest()
+        self.assertEqual(first, second)
+        self.assertEqual(first, f"delivery_proofs/blobs/{sha256[:2]}/{sha256}.mp4")
+        self.assertEqual(self.blob(first).ref_count, 2)
+        self.assertEqual(VideoBlob.objects.count(), 1)
+
+    def test_replace_and_delete_release_references(self):
+        old = self.attach(self.proofs[0], VIDEO)
+        new = self.attach(self.proofs[0], VIDEO + b"!")
+        self.assertEqual(self.blob(old).ref_count, 0)
+        self.assertEqual(self.blob(new).ref_count, 1)
+
+        self.proofs[0].delete()
+        self.assertEqual(self.blob(new).ref_count, 0)
+
+    def test_gc_deletes_only_old_unreferenced_blobs(self):
+        kept = self.attach(self.proofs[0], VIDEO)
+        orphan = self.attach(self.proofs[1], VIDEO + b"!")
+        recent = self.attach(self.proofs[1], VIDEO + b"?")
+        self.attach(self.proofs[1], b"")  # recent тоже остаётся без ссылок
+        VideoBlob.objects.exclude(name=recent).update(
+            last_used_at=timezone.now() - timedelta(days=2)
+        )
+
+        self.assertIn("Would delete 1 blobs", self.gc("--dry-run"))
+        self.assertTrue(video_storage.exists(orphan))
+
+        self.assertIn("Deleted 1 blobs", self.gc())
+        self.assertFalse(video_storage.exists(orphan))
+        self.assertFalse(VideoBlob.objects.filter(name=orphan).exists())
+        # на kept ссылаются, recent недавно использован — остаются
+        self.assertTrue(video_storage.exists(kept) and video_storage.exists(recent))
+
+    def test_gc_deletes_files_left_by_rolled_back_saves(self):
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            name = self.attach(self.proofs[0], VIDEO)
+            raise DatabaseError("outer transaction rolled back")
+        self.assertFalse(VideoBlob.objects.exists())
+        self.assertTrue(video_storage.exists(name))
+
+        # свежий файл может ждать коммита своей строки — не трогаем
+        self.assertIn("Deleted 0 orphaned files", self.gc())
+        old = (timezone.now() - timedelta(days=2)).timestamp()
+        os.utime(video_storage.path(name), (old, old))
+        self.assertIn("Would delete 1 orphaned files", self.gc("--dry-run"))
+        self.assertIn("Deleted 1 orphaned files", self.gc())
+        self.assertFalse(video_storage.exists(name))
+
+    def test_resave_after_rollback_refreshes_orphaned_file(self):
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            name = self.attach(self.proofs[0], VIDEO)
+            raise DatabaseError("outer transaction rolled back")
+        old = (timezone.now() - timedelta(days=2)).timestamp()
+        os.utime(video_storage.path(name), (old, old))
+
+        self.assertEqual(self.attach(self.proofs[0], VIDEO), name)
+        self.assertIn("Deleted 0 orphaned files", self.gc())
+        self.assertTrue(video_storage.exists(name))
+
+    def test_recount_fixes_reference_counts(self):
+        name = self.attach(self.proofs[0], VIDEO)
+        VideoBlob.objects.filter(name=name).update(
+            ref_count=0, last_used_at=timezone.now() - timedelta(days=2)
+        )
+
+        self.assertIn("fixed 1 blobs", self.gc("--recount"))
+        self.assertEqual(self.blob(name).ref_count, 1)
+        self.assertTrue(video_storage.exists(name))
+
+
+class OrderSummaryTest(TestCase):
+    """Сводка заказа для бота (app_orders.order_summary) и её кэш."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.order = Order.objects.create(
+            order_code="SUM1",
+            customer_firstname="Айгерим",
+            customer_lastname="",
+            phone_number="7701",
+            raw_json={"delivery": {"address": {"formattedAddress": "Абая, 1"}}},
+        )
+        OrderEntry.objects.create(
+            order=cls.order, entry_id=2, name="Кружка", total_price=Decimal("199.50")
+        )
+        OrderEntry.objects.create(
+            order=cls.order,
+            entry_id=1,
+            name="Чайник",
+            quantity=2,
+            total_price=Decimal("12990.00"),
+        )
+
+    def test_summary_in_two_queries(self):
+        with self.assertNumQueries(2):
+            summary = load_order_summary(self.order.pk)
+
+        self.assertEqual(
+            summary,
+            {
+                "pk": self.order.pk,
+                "order_code": "SUM1",
+                "customer_name": "Айгерим",
+                "phone_number": "7701",
+                "address": "Абая, 1",
+                "entries": [
+                    {"name": "Чайник", "total_price": "12990", "quantity": 2},
+                    {"name": "Кружка", "total_price": "199.5", "quantity": 1},
+                ],
+            },
+        )
+        self.assertIsNone(load_order_summary(self.order.pk + 1000))
+
+    def test_cache_hits_evicts_and_invalidates(self):
+        cache = OrderSummaryCache(maxsize=1)
+        other = Order.objects.create(order_code="SUM2")
+
+        cache.get(str(self.order.pk))
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get(self.order.pk)["order_code"], "SUM1")
+        self.assertEqual(cache.get(other.pk)["address"], "")
+        # maxsize=1: первый заказ вытеснен
+        with self.assertNumQueries(2):
+            cache.get(self.order.pk)
+
+        Order.objects.filter(pk=self.order.pk).update(phone_number="7702")
+        self.assertEqual(cache.get(self.order.pk)["phone_number"], "7701")
+        cache.invalidate(self.order.pk)
+        self.assertEqual(cache.get(self.order.pk)["phone_number"], "7702")
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertIsNone(cache.get(None))
+
+    def test_misses_and_expired_entries_are_not_served(self):
+        cache = OrderSummaryCache(ttl=0)
+        self.assertIsNone(cache.get(999_999))
+        Order.objects.create(pk=999_999, order_code="LATE")
+        # заказ появился позже уведомления — промах не закэширован
+        self.assertEqual(cache.get(999_999)["order_code"], "LATE")
+        with self.assertNumQueries(2):
+            cache.get(999_999)
+
+    def test_telegram_payload_references_summary(self):
+        courier = get_user_model().objects.create_user(
+            "courier", email="c1@example.com", chat_id=55
+        )
+        message = kaspi_message("SUM1", history=IngestOrderTest.history)
+        publish = self.enterContext(
+            mock.patch(
+                "app_orders.management.commands.consume_orders"
+                ".publish_message_to_rabbitmq"
+            )
+        )
+        # после on_commit курьер попадёт в общий кэш, а транзакция теста откатится
+        self.addCleanup(user_cache.clear)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ConsumeOrdersCommand(stdout=StringIO()).save_order_to_db(message)
+
+        payload = publish.call_args.kwargs["message_body"]
+        self.assertEqual(
+            payload,
+            {
+                "orderPK": self.order.pk,
+                "orderCode": "SUM1",
+                "chat_id": 55,
+                "courierPK": courier.pk,
+                "courierName": "Курьер Один",
+            },
+        )
+        summary = OrderSummaryCache().get(payload["orderPK"])
+        self.assertEqual(summary["customer_name"], "Айгерим С.")
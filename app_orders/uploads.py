@@ -0,0 +1,228 @@
+"""
+Загрузка видео доставки по частям с докачкой.
+
+Протокол (все пути под v1/api/upload_video/sessions/):
+  POST   sessions/                 {order_code, courier_id, filename, size?,
+                                    sha256?}
+                                   → {upload_id, offset}; если такое видео уже
+                                   есть в хранилище — 200 {complete: true, ...}
+                                   без загрузки
+  PUT    sessions/<id>/            тело — сырые байты части,
+                                   заголовок Upload-Offset — с какого байта
+                                   → {offset}; 409 {offset}, если сдвиг не совпал
+  GET    sessions/<id>/            → {offset, size} — откуда продолжать
+  POST   sessions/<id>/complete/   {sha256} → данные DeliveryProof
+
+Тело запроса читается кусками и сразу пишется в файл, поэтому память
+процесса не зависит ни от размера видео, ни от числа одновременных загрузок.
+Пока читается тело, транзакция не открыта: части одной загрузки разводит
+блокировка файла, а строка VideoUpload блокируется только на сверку
+и сдвиг смещения.
+"""
+
+import fcntl
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from app_accounts.models import CourierScore
+from app_orders.models import DeliveryProof, VideoBlob, VideoUpload
+from app_orders.storage import video_storage
+from app_orders.video_processing import enqueue_video_processing
+
+# каким куском читаем тело запроса и файл при подсчёте хэша
+READ_CHUNK_SIZE = 256 * 1024
+# Telegram Bot API отдаёт файлы до 20 МБ, берём с запасом
+MAX_VIDEO_SIZE = 200 * 1024 * 1024
+# незавершённые загрузки старше этого срока удаляются
+UPLOAD_TTL = timedelta(days=1)
+
+UPLOAD_DIR = os.path.join(settings.MEDIA_ROOT, "uploads_tmp")
+
+
+class UploadError(Exception):
+    """Ошибка протокола загрузки; status — HTTP-код ответа."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def part_path(upload: VideoUpload) -> str:
+    return os.path.join(UPLOAD_DIR, f"{upload.pk}.part")
+
+
+def remove_part(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def delete_upload(upload: VideoUpload):
+    path = part_path(upload)
+    upload.delete()
+    # файл убираем только если удаление записи действительно закоммичено
+    transaction.on_commit(lambda: remove_part(path))
+
+
+def delete_stale_uploads():
+    """Удаляет брошенные загрузки (курьер так и не докачал видео)."""
+    stale = VideoUpload.objects.filter(updated_at__lt=timezone.now() - UPLOAD_TTL)
+    for upload in stale:
+        delete_upload(upload)
+
+
+def start_upload(order, courier, filename: str, size=None) -> VideoUpload:
+    if size is not None and size > MAX_VIDEO_SIZE:
+        raise UploadError("Файл слишком большой.", status=413)
+    # расширение проверяем сразу, а не после загрузки всего файла
+    try:
+        DeliveryProof._meta.get_field("video").run_validators(File(None, filename))
+    except ValidationError as e:
+        raise UploadError(" ".join(e.messages))
+    delete_stale_uploads()
+
+    upload = VideoUpload.objects.create(
+        order=order, courier=courier, filename=os.path.basename(filename), size=size
+    )
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    open(part_path(upload), "wb").close()
+    return upload
+
+
+def attach_known_video(order, courier, filename: str, sha256: str, size=None):
+    """
+    Если видео с таким sha256 уже лежит в хранилище, привязывает его к заказу
+    без загрузки и возвращает DeliveryProof, иначе None.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    name = video_storage.blob_name(sha256.lower(), ext)
+    with transaction.atomic():
+        # блокировка не даёт gc_video_blobs удалить файл, пока ссылаемся
+        blob = VideoBlob.objects.select_for_update().filter(name=name).first()
+        if blob is None or (size is not None and blob.size != size):
+            return None
+        if not video_storage.exists(name):
+            return None
+        blob.last_used_at = timezone.now()
+        blob.save(update_fields=["last_used_at"])
+
+        def assign(proof):
+            proof.video = name
+
+        return _save_proof(order, courier, assign)
+
+
+def append_chunk(upload_id, offset: int, stream) -> int:
+    """
+    Дописывает тело запроса (stream) в файл загрузки с позиции offset.
+    Возвращает новое смещение.
+    """
+    upload = VideoUpload.objects.get(pk=upload_id)
+    with open(part_path(upload), "r+b") as fh:
+        # две части одной загрузки параллельно не пишем
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError(
+                "Предыдущая часть ещё загружается.", status=409, offset=upload.received
+            )
+        upload.refresh_from_db(fields=["received"])
+        if offset != upload.received:
+            raise UploadError(
+                "Смещение не совпадает.", status=409, offset=upload.received
+            )
+
+        written = 0
+        fh.seek(offset)
+        try:
+            while True:
+                chunk = stream.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if offset + written > (upload.size or MAX_VIDEO_SIZE):
+                    raise UploadError("Данных больше заявленного размера.", status=413)
+                fh.write(chunk)
+        except BaseException:
+            # оборванную часть отбрасываем, клиент повторит её с offset
+            fh.truncate(offset)
+            raise
+        # обрываем хвост от прошлой неудачной попытки
+        fh.truncate()
+
+        # сверка и сдвиг смещения — короткая транзакция после чтения тела
+
+        with transaction.atomic():
+            upload = VideoUpload.objects.select_for_update().get(pk=upload_id)
+            if upload.received != offset:
+                raise UploadError(
+                    "Смещение не совпадает.", status=409, offset=upload.received
+                )
+            upload.received = offset + written
+            upload.save(update_fields=["received", "updated_at"])
+    return upload.received
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(READ_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def complete_upload(upload_id, sha256: str) -> DeliveryProof:
+    """
+    Проверяет размер и sha256 и переносит файл в DeliveryProof.video.
+    Как и обычная загрузка, за первое видео к заказу начисляет курьеру балл.
+    """
+    with transaction.atomic():
+        upload = VideoUpload.objects.select_for_update().get(pk=upload_id)
+        path = part_path(upload)
+
+        if upload.size is not None and upload.received != upload.size:
+            raise UploadError("Файл загружен не полностью.", offset=upload.received)
+        hash_ok = file_sha256(path) == sha256.lower()
+        if not hash_ok:
+            # часть данных испорчена — загрузку нужно начать заново
+            delete_upload(upload)
+        else:
+            proof = _attach_video(upload, path)
+            delete_upload(upload)
+
+    if not hash_ok:
+        raise UploadError("Контрольная сумма не совпадает.")
+    return proof
+
+
+def _attach_video(upload: VideoUpload, path: str) -> DeliveryProof:
+    def assign(proof):
+        with open(path, "rb") as fh:
+            # storage копирует файл кусками, целиком в память он не читается
+            proof.video.save(upload.filename, File(fh), save=False)
+
+    return _save_proof(upload.order, upload.courier, assign)
+
+
+def _save_proof(order, courier, assign_video) -> DeliveryProof:
+    proof, created = DeliveryProof.objects.get_or_create(
+        order=order, defaults={"courier": courier}
+    )
+    proof.courier = courier
+    proof.processing_status = "pending"
+    assign_video(proof)
+    proof.save()
+    enqueue_video_processing(proof)
+
+    if created and courier is not None:
+        CourierScore.objects.create(user=courier, order=order, points=1)
+    return proof
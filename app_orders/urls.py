@@ -1,6 +1,26 @@
 from django.urls import path
-from .views import DeliveryProofUploadView
+from .views import (
+    DeliveryProofUploadView,
+    VideoUploadChunkView,
+    VideoUploadCompleteView,
+    VideoUploadStartView,
+)
 
 urlpatterns = [
     path("api/upload_video/", DeliveryProofUploadView.as_view(), name="upload-video"),
+    path(
+        "api/upload_video/sessions/",
+        VideoUploadStartView.as_view(),
+        name="upload-video-start",
+    ),
+    path(
+        "api/upload_video/sessions/<uuid:upload_id>/",
+        VideoUploadChunkView.as_view(),
+        name="upload-video-chunk",
+    ),
+    path(
+        "api/upload_video/sessions/<uuid:upload_id>/complete/",
+        VideoUploadCompleteView.as_view(),
+        name="upload-video-complete",
+    ),
 ]
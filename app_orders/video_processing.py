@@ -0,0 +1,228 @@
+"""
+Фоновая обработка видео доставки (DeliveryProof).
+
+После сохранения видео в очередь video_processing уходит id записи;
+обработчик (очередь слушает consume_all) считает размер и sha256 исходника,
+а если в системе есть ffmpeg — делает сжатую копию (H.264, до 720p,
+faststart) и кадр-превью и записывает длительность. Без ffmpeg
+сохраняются только размер и хэш.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from app_orders.models import DeliveryProof, change_blob_refs
+from core.rabbitmq import get_publisher
+
+log = logging.getLogger(__name__)
+
+RABBIT_QUEUE_VIDEO = "video_processing"
+
+READ_CHUNK_SIZE = 256 * 1024
+FFMPEG_TIMEOUT = 10 * 60  # секунд на один вызов ffmpeg
+RENDITION_MAX_HEIGHT = 720
+THUMBNAIL_WIDTH = 320
+
+
+def enqueue_video_processing(proof: DeliveryProof):
+    """Ставит видео в очередь обработки после коммита текущей транзакции."""
+    message = {"delivery_proof_id": proof.pk, "video": proof.video.name}
+
+    def publish():
+        try:
+            get_publisher(
+                host=settings.RABBITMQ_HOST,
+                port=settings.RABBITMQ_PORT,
+                username=settings.RABBITMQ_USER,
+                password=settings.RABBITMQ_PASSWORD,
+            ).publish(message, RABBIT_QUEUE_VIDEO)
+        except Exception:
+            # видео уже сохранено; необработанные подберёт process_videos
+            log.exception("Не удалось поставить видео %s в очередь", proof.pk)
+
+    transaction.on_commit(publish)
+
+
+@contextmanager
+def local_copy(field_file):
+    """Путь к файлу на диске: сам файл для FileSystemStorage, иначе временная копия."""
+    try:
+        yield field_file.path
+        return
+    except NotImplementedError:
+        pass
+    suffix = os.path.splitext(field_file.name)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        with field_file.open("rb") as src:
+            shutil.copyfileobj(src, tmp, READ_CHUNK_SIZE)
+        tmp.flush()
+        yield tmp.name
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(READ_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def probe_duration(path: str):
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "json",
+            path,
+        ],
+        capture_output=True,
+        check=True,
+        timeout=FFMPEG_TIMEOUT,
+    )
+    duration = json.loads(result.stdout).get("format", {}).get("duration")
+    return float(duration) if duration else None
+
+
+def make_rendition(src: str, dst: str):
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-v",
+            "error",
+            "-i",
+            src,
+            # не увеличиваем, только уменьшаем до 720p; ширина чётная для x264
+            "-vf",
+            f"scale=-2:'min({RENDITION_MAX_HEIGHT},ih)'",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-crf",
+            "28",
+            "-c:a",
+            "aac",
+            "-b:a",
+            "64k",
+            # индекс в начале файла — браузер начинает играть сразу
+            "-movflags",
+            "+faststart",
+            dst,
+        ],
+        check=True,
+        timeout=FFMPEG_TIMEOUT,
+    )
+
+
+def make_thumbnail(src: str, dst: str, duration=None):
+    # кадр с первой секунды; у совсем коротких видео — первый кадр
+    offset = "1" if duration is None or duration > 1 else "0"
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-v",
+            "error",
+            "-ss",
+            offset,
+            "-i",
+            src,
+            "-frames:v",
+            "1",
+            "-vf",
+            f"scale={THUMBNAIL_WIDTH}:-2",
+            dst,
+        ],
+        check=True,
+        timeout=FFMPEG_TIMEOUT,
+    )
+
+
+def process_delivery_proof(proof_id) -> bool:
+    """
+    Обрабатывает одно видео. Возвращает False, если записи или файла уже нет.
+    Ошибку ffmpeg записывает в processing_status и пробрасывает дальше.
+    """
+    proof = DeliveryProof.objects.filter(pk=proof_id).first()
+    if proof is None or not proof.video:
+        return False
+
+    video_name = proof.video.name
+    base_name = os.path.splitext(os.path.basename(video_name))[0]
+    try:
+        with local_copy(proof.video) as src, tempfile.TemporaryDirectory() as tmp:
+            proof.video_size = os.path.getsize(src)
+            proof.video_sha256 = file_sha256(src)
+
+            if shutil.which("ffmpeg"):
+                proof.duration = probe_duration(src)
+
+                rendition_path = os.path.join(tmp, f"{base_name}.mp4")
+                make_rendition(src, rendition_path)
+                thumbnail_path = os.path.join(tmp, f"{base_name}.jpg")
+                make_thumbnail(src, thumbnail_path, proof.duration)
+
+                with open(rendition_path, "rb") as fh:
+                    proof.rendition.save(f"{base_name}.mp4", File(fh), save=False)
+                with open(thumbnail_path, "rb") as fh:
+                    proof.thumbnail.save(f"{base_name}.jpg", File(fh), save=False)
+            else:
+                log.warning("ffmpeg не найден: для %s только размер и хэш", video_name)
+    except (subprocess.SubprocessError, OSError):
+        DeliveryProof.objects.filter(pk=proof.pk, video=video_name).update(
+            processing_status="failed"
+        )
+        raise
+
+    proof.processing_status = "done"
+    proof.processed_at = timezone.now()
+    with transaction.atomic():
+        # если пока мы работали, видео заменили — результат уже не про него
+        current = (
+            DeliveryProof.objects.select_for_update()
+            .filter(pk=proof.pk, video=video_name)
+            .values_list("rendition", "thumbnail")
+            .first()
+        )
+        if current is None:
+            return True
+        DeliveryProof.objects.filter(pk=proof.pk).update(
+            **{
+                field: getattr(proof, field)
+                for field in (
+                    "processing_status",
+                    "rendition",
+                    "thumbnail",
+                    "video_size",
+                    "duration",
+                    "video_sha256",
+                    "processed_at",
+                )
+            }
+        )
+        # update() сигналов не шлёт — ссылки на блобы правим сами
+        change_blob_refs(
+            added=[proof.rendition.name, proof.thumbnail.name], removed=current
+        )
+    return True
+
+
+def process_video_message(data: dict):
+    """Обработчик сообщения очереди video_processing."""
+    process_delivery_proof(data["delivery_proof_id"])
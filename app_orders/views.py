@@ -2,8 +2,17 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 
 from rest_framework import status
-from .serializers import DeliveryProofCreateSerializer
-from django.http import HttpResponse
+from .models import VideoUpload
+from .serializers import DeliveryProofCreateSerializer, VideoUploadStartSerializer
+from .uploads import (
+    UploadError,
+    append_chunk,
+    attach_known_video,
+    complete_upload,
+    start_upload,
+)
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
 from rest_framework.parsers import MultiPartParser, FormParser
 
 
@@ -21,3 +30,88 @@ class DeliveryProofUploadView(APIView):
 
     def get(self, request, format=None):
         return HttpResponse("Пшел вон отседова!", status=status.HTTP_400_BAD_REQUEST)
+
+
+def proof_response_data(proof):
+    return {
+        "order_code": proof.order.order_code,
+        "video": proof.video.url,
+        "uploaded_at": proof.uploaded_at,
+    }
+
+
+def upload_error_response(error: UploadError):
+    data = {"detail": str(error)}
+    if error.offset is not None:
+        data["offset"] = error.offset
+    return Response(data, status=error.status)
+
+
+class VideoUploadStartView(APIView):
+    """Начало загрузки видео по частям (протокол — в app_orders.uploads)."""
+
+    def post(self, request, format=None):
+        serializer = VideoUploadStartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        sha256 = data.pop("sha256")
+        if sha256:
+            proof = attach_known_video(sha256=sha256, **data)
+            if proof is not None:
+                return Response({"complete": True, **proof_response_data(proof)})
+        try:
+            upload = start_upload(**data)
+        except UploadError as e:
+            return upload_error_response(e)
+        return Response(
+            {"upload_id": str(upload.pk), "offset": 0}, status=status.HTTP_201_CREATED
+        )
+
+
+class VideoUploadChunkView(APIView):
+    # тело PUT читаем сами из request.stream, парсеры DRF его не трогают
+    parser_classes = ()
+
+    def get(self, request, upload_id, format=None):
+        upload = get_object_or_404(VideoUpload, pk=upload_id)
+        return Response({"offset": upload.received, "size": upload.size})
+
+    def put(self, request, upload_id, format=None):
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+        except ValueError:
+            return Response(
+                {"detail": "Нужен заголовок Upload-Offset."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # DRF отдаёт None вместо потока, если тело пустое
+        if request.stream is None:
+            return Response(
+                {"detail": "Пустое тело запроса."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            new_offset = append_chunk(upload_id, offset, request.stream)
+        except VideoUpload.DoesNotExist:
+            raise Http404
+        except UploadError as e:
+            return upload_error_response(e)
+        return Response(
+            {"offset": new_offset}, headers={"Upload-Offset": str(new_offset)}
+        )
+
+
+class VideoUploadCompleteView(APIView):
+    def post(self, request, upload_id, format=None):
+        sha256 = request.data.get("sha256")
+        if not sha256:
+            return Response(
+                {"sha256": "Обязательное поле."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            proof = complete_upload(upload_id, sha256)
+        except VideoUpload.DoesNotExist:
+            raise Http404
+        except UploadError as e:
+            return upload_error_response(e)
+        return Response(proof_response_data(proof), status=status.HTTP_201_CREATED)
@@ -10,10 +10,9 @@ django.setup()
 
 import asyncio
 import aiohttp
-import json
+import hashlib
 import logging
 
-import pika
 import aio_pika
 from asgiref.sync import sync_to_async, async_to_sync
 
@@ -30,12 +29,16 @@ from aiogram.types import (
     CallbackQuery,            # ### ИЗМЕНЕНО ДЛЯ INLINE-КНОПОК ###
 )
 from aiogram.client.bot import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import StorageKey
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
-from app_orders.models import Order
+from core.rabbitmq import get_publisher
+from app_orders.order_summary import order_summary_cache
 from app_accounts.models import User, TelegramGroup
+from fsm_storage import SQLiteStorage
+from send_queue import PRIORITY_ALERT, SendScheduler, serve_metrics
+from queue_consumer import ChatOrderedConsumer
 
 # ============================================================
 # Конфигурация и инициализация
@@ -47,19 +50,31 @@ RABBIT_PORT = 5672
 RABBIT_USER = "guest"
 RABBIT_PASSWORD = "guest"
 RABBIT_QUEUE = "telegram_queue"
+# сколько сообщений telegram_queue берём заранее и обрабатываем одновременно
+RABBIT_PREFETCH = 32
+RABBIT_CONCURRENCY = 8
 RABBIT_QUEUE_FEEDBACK = "feedback_queue"
 # DJANGO_HOST = "185.100.67.246"
 DJANGO_HOST = "localhost"
 ENDPOINT_API_VIDEO = "http://localhost:8889/v1/api/upload_video/"
+ENDPOINT_API_VIDEO_SESSIONS = "http://localhost:8889/v1/api/upload_video/sessions/"
+# видео уходит в Django частями такого размера — больше в памяти не держим
+VIDEO_CHUNK_SIZE = 1024 * 1024
+VIDEO_CHUNK_RETRIES = 3
+# GET /metrics очереди отправки (send_queue.py)
+METRICS_PORT = 9108
 
 logging.basicConfig(level=logging.INFO)
 
-storage = MemoryStorage()
+# состояние опросов курьеров переживает рестарт (bot/fsm_storage.py)
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
 bot = Bot(
     token=API_TOKEN,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML),
 )
+# все рассылки из бота идут через очередь с ограничением скорости
+sender = SendScheduler(bot)
 
 
 # ============================================================
@@ -71,8 +86,14 @@ class DeliveryFeedbackStates(StatesGroup):
     waiting_for_video = State()            # для видео отчета (общий шаг)
 
 
+def chat_state(chat_id: int) -> FSMContext:
+    # тот же ключ, под которым aiogram ищет состояние в хэндлерах личного чата
+    key = StorageKey(bot_id=bot.id, chat_id=int(chat_id), user_id=int(chat_id))
+    return FSMContext(dp.storage, key=key)
+
+
 async def get_current_state(chat_id: int):
-    state = FSMContext(dp.storage, key=f"{chat_id}:{chat_id}")
+    state = chat_state(chat_id)
     current_state = await state.get_state()
     data = await state.get_data()
 
@@ -82,38 +103,110 @@ async def get_current_state(chat_id: int):
 # ============================================================
 # Для загрузки видео
 # ============================================================
-async def download_video(file_id: str) -> bytes:
-    # Получаем file_path через API Telegram
-    file = await bot.get_file(file_id)
-    file_path = file.file_path
-    download_url = f"https://api.telegram.org/file/bot{API_TOKEN}/{file_path}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(download_url) as resp:
-            if resp.status == 200:
-                return await resp.read()
-            else:
-                raise Exception(f"Не удалось скачать видео: {resp.status}")
+class VideoUploadError(Exception):
+    pass
 
 
-async def send_video_to_django(
-    video_bytes: bytes, filename: str, order_code: str, courier_id: int
+async def put_video_chunk(
+    session: aiohttp.ClientSession, upload_url: str, offset: int, chunk: bytes
+) -> int:
+    """
+    Отправляет часть видео с позиции offset. При обрыве спрашивает у Django,
+    сколько байт дошло, и досылает только остаток части.
+    """
+    end = offset + len(chunk)
+    position = offset
+    for attempt in range(VIDEO_CHUNK_RETRIES + 1):
+        try:
+            async with session.put(
+                upload_url,
+                data=chunk[position - offset :],
+                headers={
+                    "Upload-Offset": str(position),
+                    "Content-Type": "application/octet-stream",
+                },
+            ) as resp:
+                if resp.status == 200:
+                    return (await resp.json())["offset"]
+                if resp.status != 409:
+                    raise VideoUploadError(
+                        f"Django отклонил часть видео: {resp.status} {await resp.text()}"
+                    )
+        except aiohttp.ClientError as e:
+            logging.warning(f"Часть видео не отправлена (попытка {attempt + 1}): {e}")
+
+        if attempt == VIDEO_CHUNK_RETRIES:
+            break
+        await asyncio.sleep(2**attempt)
+        async with session.get(upload_url) as resp:
+            position = (await resp.json())["offset"]
+        if position == end:
+            return end
+        if not offset <= position < end:
+            raise VideoUploadError(f"Неожиданное смещение загрузки: {position}")
+    raise VideoUploadError("Не удалось отправить часть видео")
+
+
+async def stream_video_to_django(
+    file_id: str, filename: str, order_code: str, courier_id: int
 ):
-    data = aiohttp.FormData()
-    data.add_field("video", video_bytes, filename=filename, content_type="video/mp4")
-    data.add_field("order_code", order_code)
-    data.add_field("courier_id", str(courier_id))
+    """
+    Перекачивает видео из Telegram в Django по частям: скачанный кусок
+    сразу уходит в загрузку, в памяти не больше VIDEO_CHUNK_SIZE байт.
+    """
+    file = await bot.get_file(file_id)
+    download_url = f"https://api.telegram.org/file/bot{API_TOKEN}/{file.file_path}"
+
     async with aiohttp.ClientSession() as session:
-        async with session.post(ENDPOINT_API_VIDEO, data=data) as resp:
-            if resp.status == 200:
-                logging.info("Видео успешно передано на Django")
+        async with session.post(
+            ENDPOINT_API_VIDEO_SESSIONS,
+            json={
+                "order_code": order_code,
+                "courier_id": courier_id,
+                "filename": filename,
+                "size": file.file_size,
+            },
+        ) as resp:
+            if resp.status != 201:
+                raise VideoUploadError(
+                    f"Не удалось начать загрузку: {resp.status} {await resp.text()}"
+                )
+            upload_id = (await resp.json())["upload_id"]
+        upload_url = f"{ENDPOINT_API_VIDEO_SESSIONS}{upload_id}/"
+
+        digest = hashlib.sha256()
+        offset = 0
+        buffer = bytearray()
+        async with session.get(download_url) as resp:
+            if resp.status != 200:
+                raise VideoUploadError(f"Не удалось скачать видео: {resp.status}")
+            async for piece in resp.content.iter_chunked(64 * 1024):
+                buffer += piece
+                if len(buffer) >= VIDEO_CHUNK_SIZE:
+                    chunk = bytes(buffer)
+                    buffer.clear()
+                    digest.update(chunk)
+                    offset = await put_video_chunk(session, upload_url, offset, chunk)
+        if buffer:
+            chunk = bytes(buffer)
+            digest.update(chunk)
+            offset = await put_video_chunk(session, upload_url, offset, chunk)
+
+        async with session.post(
+            f"{upload_url}complete/", json={"sha256": digest.hexdigest()}
+        ) as resp:
+            if resp.status == 201:
+                logging.info(f"Видео ({offset} байт) успешно передано на Django")
             else:
-                logging.error(f"Ошибка передачи видео: {resp.status}")
+                raise VideoUploadError(
+                    f"Ошибка передачи видео: {resp.status} {await resp.text()}"
+                )
 
 
 # ============================================================
 # Функция для отправки данных обратной связи в RabbitMQ
 # ============================================================
-def publish_feedback_to_rabbitmq(
+async def publish_feedback_to_rabbitmq(
     feedback_data: dict,
     queue_name: str = RABBIT_QUEUE_FEEDBACK,
     host: str = RABBIT_HOST,
@@ -121,21 +214,10 @@ def publish_feedback_to_rabbitmq(
     username: str = RABBIT_USER,
     password: str = RABBIT_PASSWORD,
 ):
-    credentials = pika.PlainCredentials(username, password)
-    connection_params = pika.ConnectionParameters(
-        host=host, port=port, credentials=credentials
-    )
-    connection = pika.BlockingConnection(connection_params)
-    channel = connection.channel()
-    channel.queue_declare(queue=queue_name, durable=True)
-    body_str = json.dumps(feedback_data, ensure_ascii=False)
-    channel.basic_publish(
-        exchange="",
-        routing_key=queue_name,
-        body=body_str,
-        properties=pika.BasicProperties(delivery_mode=2),
+    publisher = get_publisher(
+        host=host, port=port, username=username, password=password
     )
-    connection.close()
+    await publisher.apublish(feedback_data, queue_name)
 
 
 # ============================================================
@@ -154,11 +236,29 @@ async def complete_feedback(message: Message, state: FSMContext):
         "courierChatId": courier_chat_id,
         "comment": comment,
     }
-    await sync_to_async(publish_feedback_to_rabbitmq)(feedback_payload)
+    await publish_feedback_to_rabbitmq(feedback_payload)
     logging.info(f"Feedback отправлен: {feedback_payload}")
     await state.clear()
 
 
+# ============================================================
+# Данные заказа для текстов: в очереди и FSM только orderPK,
+# остальное читаем из БД через кэш (app_orders.order_summary)
+# ============================================================
+async def get_order_summary(order_data: dict) -> dict:
+    summary = await sync_to_async(order_summary_cache.get)(order_data.get("orderPK"))
+    return summary or {}
+
+
+def format_entries(summary: dict) -> str:
+    return "\n".join(
+        [
+            f"{el['name']} - {el['total_price']} т * {el['quantity']} ед.изм."
+            for el in summary.get("entries", [])
+        ]
+    )
+
+
 # ============================================================
 # Функция для отправки сообщения с клавиатурой для обратной связи
 # ============================================================
@@ -172,20 +272,11 @@ async def send_feedback_keyboard(
     при этом логика (ждём «Отлично»/«Не отлично» текстом) остаётся той же.
     """
     order_code = order_data.get("orderCode", "Не указан")
-    client = order_data.get("customerName", "Не указан")
-    client_phone = order_data.get("phone_number", "Не указан")
-    client_adress = (
-        order_data.get("delivery_info", {})
-        .get("address", {})
-        .get("formattedAddress", "Не указан")
-    )
-    client_entries = order_data.get("entries", [])
-    data_entries = "\n".join(
-        [
-            f"{el['name']} - {el['totalPrice']} т * {el['quantity']} ед.изм."
-            for el in client_entries
-        ]
-    )
+    summary = await get_order_summary(order_data)
+    client = summary.get("customer_name") or "Не указан"
+    client_phone = summary.get("phone_number") or "Не указан"
+    client_adress = summary.get("address") or "Не указан"
+    data_entries = format_entries(summary)
 
     msg = (
         f"Вы только что доставили заказ 🚚 № {order_code}!\n\n"
@@ -208,7 +299,7 @@ async def send_feedback_keyboard(
         ]
     )
 
-    await bot.send_message(chat_id, msg, reply_markup=inline_kb)
+    await sender.send_message(chat_id, msg, reply_markup=inline_kb)
 
 
 # ============================================================
@@ -255,34 +346,28 @@ async def feedback_rating_handler(message: Message, state: FSMContext):
         )
         # Оповещаем группы
         operator_groups = await sync_to_async(list)(TelegramGroup.objects.all())
-        client_adress = (
-            data.get("delivery_info", {})
-            .get("address", {})
-            .get("formattedAddress", "Не указан")
+        # та же сводка, что и для опроса курьера, — обычно уже в кэше
+        summary = await get_order_summary(data)
+        client_adress = summary.get("address") or "Не указан"
+        data_entries = format_entries(summary)
+
+        alert_msg = (
+            f"⚠️⚠️⚠️ Внимание!⚠️⚠️⚠️\n"
+            f"Клиент недоволен доставкой заказа {order_code}.\n"
+            f"Курьер:\n{data.get('courierName', 'Неизвестно')}\n"
+            f"Адрес:\n{client_adress}\n"
+            f"Заказ:\n{data_entries}\n"
+            f"Клиент:\n{summary.get('customer_name') or 'Неизвестно'}\n"
+            f"📞 Телефон клиента:\n{summary.get('phone_number') or 'Не указан'}\n\n"
+            "Подробнее тут (ссылка на админку):\n"
+            f"http://185.100.67.246:8889/admin/app_orders/order/{data.get('orderPK')}/change/"
         )
-        client_entries = data.get("entries", [])
-        data_entries = "\n".join(
-            [
-                f"{el['name']} - {el['totalPrice']} т * {el['quantity']} ед.изм."
-                for el in client_entries
-            ]
+        # не ждём: рассылка идёт параллельно, курьер получает ответ сразу
+        sender.broadcast(
+            [group.chat_id for group in operator_groups],
+            alert_msg,
+            priority=PRIORITY_ALERT,
         )
-
-        # order = await sync_to_async(Order.objects.filter)(chat_id=chat_id)
-        order = await Order.objects.filter(order_code=order_code).afirst()
-        for group in operator_groups:
-            alert_msg = (
-                f"⚠️⚠️⚠️ Внимание!⚠️⚠️⚠️\n"
-                f"Клиент недоволен доставкой заказа {order_code}.\n"
-                f"Курьер:\n{data.get('courierName', 'Неизвестно')}\n"
-                f"Адрес:\n{client_adress}\n"
-                f"Заказ:\n{data_entries}\n"
-                f"Клиент:\n{data.get('customerName', 'Неизвестно')}\n"
-                f"📞 Телефон клиента:\n{data.get('phone_number', 'Не указан')}\n\n"
-                "Подробнее тут (ссылка на админку):\n"
-                f"http://185.100.67.246:8889/admin/app_orders/order/{order.pk}/change/"
-            )
-            await bot.send_message(group.chat_id, alert_msg)
     else:
         await state.set_state(DeliveryFeedbackStates.waiting_for_video)
         await message.answer(
@@ -347,12 +432,11 @@ async def video_handler(message: Message, state: FSMContext):
         await message.answer(f"Видео получено! (File ID: {video_file_id})")
         logging.info(f"User {message.from_user.id} отправил видео: {video_file_id}")
         try:
-            video_bytes = await download_video(video_file_id)
             data = await state.get_data()
             order_code = data.get("orderCode", "Не указан")
             courier_id = data.get("courier_id") or message.from_user.id
-            await send_video_to_django(
-                video_bytes, f"{video_file_id}.mp4", order_code, courier_id
+            await stream_video_to_django(
+                video_file_id, f"{video_file_id}.mp4", order_code, courier_id
             )
         except Exception as e:
             logging.error(f"Ошибка при скачивании/передаче видео: {e}")
@@ -376,39 +460,38 @@ async def skip_video_handler(message: Message, state: FSMContext):
 # ============================================================
 # RabbitMQ Consumer
 # ============================================================
+async def handle_order_notification(data: dict):
+    """Одно сообщение telegram_queue: сохраняем заказ в FSM и шлём опрос."""
+    logging.info(f"Получили из RabbitMQ: {data}")
+    chat_id = data.get("chat_id")
+    if chat_id is None:
+        return
+
+    state = chat_state(chat_id)
+    await state.update_data(**data)
+    await state.set_state(DeliveryFeedbackStates.begin_waiting_state)
+
+    await send_feedback_keyboard(
+        chat_id,
+        data,
+        state,
+    )
+    logging.info(f"Сообщение отправлено на chat_id={chat_id}")
+
+
 async def rabbit_consumer():
     connection = await aio_pika.connect_robust(
         host=RABBIT_HOST, port=RABBIT_PORT, login=RABBIT_USER, password=RABBIT_PASSWORD
     )
-    channel = await connection.channel()
-    queue = await channel.declare_queue(RABBIT_QUEUE, durable=True)
-
-    async with queue.iterator() as queue_iter:
-        async for message in queue_iter:
-            async with message.process():
-                try:
-                    body = message.body.decode("utf-8")
-                    data = json.loads(body)
-                    logging.info(f"Получили из RabbitMQ: {data}")
-
-                    chat_id = data.get("chat_id")
-
-                    if chat_id is None:
-                        continue
-
-                    state = FSMContext(dp.storage, key=f"{chat_id}:{chat_id}")
-                    await state.update_data(**data)
-                    await state.set_state(DeliveryFeedbackStates.begin_waiting_state)
-
-                    await send_feedback_keyboard(
-                        chat_id,
-                        data,
-                        state,
-                    )
-                    logging.info(f"Сообщение отправлено на chat_id={chat_id}")
-
-                except Exception as e:
-                    logging.exception(f"Ошибка при обработке сообщения: {e}")
+    # разные курьеры — параллельно, один chat_id — по порядку; ошибки — в DLQ
+    consumer = ChatOrderedConsumer(
+        RABBIT_QUEUE,
+        handle_order_notification,
+        prefetch=RABBIT_PREFETCH,
+        concurrency=RABBIT_CONCURRENCY,
+    )
+    await consumer.start(connection)
+    await asyncio.Future()  # слушаем, пока работает бот
 
 
 # ============================================================
@@ -504,6 +587,10 @@ def register_handlers(dp: Dispatcher):
 async def main():
     logging.info("Запускаем бота и rabbit_consumer...")
     register_handlers(dp)
+    await sender.start()
+    await serve_metrics(sender, METRICS_PORT)
+    removed = storage.purge_expired()
+    logging.info(f"Удалено просроченных FSM-сессий: {removed}")
     # ВАЖНО: callback_query-хэндлер мы регистрируем декоратором выше
     asyncio.create_task(rabbit_consumer())
     await dp.start_polling(bot)
@@ -0,0 +1,123 @@
+"""
+FSM-хранилище бота в SQLite-файле.
+
+В отличие от MemoryStorage состояние курьера (ждём оценку, комментарий,
+видео) и данные заказа переживают рестарт бота и не копятся в памяти
+процесса. Данные хранятся сжатым JSON. У каждой записи есть срок жизни:
+брошенный опрос (курьер так и не ответил) через SESSION_TTL_SECONDS
+считается пустым и удаляется.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+STORAGE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fsm_state.sqlite3"
+)
+SESSION_TTL_SECONDS = 3 * 24 * 60 * 60
+# просроченные записи чистим не на каждой записи
+PURGE_EVERY_WRITES = 500
+
+
+def storage_key(key) -> str:
+    if isinstance(key, StorageKey):
+        parts = [key.bot_id, key.chat_id, key.user_id, key.thread_id]
+        parts += [key.business_connection_id, key.destiny]
+        return ":".join("" if part is None else str(part) for part in parts)
+    return str(key)
+
+
+def pack_data(data: Dict[str, Any]) -> bytes:
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+    return zlib.compress(raw.encode("utf-8"))
+
+
+def unpack_data(blob: Optional[bytes]) -> Dict[str, Any]:
+    if not blob:
+        return {}
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str = STORAGE_FILE, ttl: int = SESSION_TTL_SECONDS):
+        self.ttl = ttl
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=10)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                " key TEXT PRIMARY KEY,"
+                " state TEXT,"
+                " data BLOB,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at)"
+            )
+
+    def _row(self, key):
+        row = self._conn.execute(
+            "SELECT state, data, expires_at FROM fsm WHERE key = ?",
+            (storage_key(key),),
+        ).fetchone()
+        if row is None or row[2] < time.time():
+            return None, None
+        return row[0], row[1]
+
+    def _write(self, key, state: Optional[str], data: Optional[bytes]):
+        with self._conn:
+            if state is None and data is None:
+                # пустая запись не нужна
+                self._conn.execute("DELETE FROM fsm WHERE key = ?", (storage_key(key),))
+            else:
+                self._conn.execute(
+                    "INSERT INTO fsm (key, state, data, expires_at)"
+                    " VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (key) DO UPDATE SET"
+                    " state = excluded.state,"
+                    " data = excluded.data,"
+                    " expires_at = excluded.expires_at",
+                    (storage_key(key), state, data, time.time() + self.ttl),
+                )
+            self._writes += 1
+            if self._writes % PURGE_EVERY_WRITES == 0:
+                self._purge()
+
+    def _purge(self) -> int:
+        return self._conn.execute(
+            "DELETE FROM fsm WHERE expires_at < ?", (time.time(),)
+        ).rowcount
+
+    def purge_expired(self) -> int:
+        """Удаляет просроченные записи, возвращает их число."""
+        with self._conn:
+            return self._purge()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        _, data = self._row(key)
+        self._write(key, state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = self._row(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = self._row(key)
+        self._write(key, state, pack_data(data) if data else None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = self._row(key)
+        return unpack_data(data)
+
+    async def close(self) -> None:
+        self._conn.close()
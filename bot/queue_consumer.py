@@ -0,0 +1,104 @@
+"""
+Параллельный потребитель очереди RabbitMQ для бота.
+
+Сообщения разных чатов обрабатываются одновременно (не больше
+concurrency штук), сообщения одного chat_id — строго по очереди,
+в порядке получения. Медленный ответ Telegram одному курьеру больше
+не задерживает уведомления остальным.
+
+Сообщение, которое не удалось обработать, перекладывается в очередь
+<queue>.dlq с текстом ошибки в заголовках и только потом подтверждается.
+Саму очередь с x-dead-letter-exchange объявить нельзя: её уже объявляют
+издатели без аргументов, и брокер отверг бы повторное объявление.
+"""
+
+import asyncio
+import json
+import logging
+
+import aio_pika
+
+PREFETCH_COUNT = 32
+HANDLER_CONCURRENCY = 8
+
+
+class ChatOrderedConsumer:
+    def __init__(
+        self,
+        queue_name: str,
+        handler,
+        prefetch: int = PREFETCH_COUNT,
+        concurrency: int = HANDLER_CONCURRENCY,
+    ):
+        self.queue_name = queue_name
+        self.dlq_name = f"{queue_name}.dlq"
+        self.handler = handler
+        self.prefetch = prefetch
+        self.stats = {"processed": 0, "dead_lettered": 0}
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # последняя задача каждого чата: следующая ждёт её завершения
+        self._tails: dict = {}
+        self._channel = None
+
+    async def start(self, connection: aio_pika.abc.AbstractRobustConnection):
+        self._channel = await connection.channel()
+        await self._channel.set_qos(prefetch_count=self.prefetch)
+        await self._channel.declare_queue(self.dlq_name, durable=True)
+        queue = await self._channel.declare_queue(self.queue_name, durable=True)
+        await queue.consume(self.on_message)
+
+    async def on_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        try:
+            data = json.loads(message.body)
+        except ValueError as e:
+            await self.dead_letter(message, e)
+            return
+        chat_id = data.get("chat_id") if isinstance(data, dict) else None
+
+        previous = self._tails.get(chat_id)
+        task = asyncio.create_task(self.process(message, data, previous))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._forget(chat_id, t))
+
+    def _forget(self, chat_id, task):
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    async def process(self, message, data, previous):
+        if previous is not None:
+            # ошибка предыдущего сообщения уже ушла в DLQ, ждём только порядок
+            await asyncio.gather(previous, return_exceptions=True)
+        async with self._semaphore:
+            try:
+                await self.handler(data)
+            except Exception as e:
+                logging.exception(
+                    f"Ошибка при обработке сообщения из {self.queue_name}"
+                )
+                await self.dead_letter(message, e)
+            else:
+                self.stats["processed"] += 1
+                await message.ack()
+
+    async def dead_letter(self, message, error: Exception):
+        try:
+            await self._channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=message.body,
+                    content_type=message.content_type,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    headers={
+                        **(message.headers or {}),
+                        "x-error": repr(error)[:1000],
+                        "x-original-queue": self.queue_name,
+                    },
+                ),
+                routing_key=self.dlq_name,
+            )
+        except Exception:
+            logging.exception(f"Не удалось переложить сообщение в {self.dlq_name}")
+            await message.nack(requeue=True)
+            return
+        self.stats["dead_lettered"] += 1
+        await message.ack()
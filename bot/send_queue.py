@@ -0,0 +1,319 @@
+"""
+Очередь исходящих сообщений бота с ограничением скорости.
+
+Telegram режет ботов, которые шлют больше ~30 сообщений в секунду всего,
+больше одного в секунду в личный чат и больше 20 в минуту в группу.
+Все отправки идут через SendScheduler:
+  • общий token bucket и отдельный bucket на каждый чат;
+  • у каждого чата своя очередь, воркеры берут чаты, готовые к отправке:
+    рассылка по группам идёт параллельно, сообщения в один чат уходят
+    по порядку, а чат, исчерпавший лимит, ждёт по таймеру и воркер
+    не занимает;
+  • оповещения (PRIORITY_ALERT) обгоняют обычные сообщения;
+  • на 429 ждём retry_after и повторяем, на сетевые ошибки — с паузой.
+Счётчики и задержка отправки отдаются в формате Prometheus (serve_metrics).
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiohttp import web
+
+PRIORITY_ALERT = 0
+PRIORITY_NORMAL = 1
+
+GLOBAL_RATE = 25  # сообщений в секунду, с запасом до лимита Telegram
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+SEND_WORKERS = 8
+MAX_ATTEMPTS = 5
+# bucket чата, простоявший дольше этого, забываем
+IDLE_BUCKET_SECONDS = 10 * 60
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Через сколько секунд появится токен (0 — есть уже сейчас)."""
+        now = time.monotonic()
+        self._refill(now)
+        if now >= self.blocked_until and self.tokens >= 1:
+            return 0.0
+        return max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        if self.wait_time() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.wait_time())
+
+    def block(self, seconds: float):
+        """Не выдавать токены seconds секунд (ответ 429 от Telegram)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        return now - self.updated > IDLE_BUCKET_SECONDS and now >= self.blocked_until
+
+
+@dataclass(order=True)
+class SendJob:
+    priority: int
+    seq: int
+    chat_id: int = field(compare=False)
+    text: str = field(compare=False)
+    kwargs: dict = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+def log_failed_send(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Сообщение не отправлено: {future.exception()}")
+
+
+class SendMetrics:
+    def __init__(self, window: int = 1000):
+        self.sent = 0
+        self.failed = 0
+        self.retry_after = 0
+        self.latency_sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, latency: float):
+        self.sent += 1
+        self.latency_sum += latency
+        self.recent.append(latency)
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class SendScheduler:
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = GLOBAL_RATE,
+        workers: int = SEND_WORKERS,
+    ):
+        self.bot = bot
+        self.workers = workers
+        self.metrics = SendMetrics()
+        self._global = TokenBucket(global_rate, capacity=global_rate)
+        self._chats: dict[int, TokenBucket] = {}
+        # неотправленные сообщения каждого чата, куча по (priority, seq)
+        self._pending: dict[int, list[SendJob]] = {}
+        # чаты с сообщениями: в _ready, на таймере или у воркера
+        self._active: set[int] = set()
+        # (priority, seq) актуальной записи чата в _ready; прочие — устаревшие
+        self._ready_entries: dict[int, tuple] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._ready: asyncio.PriorityQueue | None = None
+        self._seq = itertools.count()
+        self._tasks = []
+
+    async def start(self):
+        self._ready = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(
+        self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, **kwargs
+    ) -> asyncio.Future:
+        """Ставит сообщение в очередь; future вернёт Message или ошибку."""
+        future = asyncio.get_running_loop().create_future()
+        job = SendJob(
+            priority,
+            next(self._seq),
+            int(chat_id),
+            text,
+            kwargs,
+            future,
+            time.monotonic(),
+        )
+        heapq.heappush(self._pending.setdefault(job.chat_id, []), job)
+        if job.chat_id not in self._active:
+            self._active.add(job.chat_id)
+            self._schedule(job.chat_id)
+        else:
+            entry = self._ready_entries.get(job.chat_id)
+            if entry is not None and job.priority < entry[0]:
+                # оповещение не ждёт за обычными сообщениями других чатов
+                self._make_ready(job.chat_id)
+        return future
+
+    async def send_message(
+        self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, **kwargs
+    ):
+        return await self.submit(chat_id, text, priority, **kwargs)
+
+    def broadcast(
+        self, chat_ids, text: str, priority: int = PRIORITY_NORMAL, **kwargs
+    ) -> list:
+        """Рассылка в несколько чатов; не ждёт отправки, ошибки пишет в лог."""
+        futures = []
+        for chat_id in chat_ids:
+            future = self.submit(chat_id, text, priority, **kwargs)
+            future.add_done_callback(log_failed_send)
+            futures.append(future)
+        return futures
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10_000:
+                now = time.monotonic()
+                for idle_id, idle_bucket in list(self._chats.items()):
+                    if idle_id not in self._active and idle_bucket.idle(now):
+                        del self._chats[idle_id]
+            # у групп и каналов chat_id отрицательный
+            rate = GROUP_CHAT_RATE if chat_id < 0 else PRIVATE_CHAT_RATE
+            bucket = self._chats[chat_id] = TokenBucket(rate)
+        return bucket
+
+    def _schedule(self, chat_id: int):
+        """Ставит чат в _ready, как только у него будет токен; пустой — забывает."""
+        if not self._pending.get(chat_id):
+            self._pending.pop(chat_id, None)
+            self._active.discard(chat_id)
+            return
+        wait = self._chat_bucket(chat_id).wait_time()
+        if wait > 0:
+            loop = asyncio.get_running_loop()
+            self._timers[chat_id] = loop.call_later(wait, self._make_ready, chat_id)
+        else:
+            self._make_ready(chat_id)
+
+    def _make_ready(self, chat_id: int):
+        self._timers.pop(chat_id, None)
+        head = self._pending[chat_id][0]
+        self._ready_entries[chat_id] = (head.priority, head.seq)
+        self._ready.put_nowait((head.priority, head.seq, chat_id))
+
+    async def _worker(self):
+        while True:
+            priority, seq, chat_id = await self._ready.get()
+            try:
+                if self._ready_entries.get(chat_id) != (priority, seq):
+                    continue  # чат уже переставлен с более высоким приоритетом
+                del self._ready_entries[chat_id]
+                await self._send_next(chat_id)
+            except Exception:
+                logging.exception("Ошибка в очереди отправки")
+            finally:
+                self._ready.task_done()
+
+    async def _send_next(self, chat_id: int):
+        """
+        Отправляет первое сообщение чата. Пока чат у воркера, других записей
+        о нём в _ready нет, так что сообщения одного чата не обгоняют друг друга.
+        """
+        pending = self._pending[chat_id]
+        try:
+            job = heapq.heappop(pending)
+            if job.future.cancelled():
+                return
+            bucket = self._chat_bucket(job.chat_id)
+            if not bucket.try_acquire():
+                heapq.heappush(pending, job)
+                return
+            await self._global.acquire()
+            job.attempts += 1
+            try:
+                message = await self.bot.send_message(
+                    job.chat_id, job.text, **job.kwargs
+                )
+            except TelegramRetryAfter as e:
+                self.metrics.retry_after += 1
+                logging.warning(
+                    f"Telegram 429 для чата {job.chat_id}, ждём {e.retry_after} с"
+                )
+                bucket.block(e.retry_after)
+                error = e
+            except TelegramNetworkError as e:
+                bucket.block(2**job.attempts)
+                error = e
+            except Exception as e:
+                self._fail(job, e)
+                return
+            else:
+                self.metrics.observe(time.monotonic() - job.enqueued_at)
+                if not job.future.done():
+                    job.future.set_result(message)
+                return
+            if job.attempts >= MAX_ATTEMPTS:
+                self._fail(job, error)
+                return
+            # повтор остаётся первым: следующее сообщение в этот чат
+            # не обгонит то, на которое пришёл 429
+            heapq.heappush(pending, job)
+        finally:
+            self._schedule(chat_id)
+
+    def _fail(self, job: SendJob, error: Exception):
+        self.metrics.failed += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def render_metrics(self) -> str:
+        m = self.metrics
+        lines = [
+            "# TYPE bot_messages_sent_total counter",
+            f"bot_messages_sent_total {m.sent}",
+            "# TYPE bot_messages_failed_total counter",
+            f"bot_messages_failed_total {m.failed}",
+            "# TYPE bot_telegram_retry_after_total counter",
+            f"bot_telegram_retry_after_total {m.retry_after}",
+            "# TYPE bot_send_queue_size gauge",
+            f"bot_send_queue_size {sum(map(len, self._pending.values()))}",
+            "# TYPE bot_send_latency_seconds summary",
+            f'bot_send_latency_seconds{{quantile="0.5"}} {m.quantile(0.5):.3f}',
+            f'bot_send_latency_seconds{{quantile="0.95"}} {m.quantile(0.95):.3f}',
+            f"bot_send_latency_seconds_sum {m.latency_sum:.3f}",
+            f"bot_send_latency_seconds_count {m.sent}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+async def serve_metrics(scheduler: SendScheduler, port: int) -> web.AppRunner:
+    """Поднимает GET /metrics на указанном порту."""
+
+    async def metrics(request):
+        return web.Response(text=scheduler.render_metrics())
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    return runner
@@ -0,0 +1,255 @@
+"""
+Тесты бота. bot/ — не пакет, модули импортируют друг друга напрямую,
+поэтому запускаются отдельно от Django-тестов:
+
+    python -m unittest discover -s bot -p tests.py
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+import send_queue
+from fsm_storage import SQLiteStorage
+from queue_consumer import ChatOrderedConsumer
+from send_queue import PRIORITY_ALERT, SendScheduler
+
+
+class Feedback(StatesGroup):
+    waiting_for_rating = State()
+
+
+def key(chat_id=1, thread_id=None):
+    return StorageKey(bot_id=42, chat_id=chat_id, user_id=chat_id, thread_id=thread_id)
+
+
+class SQLiteStorageTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "fsm.sqlite3")
+
+    def open_storage(self, **kwargs):
+        storage = SQLiteStorage(self.path, **kwargs)
+        self.addAsyncCleanup(storage.close)
+        return storage
+
+    def rows(self, storage):
+        return storage._conn.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+
+    async def test_state_and_data_survive_restart(self):
+        storage = self.open_storage()
+        await storage.set_state(key(), Feedback.waiting_for_rating)
+        await storage.set_data(key(), {"order_code": "123", "comment": "спасибо"})
+
+        storage = self.open_storage()
+        self.assertEqual(await storage.get_state(key()), "Feedback:waiting_for_rating")
+        self.assertEqual(
+            await storage.get_data(key()), {"order_code": "123", "comment": "спасибо"}
+        )
+        # set_state не затирает данные, set_data — состояние
+        await storage.set_state(key(), None)
+        self.assertEqual((await storage.get_data(key()))["order_code"], "123")
+
+    async def test_keys_are_separate(self):
+        storage = self.open_storage()
+        await storage.set_data(key(thread_id=7), {"n": 1})
+
+        self.assertEqual(await storage.get_data(key()), {})
+        self.assertEqual(await storage.get_data(key(chat_id=2, thread_id=7)), {})
+        self.assertEqual(await storage.get_data(key(thread_id=7)), {"n": 1})
+
+    async def test_cleared_session_leaves_no_row(self):
+        storage = self.open_storage()
+        await storage.set_state(key(), "Feedback:waiting_for_rating")
+        await storage.set_data(key(), {"n": 1})
+
+        await storage.set_state(key(), None)
+        await storage.set_data(key(), {})
+
+        self.assertEqual(self.rows(storage), 0)
+
+    async def test_abandoned_session_expires(self):
+        storage = self.open_storage(ttl=-1)
+        await storage.set_state(key(), "Feedback:waiting_for_rating")
+        await storage.set_data(key(chat_id=2), {"n": 1})
+
+        self.assertIsNone(await storage.get_state(key()))
+        self.assertEqual(await storage.get_data(key(chat_id=2)), {})
+        self.assertEqual(storage.purge_expired(), 2)
+        self.assertEqual(self.rows(storage), 0)
+
+
+class FakeBot:
+    """Запоминает отправленное; errors — что бросить на первые попытки в чат."""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        errors = self.errors.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text))
+        return text
+
+
+class SendSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    GROUP = -100
+    loop_time = staticmethod(lambda: asyncio.get_running_loop().time())
+
+    async def start_scheduler(self, bot, **kwargs):
+        scheduler = SendScheduler(bot, **kwargs)
+        await scheduler.start()
+        self.addAsyncCleanup(scheduler.close)
+        return scheduler
+
+    async def test_slow_group_does_not_hold_workers(self):
+        bot = FakeBot()
+        # группа — сообщение в 0.2 с; один воркер, чтобы простой был заметен
+        with mock.patch.object(send_queue, "GROUP_CHAT_RATE", 5):
+            scheduler = await self.start_scheduler(bot, workers=1)
+            group = [scheduler.submit(self.GROUP, f"g{n}") for n in range(3)]
+            alert = scheduler.submit(5, "alert", priority=PRIORITY_ALERT)
+            private = scheduler.submit(6, "p")
+
+            started = self.loop_time()
+            await asyncio.wait_for(asyncio.gather(alert, private), 0.15)
+            self.assertLess(self.loop_time() - started, 0.15)
+            await asyncio.wait_for(asyncio.gather(*group), 1)
+
+        self.assertEqual(
+            [text for _, text in bot.sent], ["alert", "g0", "p", "g1", "g2"]
+        )
+
+    async def test_alert_overtakes_queued_chat(self):
+        bot = FakeBot()
+        with mock.patch.object(send_queue, "PRIVATE_CHAT_RATE", 50):
+            scheduler = await self.start_scheduler(bot, workers=1)
+            normal = [scheduler.submit(chat_id, "n") for chat_id in (1, 2, 3)]
+            # у чата 3 уже есть обычное сообщение — оповещение его опережает
+            alert = scheduler.submit(3, "alert", priority=PRIORITY_ALERT)
+
+            await asyncio.wait_for(asyncio.gather(alert, *normal), 1)
+
+        self.assertEqual(bot.sent[0], (3, "alert"))
+        self.assertEqual(scheduler.metrics.sent, 4)
+
+    async def test_retry_after_keeps_chat_order(self):
+        bot = FakeBot({7: [TelegramRetryAfter(mock.Mock(), "Too Many Requests", 0)]})
+        with mock.patch.object(send_queue, "PRIVATE_CHAT_RATE", 50):
+            scheduler = await self.start_scheduler(bot)
+            futures = [scheduler.submit(7, text) for text in "abc"]
+            futures.append(scheduler.submit(8, "other"))
+
+            with self.assertLogs(level="WARNING"):
+                await asyncio.wait_for(asyncio.gather(*futures), 1)
+
+        self.assertEqual([text for chat, text in bot.sent if chat == 7], list("abc"))
+        self.assertEqual(scheduler.metrics.retry_after, 1)
+        self.assertIn("bot_send_queue_size 0", scheduler.render_metrics())
+        # отправленные чаты не держат за собой очередей
+        self.assertEqual(scheduler._pending, {})
+
+    async def test_other_errors_are_not_retried(self):
+        error = RuntimeError("chat not found")
+        bot = FakeBot({9: [error]})
+        scheduler = await self.start_scheduler(bot)
+
+        with self.assertRaises(RuntimeError):
+            await asyncio.wait_for(scheduler.submit(9, "x"), 1)
+        self.assertEqual(scheduler.metrics.failed, 1)
+
+
+class FakeIncomingMessage:
+    def __init__(self, data):
+        self.body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        self.headers = {"x-source": "test"}
+        self.content_type = "application/json"
+        self.ack = mock.AsyncMock()
+        self.nack = mock.AsyncMock()
+
+
+class ChatOrderedConsumerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.handled = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.consumer = ChatOrderedConsumer(
+            "telegram_queue", self.handler, concurrency=3
+        )
+        self.consumer._channel = mock.Mock()
+        self.publish = self.consumer._channel.default_exchange.publish = (
+            mock.AsyncMock()
+        )
+
+    async def handler(self, data):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(data.get("delay", 0))
+            if data.get("fail"):
+                raise RuntimeError("telegram down")
+            self.handled.append((data["chat_id"], data["n"]))
+        finally:
+            self.in_flight -= 1
+
+    async def deliver(self, *payloads):
+        messages = [FakeIncomingMessage(payload) for payload in payloads]
+        for message in messages:
+            await self.consumer.on_message(message)
+        await asyncio.gather(*list(self.consumer._tails.values()))
+        return messages
+
+    async def test_order_within_chat_concurrency_across_chats(self):
+        messages = await self.deliver(
+            {"chat_id": 1, "n": 1, "delay": 0.05},
+            {"chat_id": 1, "n": 2},
+            *({"chat_id": chat_id, "n": 1, "delay": 0.02} for chat_id in range(2, 7)),
+        )
+
+        self.assertEqual([n for chat, n in self.handled if chat == 1], [1, 2])
+        self.assertEqual(self.max_in_flight, 3)
+        self.assertEqual(self.consumer.stats["processed"], 7)
+        self.assertTrue(all(m.ack.await_count == 1 for m in messages))
+        self.assertEqual(self.consumer._tails, {})
+
+    async def test_failed_message_is_dead_lettered(self):
+        with self.assertLogs(level="ERROR"):
+            failed, following = await self.deliver(
+                {"chat_id": 1, "n": 1, "fail": True}, {"chat_id": 1, "n": 2}
+            )
+
+        (dead,), kwargs = self.publish.await_args
+        self.assertEqual(kwargs["routing_key"], "telegram_queue.dlq")
+        self.assertEqual(dead.body, failed.body)
+        self.assertEqual(dead.headers["x-original-queue"], "telegram_queue")
+        self.assertIn("telegram down", dead.headers["x-error"])
+        self.assertEqual(dead.headers["x-source"], "test")
+        failed.ack.assert_awaited_once()
+        # следующее сообщение чата не застревает за упавшим
+        self.assertEqual(self.handled, [(1, 2)])
+        following.ack.assert_awaited_once()
+
+    async def test_malformed_message_is_dead_lettered(self):
+        (message,) = await self.deliver(b"not json")
+
+        self.publish.assert_awaited_once()
+        message.ack.assert_awaited_once()
+        self.assertEqual(self.consumer.stats["dead_lettered"], 1)
+
+    async def test_requeued_if_dlq_is_unavailable(self):
+        self.publish.side_effect = ConnectionError
+        with self.assertLogs(level="ERROR"):
+            (message,) = await self.deliver({"chat_id": 1, "n": 1, "fail": True})
+
+        message.nack.assert_awaited_once_with(requeue=True)
+        message.ack.assert_not_awaited()
@@ -0,0 +1,156 @@
+"""
+Общий издатель сообщений в RabbitMQ.
+
+Держит одно долгоживущее соединение на каждый брокер вместо
+BlockingConnection на каждое сообщение, объявляет очередь один раз,
+ждёт publisher confirm и сам переподключается при обрыве.
+
+Модуль не зависит от Django: им пользуются и management-команды,
+и воркер Kaspi, и телеграм-бот.
+"""
+
+import asyncio
+import atexit
+import json
+import logging
+import threading
+
+import pika
+from pika.exceptions import AMQPError, NackError, UnroutableError
+
+log = logging.getLogger(__name__)
+
+
+class RabbitPublisher:
+    """
+    Потокобезопасный издатель поверх одного pika.BlockingConnection.
+
+    BlockingConnection нельзя делить между потоками, поэтому все обращения
+    к нему идут под self._lock. Из asyncio-кода используйте apublish().
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 5672,
+        username: str = "guest",
+        password: str = "guest",
+        retries: int = 2,
+    ):
+        self.parameters = pika.ConnectionParameters(
+            host=host,
+            port=port,
+            credentials=pika.PlainCredentials(username, password),
+            heartbeat=60,
+            blocked_connection_timeout=300,
+        )
+        self.retries = retries
+        self.stats = {"publishes": 0, "confirms": 0, "nacks": 0, "reconnects": 0}
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._channel = None
+        self._declared_queues = set()
+
+    def _get_channel(self):
+        if self._channel is not None and self._channel.is_open:
+            return self._channel
+
+        if self._connection is not None:
+            self.stats["reconnects"] += 1
+            self._close()
+        self._connection = pika.BlockingConnection(self.parameters)
+        self._channel = self._connection.channel()
+        self._channel.confirm_delivery()
+        # после переподключения очереди могли пропасть (auto-delete/рестарт брокера)
+        self._declared_queues.clear()
+        return self._channel
+
+    def _close(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except AMQPError:
+            pass
+        self._connection = None
+        self._channel = None
+
+    def publish(self, message_body: dict, queue_name: str):
+        """
+        Отправляет message_body (JSON) в очередь queue_name через default exchange
+        и ждёт подтверждения от брокера. При обрыве соединения
+        переподключается и повторяет отправку до self.retries раз.
+        """
+        body_str = json.dumps(message_body, ensure_ascii=False)
+
+        with self._lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    channel = self._get_channel()
+                    if queue_name not in self._declared_queues:
+                        channel.queue_declare(queue=queue_name, durable=True)
+                        self._declared_queues.add(queue_name)
+
+                    self.stats["publishes"] += 1
+                    channel.basic_publish(
+                        exchange="",
+                        routing_key=queue_name,
+                        body=body_str,
+                        properties=pika.BasicProperties(
+                            delivery_mode=2  # persistent
+                        ),
+                    )
+                    self.stats["confirms"] += 1
+                    return
+                except (NackError, UnroutableError):
+                    # брокер жив, но сообщение не принял — повтор не поможет
+                    self.stats["nacks"] += 1
+                    raise
+                except AMQPError as e:
+                    log.warning(
+                        "RabbitMQ publish to %s failed (attempt %s): %r",
+                        queue_name,
+                        attempt + 1,
+                        e,
+                    )
+                    if self._connection is not None:
+                        self.stats["reconnects"] += 1
+                    self._close()
+                    if attempt == self.retries:
+                        raise
+
+    async def apublish(self, message_body: dict, queue_name: str):
+        """То же, что publish(), но не блокирует event loop."""
+        await asyncio.to_thread(self.publish, message_body, queue_name)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+def get_publisher(
+    host: str,
+    port: int = 5672,
+    username: str = "guest",
+    password: str = "guest",
+) -> RabbitPublisher:
+    """Возвращает общий на процесс издатель для указанного брокера."""
+    key = (host, port, username, password)
+    with _publishers_lock:
+        publisher = _publishers.get(key)
+        if publisher is None:
+            publisher = RabbitPublisher(host, port, username, password)
+            _publishers[key] = publisher
+        return publisher
+
+
+@atexit.register
+def close_publishers():
+    with _publishers_lock:
+        for publisher in _publishers.values():
+            publisher.close()
+        _publishers.clear()
@@ -0,0 +1,62 @@
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase
+from pika.exceptions import AMQPConnectionError, NackError
+
+from core.rabbitmq import RabbitPublisher
+
+
+class RabbitPublisherTest(SimpleTestCase):
+    """Одно соединение на брокер, очередь объявляется один раз, обрыв — повтор."""
+
+    def setUp(self):
+        patcher = mock.patch("core.rabbitmq.pika.BlockingConnection")
+        self.BlockingConnection = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.publisher = RabbitPublisher("rabbit.local")
+
+    def channel(self):
+        return self.BlockingConnection.return_value.channel.return_value
+
+    def test_connection_and_declaration_are_reused(self):
+        for n in range(3):
+            self.publisher.publish({"n": n, "text": "привет"}, "orders_queue")
+
+        self.BlockingConnection.assert_called_once()
+        self.channel().confirm_delivery.assert_called_once()
+        self.channel().queue_declare.assert_called_once_with(
+            queue="orders_queue", durable=True
+        )
+        bodies = [
+            json.loads(call.kwargs["body"])
+            for call in self.channel().basic_publish.call_args_list
+        ]
+        self.assertEqual([body["n"] for body in bodies], [0, 1, 2])
+        self.assertEqual(self.publisher.stats["confirms"], 3)
+
+    def test_reconnects_after_connection_error(self):
+        self.channel().basic_publish.side_effect = [AMQPConnectionError(), None]
+
+        with self.assertLogs("core.rabbitmq", "WARNING"):
+            self.publisher.publish({"n": 1}, "orders_queue")
+
+        self.assertEqual(self.BlockingConnection.call_count, 2)
+        # после переподключения очередь объявляется заново
+        self.assertEqual(self.channel().queue_declare.call_count, 2)
+        self.assertEqual(self.publisher.stats["confirms"], 1)
+
+    def test_gives_up_after_retries(self):
+        self.channel().basic_publish.side_effect = AMQPConnectionError()
+
+        with self.assertRaises(AMQPConnectionError), self.assertLogs("core.rabbitmq"):
+            self.publisher.publish({"n": 1}, "orders_queue")
+        self.assertEqual(self.BlockingConnection.call_count, self.publisher.retries + 1)
+
+    def test_nack_is_not_retried(self):
+        self.channel().basic_publish.side_effect = NackError([])
+
+        with self.assertRaises(NackError):
+            self.publisher.publish({"n": 1}, "orders_queue")
+        self.BlockingConnection.assert_called_once()
+        self.assertEqual(self.publisher.stats["nacks"], 1)
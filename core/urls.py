@@ -4,11 +4,13 @@ from django.conf.urls.static import static
 from django.conf import settings
 
 from app_orders.urls import urlpatterns as urlpatterns_video
+from app_cargo.urls import urlpatterns as urlpatterns_cargo
 
 urlpatterns = (
     [
         path("admin/", admin.site.urls),
         path("v1/", include(urlpatterns_video)),
+        path("v1/", include(urlpatterns_cargo)),
     ]
     + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -3,10 +3,8 @@ python manage.py makemigrations
 python manage.py migrate
 python manage.py collectstatic --no-input
 
-python manage.py consume_orders --host=185.100.67.246 &
-python manage.py consume_feedback &
-python manage.py consume_qr_events &
-python manage.py cargo_qr &
+# orders_queue, feedback_queue, qr_events, work_qr_queue и video_processing в одном процессе
+python manage.py consume_all &
 python /app/bot/bot_telegram7.py &
 
 
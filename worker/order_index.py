@@ -0,0 +1,118 @@
+"""
+Индекс уже отправленных в RabbitMQ заказов Kaspi.
+
+Для каждого orderCode хранит два отпечатка:
+  • list_fp   – хэш строки заказа из архива (orderTabs/archive);
+  • detail_fp – время последней записи истории + хэш деталей заказа.
+Если строка архива не изменилась, детали не запрашиваем вовсе;
+если изменилась, но детали те же — не публикуем повторно.
+
+Лежит в SQLite-файле (по умолчанию рядом с воркером, путь можно задать
+переменной окружения KASPI_PUBLISHED_INDEX_FILE), поэтому переживает
+рестарт и общий для worker.py и worker1.py. Файл открывается при первом
+обращении к get_published_index(), а не при импорте модуля.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+INDEX_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "published_orders.sqlite3"
+)
+INDEX_FILE_ENV = "KASPI_PUBLISHED_INDEX_FILE"
+MAX_ENTRIES = 100_000
+
+
+def content_hash(data: dict) -> str:
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def detail_fingerprint(details: dict) -> str:
+    history = details.get("historyEntries") or []
+    last_change = max((h.get("createDate") or 0 for h in history), default=0)
+    return f"{last_change}:{content_hash(details)}"
+
+
+class PublishedOrderIndex:
+    def __init__(self, path: str = INDEX_FILE, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.skipped_fetches = 0
+        self.skipped_publishes = 0
+
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS published ("
+                " order_code TEXT PRIMARY KEY,"
+                " list_fp TEXT,"
+                " detail_fp TEXT,"
+                " seen_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS published_seen_at ON published (seen_at)"
+            )
+
+    def _get(self, order_code: str):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT list_fp, detail_fp FROM published WHERE order_code = ?",
+                (order_code,),
+            ).fetchone()
+
+    def list_unchanged(self, order_code: str, list_fp: str) -> bool:
+        row = self._get(order_code)
+        if row is not None and row[0] == list_fp:
+            self.skipped_fetches += 1
+            return True
+        return False
+
+    def details_unchanged(self, order_code: str, detail_fp: str) -> bool:
+        row = self._get(order_code)
+        if row is not None and row[1] == detail_fp:
+            self.skipped_publishes += 1
+            return True
+        return False
+
+    def remember(self, order_code: str, list_fp: Optional[str], detail_fp: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO published (order_code, list_fp, detail_fp, seen_at)"
+                " VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (order_code) DO UPDATE SET"
+                " list_fp = excluded.list_fp,"
+                " detail_fp = excluded.detail_fp,"
+                " seen_at = excluded.seen_at",
+                (order_code, list_fp, detail_fp, time.time()),
+            )
+            self._puts += 1
+            # подрезаем самые старые записи не на каждой вставке
+            if self._puts % 1000 == 0:
+                self._conn.execute(
+                    "DELETE FROM published WHERE order_code IN ("
+                    " SELECT order_code FROM published"
+                    " ORDER BY seen_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+
+_published_index: Optional[PublishedOrderIndex] = None
+_published_index_lock = threading.Lock()
+
+
+def get_published_index() -> PublishedOrderIndex:
+    """Общий на процесс индекс; файл открывается при первом вызове."""
+    global _published_index
+    with _published_index_lock:
+        if _published_index is None:
+            _published_index = PublishedOrderIndex(
+                os.environ.get(INDEX_FILE_ENV) or INDEX_FILE
+            )
+        return _published_index
@@ -0,0 +1,485 @@
+"""
+Тесты воркеров Kaspi. worker/ — не пакет, модули импортируют друг друга
+напрямую, поэтому запускаются отдельно от Django-тестов:
+
+    python -m unittest discover -s worker -p tests.py
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from contextlib import asynccontextmanager, redirect_stdout
+from io import StringIO
+from unittest import mock
+
+import yarl
+
+import order_index
+import worker1
+from order_index import PublishedOrderIndex, content_hash, detail_fingerprint
+
+
+def use_temporary_index(test, path):
+    """Индекс воркера — во временном файле, а не рядом с исходниками."""
+    test.enterContext(mock.patch.dict(os.environ, {order_index.INDEX_FILE_ENV: path}))
+    test.enterContext(mock.patch.object(order_index, "_published_index", None))
+
+
+class FakeResponse:
+    def __init__(self, status=200, data=None):
+        self.status = status
+        self.data = data
+
+    async def json(self, content_type=None):
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+    async def text(self):
+        return str(self.data)
+
+
+class FakeKaspi:
+    """
+    Подменяет kaspi_auth: отвечает на GET по таблице url-фрагмент -> ответы
+    и считает, сколько запросов выполнялось одновременно.
+    """
+
+    def __init__(self, routes, delay=0.01):
+        self.routes = {key: list(answers) for key, answers in routes.items()}
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @asynccontextmanager
+    async def get(self, url, **kwargs):
+        self.calls.append(url)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            key = next(key for key in self.routes if key in url)
+            answers = self.routes[key]
+            answer = answers.pop(0) if len(answers) > 1 else answers[0]
+            if isinstance(answer, Exception):
+                raise answer
+            yield answer
+        finally:
+            self.in_flight -= 1
+
+
+def order_details(order_code, create_date=1):
+    return {
+        "orderCode": order_code,
+        "historyEntries": [{"createDate": create_date, "action": "COMPLETED"}],
+    }
+
+
+class WorkerTestCase(unittest.IsolatedAsyncioTestCase):
+    """Общая обвязка: временный индекс, подменённые Kaspi и RabbitMQ."""
+
+    routes = {}
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp_dir = tmp.name
+        use_temporary_index(self, os.path.join(tmp.name, "index.sqlite3"))
+        self.index = order_index.get_published_index()
+        self.addCleanup(self.index._conn.close)
+        self.kaspi = FakeKaspi(self.routes)
+        self.published = []
+
+        for target, value in [
+            ("kaspi_auth", self.kaspi),
+            ("publish_to_rabbitmq", self.publish),
+            ("DETAIL_BACKOFF_SECONDS", 0),
+            ("QUARANTINE_FILE", os.path.join(tmp.name, "quarantine.jsonl")),
+            ("WATERMARK_FILE", os.path.join(tmp.name, "watermark.json")),
+        ]:
+            patcher = mock.patch.object(worker1, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # воркер печатает каждый шаг — в выводе тестов это лишнее
+        self.enterContext(redirect_stdout(StringIO()))
+
+    def publish(self, message_body, queue_name="orders_queue"):
+        self.published.append(message_body)
+
+    async def run_poller(self, timeout=0.5):
+        """Крутит fetch_orders_background, пока не сохранится граница окна."""
+        task = asyncio.create_task(worker1.fetch_orders_background())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not os.path.exists(worker1.WATERMARK_FILE) and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        return worker1.ArchiveWatermark(worker1.WATERMARK_FILE).load()
+
+    def quarantined(self):
+        try:
+            with open(worker1.QUARANTINE_FILE, encoding="utf-8") as f:
+                return [json.loads(line) for line in f]
+        except FileNotFoundError:
+            return []
+
+
+class ConcurrentDetailsTest(WorkerTestCase):
+    """Детали запрашиваются параллельно, но не больше DETAIL_CONCURRENCY сразу."""
+
+    def setUp(self):
+        self.routes = {
+            f"/order/{n}?": [FakeResponse(data=order_details(str(n)))]
+            for n in range(20)
+        }
+        self.routes["/order/503?"] = [
+            FakeResponse(503, "busy"),
+            FakeResponse(data=order_details("503")),
+        ]
+        self.routes["/order/404?"] = [FakeResponse(404, "not found")]
+        super().setUp()
+
+    async def test_bounded_concurrency(self):
+        orders = [{"orderCode": str(n)} for n in range(20)]
+
+        failed = await worker1.process_orders_data({"orders": orders})
+
+        self.assertEqual(failed, [])
+        self.assertEqual(self.kaspi.max_in_flight, worker1.DETAIL_CONCURRENCY)
+        self.assertCountEqual(
+            [details["orderCode"] for details in self.published],
+            [str(n) for n in range(20)],
+        )
+
+    async def test_retries_server_errors(self):
+        failed = await worker1.process_orders_data({"orders": [{"orderCode": "503"}]})
+
+        self.assertEqual(failed, [])
+        self.assertEqual(len(self.kaspi.calls), 2)
+        self.assertEqual([d["orderCode"] for d in self.published], ["503"])
+
+    async def test_client_error_is_not_retried(self):
+        failed = await worker1.process_orders_data({"orders": [{"orderCode": "404"}]})
+
+        self.assertEqual(failed, [])
+        self.assertEqual(len(self.kaspi.calls), 1)
+        self.assertEqual(self.published, [])
+        self.assertEqual([r["orderCode"] for r in self.quarantined()], ["404"])
+
+    async def test_publish_failure_is_reported(self):
+        with mock.patch.object(
+            worker1, "publish_to_rabbitmq", side_effect=ConnectionError
+        ):
+            failed = await worker1.process_orders_data({"orders": [{"orderCode": "1"}]})
+
+        self.assertEqual(failed, ["1"])
+        # не запомнили — в следующем окне заказ отправится снова
+        self.assertIsNone(self.index._get("1"))
+
+
+class PermanentFailuresTest(WorkerTestCase):
+    """Постоянные ошибки уходят в карантин и не держат окно архива."""
+
+    def setUp(self):
+        self.routes = {
+            "orderTabs/archive": [
+                FakeResponse(data={"orders": [{"orderCode": "1"}, {"orderCode": "2"}]})
+            ],
+            "/order/1?": [FakeResponse(data=order_details("1"))],
+            "/order/2?": [FakeResponse(404, "not found")],
+            "/order/3?": [FakeResponse(data=ValueError("<html>"))],
+            "/order/4?": [FakeResponse(data={})],
+            "/order/5?": [FakeResponse(503, "busy")],
+        }
+        super().setUp()
+
+    async def test_bad_bodies_are_quarantined(self):
+        orders = [{"orderCode": code, "total": 1} for code in ("3", "4", "5")]
+
+        failed = await worker1.process_orders_data({"orders": orders})
+
+        # 503 — временная ошибка: окно повторится
+        self.assertEqual(failed, ["5"])
+        self.assertEqual(len([c for c in self.kaspi.calls if "/order/5?" in c]), 4)
+        self.assertCountEqual(
+            [(r["orderCode"], r["order"]) for r in self.quarantined()],
+            [("3", orders[0]), ("4", orders[1])],
+        )
+
+    async def test_watermark_moves_past_permanent_failure(self):
+        watermark = await self.run_poller()
+
+        self.assertIsNotNone(watermark)
+        self.assertEqual([d["orderCode"] for d in self.published], ["1"])
+        self.assertEqual([r["orderCode"] for r in self.quarantined()], ["2"])
+
+    async def test_watermark_waits_for_retryable_failure(self):
+        self.kaspi.routes["orderTabs/archive"] = [
+            FakeResponse(data={"orders": [{"orderCode": "5"}]})
+        ]
+
+        self.assertIsNone(await self.run_poller(timeout=0.2))
+        self.assertEqual(self.quarantined(), [])
+
+
+class ArchiveWindowTest(WorkerTestCase):
+    """Окно архива выгружается постранично, размер окна следует за потоком."""
+
+    routes = {
+        "start=0&": [
+            FakeResponse(data={"orders": [{"orderCode": "1"}, {"orderCode": "2"}]})
+        ],
+        "start=2&": [
+            FakeResponse(data={"orders": [{"orderCode": "3"}, {"orderCode": "4"}]})
+        ],
+        "start=4&": [FakeResponse(data={"orders": [{"orderCode": "5"}]})],
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(worker1, "ARCHIVE_PAGE_SIZE", 2))
+
+    def codes(self, orders):
+        return [order["orderCode"] for order in orders]
+
+    async def test_pages_until_short_page(self):
+        orders = await worker1.fetch_archive_window(1000, 2000)
+
+        self.assertEqual(self.codes(orders), ["1", "2", "3", "4", "5"])
+        self.assertEqual(len(self.kaspi.calls), 3)
+        self.assertTrue(
+            all("fromDate=1000&toDate=2000" in url for url in self.kaspi.calls)
+        )
+
+    async def test_stops_at_total_without_extra_request(self):
+        self.kaspi.routes["start=2&"] = [
+            FakeResponse(data={"orders": [{"orderCode": "3"}], "total": 3})
+        ]
+        self.kaspi.routes["start=0&"][0].data["total"] = 3
+
+        orders = await worker1.fetch_archive_window(1000, 2000)
+
+        self.assertEqual(self.codes(orders), ["1", "2", "3"])
+        self.assertEqual(len(self.kaspi.calls), 2)
+
+    async def test_failed_page_fails_whole_window(self):
+        self.kaspi.routes["start=2&"] = [FakeResponse(status=500, data="down")]
+
+        self.assertIsNone(await worker1.fetch_archive_window(1000, 2000))
+
+    def test_window_grows_when_quiet_and_shrinks_when_busy(self):
+        hour = 60 * 60 * 1000
+        # пустое окно — следующее в полтора раза больше (сглаженное удвоение)
+        self.assertEqual(worker1.next_window_size(hour, 0, hour), hour * 3 // 2)
+        # 800 заказов за час при цели 200 — цель 15 минут, шаг к ней наполовину
+        self.assertEqual(
+            worker1.next_window_size(hour, 800, hour), (hour + hour // 4) // 2
+        )
+        # ровно целевой поток — окно не меняется
+        self.assertEqual(worker1.next_window_size(hour, 200, hour), hour)
+
+    def test_window_stays_within_bounds(self):
+        self.assertEqual(
+            worker1.next_window_size(worker1.MAX_WINDOW_MS, 0, worker1.MAX_WINDOW_MS),
+            worker1.MAX_WINDOW_MS,
+        )
+        self.assertEqual(
+            worker1.next_window_size(worker1.MIN_WINDOW_MS, 10**6, 1000),
+            worker1.MIN_WINDOW_MS,
+        )
+
+    async def test_poller_widens_window_after_quiet_windows(self):
+        spans = []
+
+        async def empty_window(from_date, to_date):
+            spans.append(to_date - from_date)
+            return []
+
+        now_ms = int(datetime.datetime.now().timestamp() * 1000)
+        worker1.ArchiveWatermark(worker1.WATERMARK_FILE).save(
+            now_ms - 24 * 60 * 60 * 1000
+        )
+        with mock.patch.object(worker1, "fetch_archive_window", empty_window):
+            task = asyncio.create_task(worker1.fetch_orders_background())
+            while len(spans) < 4:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        # граница сдвигается на всё окно, следующее окно шире
+        window = worker1.INITIAL_WINDOW_MS
+        self.assertEqual(
+            spans[:4], [window, window * 3 // 2, window * 9 // 4, window * 27 // 8]
+        )
+
+
+class PublishedOrderIndexTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "index.sqlite3")
+
+    def open_index(self, **kwargs):
+        index = PublishedOrderIndex(self.path, **kwargs)
+        self.addCleanup(index._conn.close)
+        return index
+
+    def test_shared_index_opens_lazily_at_configured_path(self):
+        use_temporary_index(self, self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+        index = order_index.get_published_index()
+        self.addCleanup(index._conn.close)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertIs(order_index.get_published_index(), index)
+
+    def test_fingerprints_survive_restart(self):
+        self.open_index().remember("1", "list-a", "detail-a")
+
+        index = self.open_index()
+        self.assertTrue(index.list_unchanged("1", "list-a"))
+        self.assertFalse(index.list_unchanged("1", "list-b"))
+        self.assertTrue(index.details_unchanged("1", "detail-a"))
+        self.assertFalse(index.details_unchanged("2", "detail-a"))
+        self.assertEqual((index.skipped_fetches, index.skipped_publishes), (1, 1))
+
+    def test_oldest_entries_are_trimmed(self):
+        index = self.open_index(max_entries=10)
+        for n in range(1000):
+            index.remember(str(n), "list", "detail")
+
+        codes = [
+            row[0] for row in index._conn.execute("SELECT order_code FROM published")
+        ]
+        self.assertCountEqual(codes, [str(n) for n in range(990, 1000)])
+
+    def test_detail_fingerprint_tracks_last_history_entry(self):
+        details = order_details("1", create_date=5)
+        details["historyEntries"].append({"createDate": 9})
+
+        self.assertTrue(detail_fingerprint(details).startswith("9:"))
+        self.assertNotEqual(
+            detail_fingerprint(details), detail_fingerprint(order_details("1", 5))
+        )
+        self.assertEqual(content_hash({"a": 1, "b": 2}), content_hash({"b": 2, "a": 1}))
+
+
+class DedupTest(WorkerTestCase):
+    """Неизменённые заказы не запрашиваются и не публикуются повторно."""
+
+    routes = {"/order/1?": [FakeResponse(data=order_details("1"))]}
+
+    async def test_unchanged_list_row_skips_fetch(self):
+        orders = {"orders": [{"orderCode": "1", "state": "COMPLETED"}]}
+
+        await worker1.process_orders_data(orders)
+        await worker1.process_orders_data(orders)
+
+        self.assertEqual(len(self.kaspi.calls), 1)
+        self.assertEqual(len(self.published), 1)
+
+    async def test_unchanged_details_skip_publish(self):
+        await worker1.process_orders_data({"orders": [{"orderCode": "1", "v": 1}]})
+        # строка архива изменилась, а детали те же — запрашиваем, но не шлём
+        await worker1.process_orders_data({"orders": [{"orderCode": "1", "v": 2}]})
+
+        self.assertEqual(len(self.kaspi.calls), 2)
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(self.index.skipped_publishes, 1)
+
+
+class FakeClientResponse:
+    def __init__(self, status=200, url="https://mc.shop.kaspi.kz/mc/api/x"):
+        self.status = status
+        self.url = yarl.URL(url)
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+LOGIN_PAGE = "https://idmc.shop.kaspi.kz/login"
+
+
+class KaspiAuthenticatorTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        storage = worker1.SessionStorage()
+        storage.last_auth_time = datetime.datetime.now()
+        storage.mc_sid = "sid-1"
+        self.auth = worker1.KaspiAuthenticator(storage)
+        self.client = mock.Mock(closed=False)
+        self.auth._client = self.client
+        self.logins = 0
+        self.enterContext(mock.patch.object(self.auth, "_login", self.login))
+        self.enterContext(redirect_stdout(StringIO()))
+
+    async def login(self):
+        self.logins += 1
+        await asyncio.sleep(0.01)
+        self.auth.storage.mc_sid = f"sid-{self.logins + 1}"
+
+    def answer(self, *responses):
+        self.client.get = mock.AsyncMock(side_effect=responses)
+        return responses
+
+    async def test_reauthorizes_once_and_retries(self):
+        rejected, ok = self.answer(FakeClientResponse(401), FakeClientResponse(200))
+
+        async with self.auth.get("https://mc.shop.kaspi.kz/mc/api/x") as resp:
+            self.assertIs(resp, ok)
+        self.assertEqual(self.logins, 1)
+        self.assertTrue(rejected.released and ok.released)
+
+    async def test_second_rejection_raises(self):
+        responses = self.answer(
+            FakeClientResponse(401), FakeClientResponse(200, LOGIN_PAGE)
+        )
+
+        with self.assertRaises(worker1.KaspiAuthError):
+            async with self.auth.get("https://mc.shop.kaspi.kz/mc/api/x"):
+                self.fail("страница логина не должна доходить до вызывающего")
+        self.assertTrue(all(resp.released for resp in responses))
+
+    async def test_concurrent_callers_share_one_login(self):
+        await asyncio.gather(*(self.auth.refresh(stale_sid="sid-1") for _ in range(5)))
+
+        self.assertEqual(self.logins, 1)
+        # сессия уже сменилась — устаревший sid повторного входа не вызывает
+        await self.auth.refresh(stale_sid="sid-1")
+        self.assertEqual(self.logins, 1)
+
+
+class ArchiveAuthFailureTest(WorkerTestCase):
+    """Отказ в авторизации не роняет фоновый сбор заказов."""
+
+    routes = {
+        "orderTabs/archive": [
+            worker1.KaspiAuthError("не пускает"),
+            FakeResponse(data={"orders": []}),
+        ]
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(worker1, "AUTH_RETRY_SECONDS", 0))
+
+    async def test_auth_error_propagates_from_window(self):
+        with self.assertRaises(worker1.KaspiAuthError):
+            await worker1.fetch_archive_window(0, 1)
+
+    async def test_broken_json_is_a_failed_window(self):
+        self.kaspi.routes["orderTabs/archive"] = [FakeResponse(data=ValueError())]
+
+        self.assertIsNone(await worker1.fetch_archive_window(0, 1))
+
+    async def test_polling_survives_auth_error(self):
+        self.assertIsNotNone(await self.run_poller())
+        self.assertEqual(len(self.kaspi.calls), 2)
@@ -1,14 +1,21 @@
-import pika
+import os
+import sys
 import asyncio
 import datetime
 from typing import Optional
 
-import json
 import requests
 from fastapi import FastAPI, Query
 
 import uvicorn
 
+# Общий издатель RabbitMQ лежит в core/ (корень проекта)
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(BASE_DIR)
+
+from core.rabbitmq import get_publisher
+from order_index import content_hash, detail_fingerprint, get_published_index
+
 
 # ------------------------------------------------------------------------------------
 # 1) Глобальное хранилище для сессии
@@ -204,6 +211,9 @@ async def lifespan(app: FastAPI):
     - до yield: код, выполняющийся "при старте" приложения
     - после yield: код, выполняющийся "при завершении" приложения
     """
+    # Индекс отправленных заказов открываем при старте, а не при импорте
+    get_published_index()
+
     # Запускаем авторизацию (обязательная задача)
     auth_task = asyncio.create_task(auth_loop_background())
 
@@ -236,44 +246,23 @@ def publish_to_rabbitmq(
     password: str = "guest",
 ):
     """
-    Подключаемся к RabbitMQ, создаём/объявляем очередь (если нужно),
-    и отправляем туда сообщение (message_body).
-
-    В реальном проекте лучше держать connection/channel открытыми
-    или использовать пул соединений, а не открывать/закрывать
-    при каждом сообщении.
+    Отправляем сообщение (message_body) в очередь через общий издатель:
+    соединение с RabbitMQ держится открытым между сообщениями,
+    очередь объявляется один раз, доставка подтверждается брокером.
     """
-    credentials = pika.PlainCredentials(username, password)
-    connection_params = pika.ConnectionParameters(
-        host=host, port=port, credentials=credentials
+    publisher = get_publisher(
+        host=host, port=port, username=username, password=password
     )
+    publisher.publish(message_body, queue_name)
 
-    # Открываем соединение
-    connection = pika.BlockingConnection(connection_params)
-    channel = connection.channel()
-
-    # Объявляем очередь (idempotent)
-    channel.queue_declare(queue=queue_name, durable=True)
-
-    # Публикуем сообщение:
-    body_str = json.dumps(message_body, ensure_ascii=False)
-    channel.basic_publish(
-        exchange="",  # Используем default exchange
-        routing_key=queue_name,  # В какой queue шлём
-        body=body_str,
-        properties=pika.BasicProperties(
-            delivery_mode=2  # Сохранение сообщения на диске (persistent)
-        ),
-    )
 
-    # Закрываем соединение
-    connection.close()
-
-
-def fetch_order_details(order_code: str, session: requests.Session) -> dict:
+def fetch_order_details(
+    order_code: str, session: requests.Session, list_fp: Optional[str] = None
+) -> dict:
     """
     Делаем дополнительный запрос, чтобы получить детальную информацию
-    для заказа с кодом order_code.
+    для заказа с кодом order_code. Если детали не изменились с прошлой
+    отправки — в RabbitMQ повторно не шлём.
     """
     detail_url = f"https://mc.shop.kaspi.kz/mc/api/order/{order_code}?_m=BUGA"
 
@@ -291,8 +280,13 @@ def fetch_order_details(order_code: str, session: requests.Session) -> dict:
     resp = session.get(detail_url, headers=headers)
     if resp.status_code == 200:
         details = resp.json()
-        # Отправляем в RabbitMQ (указываем очередь, хост, порт, если нужно):
-        publish_to_rabbitmq(message_body=details)
+        detail_fp = detail_fingerprint(details)
+        if get_published_index().details_unchanged(order_code, detail_fp):
+            print(f"[=] Заказ {order_code} не изменился, не отправляем")
+        else:
+            # Отправляем в RabbitMQ (указываем очередь, хост, порт, если нужно):
+            publish_to_rabbitmq(message_body=details)
+        get_published_index().remember(order_code, list_fp, detail_fp)
         return details
     else:
         print(
@@ -315,8 +309,13 @@ def process_orders_data(orders_data: dict, session: requests.Session):
         if not order_code:
             continue  # вдруг нет кода?
 
+        list_fp = content_hash(order)
+        if get_published_index().list_unchanged(order_code, list_fp):
+            print(f"--- Заказ {order_code} уже отправлен, пропускаем ---")
+            continue
+
         print(f"--- Получаем детали для заказа {order_code} ---")
-        details = fetch_order_details(order_code, session)
+        details = fetch_order_details(order_code, session, list_fp)
         print(f"Детали заказа {order_code}:")
         print(details)
         print("-----\n")
@@ -1,14 +1,27 @@
-import pika
+import os
+import sys
+import json
+import random
 import asyncio
 import datetime
 from typing import Optional
 
-import json
+from contextlib import asynccontextmanager
+
+import aiohttp
 import requests
+import yarl
 from fastapi import FastAPI, Query
 
 import uvicorn
 
+# Общий издатель RabbitMQ лежит в core/ (корень проекта)
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(BASE_DIR)
+
+from core.rabbitmq import get_publisher
+from order_index import content_hash, detail_fingerprint, get_published_index
+
 
 # ------------------------------------------------------------------------------------
 # 1) Глобальное хранилище для сессии
@@ -131,101 +144,313 @@ def do_authorization() -> Optional[requests.Session]:
 
 
 # ------------------------------------------------------------------------------------
-# 3) Фоновые задачи (авторизация / периодический сбор заказов)
+# 3) Асинхронный авторизатор и общий HTTP-клиент
+# ------------------------------------------------------------------------------------
+SESSION_TTL_SECONDS = 2 * 60 * 60
+# обновляем сессию заранее, пока старая ещё действует
+REFRESH_MARGIN_SECONDS = 10 * 60
+# после неудачного входа не долбим Kaspi чаще раза в минуту
+AUTH_RETRY_SECONDS = 60
+# потолок паузы сбора заказов, когда Kaspi раз за разом не пускает
+MAX_AUTH_BACKOFF_SECONDS = 30 * 60
+
+HTTP_POOL_SIZE = 16
+HTTP_TIMEOUT_SECONDS = 20
+
+
+class KaspiAuthError(aiohttp.ClientError):
+    """Не удалось авторизоваться в Kaspi (обрабатывается как сетевая ошибка)."""
+
+
+def is_auth_failure(resp: aiohttp.ClientResponse) -> bool:
+    """401 или редирект на страницу логина — сессия протухла."""
+    return resp.status == 401 or resp.url.host == "idmc.shop.kaspi.kz"
+
+
+class KaspiAuthenticator:
+    """
+    Держит авторизованную сессию Kaspi и один aiohttp-клиент с пулом
+    keep-alive соединений на всё приложение (/orders, фоновый сбор заказов).
+
+    Вход выполняется в отдельном потоке, event loop не блокируется.
+    Одновременные запросы на переавторизацию ждут один и тот же вход.
+    """
+
+    def __init__(self, storage: SessionStorage):
+        self.storage = storage
+        self.last_failure: Optional[float] = None
+        self._client: Optional[aiohttp.ClientSession] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _ensure_client(self) -> aiohttp.ClientSession:
+        if self._client is None or self._client.closed:
+            self._client = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE),
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS),
+            )
+        return self._client
+
+    async def get_client(self) -> aiohttp.ClientSession:
+        """Клиент с действующей сессией; если сессии нет — дожидается входа."""
+        if not self.storage.is_session_valid(SESSION_TTL_SECONDS):
+            await self.refresh()
+        return self._ensure_client()
+
+    async def refresh(self, stale_sid: Optional[str] = None):
+        """
+        Переавторизация. Если передан stale_sid, а сессия уже сменилась
+        (кто-то успел войти заново) — ничего не делаем.
+        Бросает KaspiAuthError, если войти не удалось.
+        """
+        if stale_sid is not None and self.storage.mc_sid != stale_sid:
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            loop = asyncio.get_running_loop()
+            if (
+                self.last_failure is not None
+                and loop.time() - self.last_failure < AUTH_RETRY_SECONDS
+            ):
+                raise KaspiAuthError("Авторизация в Kaspi недавно не удалась")
+            self._refresh_task = asyncio.create_task(self._login())
+        # shield: отмена одного ожидающего не должна обрывать общий вход
+        await asyncio.shield(self._refresh_task)
+
+    async def _login(self):
+        session = await asyncio.to_thread(do_authorization)
+        if session is None:
+            self.last_failure = asyncio.get_running_loop().time()
+            raise KaspiAuthError("Авторизация в Kaspi не удалась")
+        self.last_failure = None
+
+        cookies = {
+            cookie.name: cookie.value
+            for cookie in session.cookies
+            if "mc.shop.kaspi.kz".endswith(cookie.domain.lstrip("."))
+        }
+        client = self._ensure_client()
+        client.cookie_jar.clear()
+        client.cookie_jar.update_cookies(
+            cookies, response_url=yarl.URL("https://mc.shop.kaspi.kz/")
+        )
+
+        self.storage.session = session
+        self.storage.mc_sid = cookies.get("mc-sid")
+        self.storage.last_auth_time = datetime.datetime.now()
+        print("Сессия успешно обновлена в:", self.storage.last_auth_time)
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs):
+        """
+        GET через общий клиент. Если Kaspi ответил 401 или отправил на логин,
+        один раз переавторизуемся и повторяем запрос; если и после этого
+        не пускает — бросаем KaspiAuthError, а не отдаём страницу логина.
+        """
+        for attempt in range(2):
+            client = await self.get_client()
+            sid = self.storage.mc_sid
+            resp = await client.get(url, **kwargs)
+            if not is_auth_failure(resp):
+                break
+            resp.release()
+            if attempt == 0:
+                print("🔐 Сессия Kaspi отклонена, переавторизуемся...")
+                await self.refresh(stale_sid=sid)
+        else:
+            raise KaspiAuthError("Kaspi отклонил сессию и после переавторизации")
+        try:
+            yield resp
+        finally:
+            resp.release()
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self._client is not None:
+            await self._client.close()
+        self._client = None
+
+
+kaspi_auth = KaspiAuthenticator(global_session_storage)
+
+
+# ------------------------------------------------------------------------------------
+# 3.1) Фоновые задачи (авторизация / периодический сбор заказов)
 # ------------------------------------------------------------------------------------
 async def auth_loop_background():
     """
-    Бесконечный цикл авторизации (раз в 2 часа).
+    Обновляет сессию заранее, за REFRESH_MARGIN_SECONDS до истечения.
     Если авторизация падает, пытаемся снова через 1 минуту.
     """
     while True:
-        session = do_authorization()
-        if session is not None:
-            global_session_storage.session = session
-            global_session_storage.mc_sid = session.cookies.get_dict(
-                domain="mc.shop.kaspi.kz"
-            ).get("mc-sid")
-            global_session_storage.last_auth_time = datetime.datetime.now()
-            print("Сессия успешно обновлена в:", global_session_storage.last_auth_time)
-            # Спим 2 часа
-            await asyncio.sleep(2 * 60 * 60)
-        else:
+        last_auth_time = global_session_storage.last_auth_time
+        if last_auth_time is not None:
+            age = (datetime.datetime.now() - last_auth_time).total_seconds()
+            wait = SESSION_TTL_SECONDS - REFRESH_MARGIN_SECONDS - age
+            if wait > 0:
+                await asyncio.sleep(wait)
+                # пока спали, сессию мог обновить реактивный вход
+                if global_session_storage.last_auth_time != last_auth_time:
+                    continue
+        try:
+            await kaspi_auth.refresh()
+        except KaspiAuthError:
             # Повторяем попытку авторизации через 1 минуту
             print("Авторизация не удалась. Повторим через 1 минуту...")
-            await asyncio.sleep(60)
-
-
-async def fetch_orders_background():
+            await asyncio.sleep(AUTH_RETRY_SECONDS)
+
+
+ARCHIVE_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/134.0.0.0 Safari/537.36"
+    ),
+    "Accept": (
+        "text/html,application/xhtml+xml,application/xml;"
+        "q=0.9,image/avif,image/webp,image/apng,*/*;"
+        "q=0.8,application/signed-exchange;v=b3;q=0.7"
+    ),
+    # В "Referer" обычно указывается https://kaspi.kz/mc/
+    # или https://mc.shop.kaspi.kz/
+    "Referer": "https://kaspi.kz/mc/",
+}
+
+ARCHIVE_PAGE_SIZE = 100
+POLL_INTERVAL_SECONDS = 120
+# Не запрашиваем самые свежие секунды: архив Kaspi догоняет с задержкой
+ARCHIVE_LAG_MS = 30 * 1000
+# Размер окна подстраивается под поток заказов, чтобы в окно попадало
+# около TARGET_ORDERS_PER_WINDOW заказов
+MIN_WINDOW_MS = 60 * 1000
+MAX_WINDOW_MS = 6 * 60 * 60 * 1000
+INITIAL_WINDOW_MS = 2 * 60 * 1000
+TARGET_ORDERS_PER_WINDOW = 200
+
+WATERMARK_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "archive_watermark.json"
+)
+
+
+class ArchiveWatermark:
     """
-    Фоновая задача: каждые 2 минуты выгружает новые заказы и отправляет в RabbitMQ.
+    Граница (toDate, мс), до которой архив уже полностью выгружен.
+    Хранится в JSON-файле, чтобы после рестарта продолжить с того же места.
     """
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/134.0.0.0 Safari/537.36"
-        ),
-        "Accept": (
-            "text/html,application/xhtml+xml,application/xml;"
-            "q=0.9,image/avif,image/webp,image/apng,*/*;"
-            "q=0.8,application/signed-exchange;v=b3;q=0.7"
-        ),
-        # "Accept-Encoding": "gzip, deflate, br, zstd",
-        # "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
-        # "Cache-Control": "max-age=0",
-        # "Upgrade-Insecure-Requests": "1",
-        # "Sec-Fetch-Dest": "document",
-        # "Sec-Fetch-Mode": "navigate",
-        # "Sec-Fetch-Site": "none",
-        # "Sec-Fetch-User": "?1",
-        # # Эти заголовки, если хотите, тоже можно добавить –
-        # # но важно учесть синтаксис кавычек
-        # "Sec-CH-UA": '"Chromium";v="134", "Not:A-Brand";v="24", "Google Chrome";v="134"',
-        # "Sec-CH-UA-Mobile": "?0",
-        # "Sec-CH-UA-Platform": '"Windows"',
-        # В "Referer" обычно указывается https://kaspi.kz/mc/
-        # или https://mc.shop.kaspi.kz/
-        "Referer": "https://kaspi.kz/mc/",
-    }
-    while True:
-        if not global_session_storage.is_session_valid():
-            print("❌ Сессия не готова или устарела, ждём 10 секунд...")
-            await asyncio.sleep(10)
-            continue
 
-        # 📌 Вычисляем временные рамки: за последние 2 минуты
-        now = datetime.datetime.now()
-        from_date = int((now - datetime.timedelta(minutes=2)).timestamp() * 1000)
-        to_date = int(now.timestamp() * 1000)
-        # from_date = 1741719600000 # тестовые
-        # to_date = 1741781941722 # тестовые
+    def __init__(self, path: str):
+        self.path = path
 
-        print(f"🔄 Запрашиваем заказы с {from_date} до {to_date}...")
+    def load(self) -> Optional[int]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return int(json.load(f)["to_date"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, to_date: int):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"to_date": to_date}, f)
+        os.replace(tmp_path, self.path)  # атомарно: файл не останется «наполовину»
 
-        # Запрос к Kaspi
+
+def next_window_size(window_ms: int, orders_count: int, span_ms: int) -> int:
+    """Подбирает размер следующего окна по наблюдаемой частоте заказов."""
+    if orders_count == 0:
+        target = window_ms * 2
+    else:
+        target = TARGET_ORDERS_PER_WINDOW * span_ms // orders_count
+    # сглаживаем, чтобы один всплеск не бросал окно туда-сюда
+    window_ms = (window_ms + target) // 2
+    return max(MIN_WINDOW_MS, min(MAX_WINDOW_MS, window_ms))
+
+
+async def fetch_archive_window(from_date: int, to_date: int) -> Optional[list]:
+    """
+    Постранично выгружает все заказы архива за [from_date, to_date].
+    Возвращает список заказов или None, если какая-то страница не пришла.
+    KaspiAuthError пробрасывает: ждать после неё надо дольше, чем после сбоя сети.
+    """
+    orders = []
+    start = 0
+    while True:
         url = (
             "https://mc.shop.kaspi.kz/mc/api/orderTabs/archive"
-            f"?start=0&count=100&fromDate={from_date}&toDate={to_date}"
-            # f"?start=0&count=1&fromDate={from_date}&toDate={to_date}" # тестовые
+            f"?start={start}&count={ARCHIVE_PAGE_SIZE}"
+            f"&fromDate={from_date}&toDate={to_date}"
             "&statuses=COMPLETED"
             "&_m=BUGA"
         )
+        try:
+            async with kaspi_auth.get(url, headers=ARCHIVE_HEADERS) as resp:
+                if resp.status != 200:
+                    text = await resp.text()
+                    print(f"⚠️ Ошибка при получении заказов: {resp.status}, {text}")
+                    return None
+                data = await resp.json(content_type=None)
+        except KaspiAuthError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            print(f"⚠️ Ошибка при получении заказов: {e!r}")
+            return None
 
-        session = global_session_storage.session
-        resp = session.get(url, headers=headers)
+        page = data.get("orders", [])
+        orders.extend(page)
+        start += len(page)
+        total = data.get("total")
+        if len(page) < ARCHIVE_PAGE_SIZE or (total is not None and start >= total):
+            return orders
 
-        if resp.status_code == 200:
-            data = resp.json()
-            orders = data.get("data", [])
-            print(f"✅ Получено {len(orders)} заказов.")
 
-            # 📌 Обрабатываем заказы и отправляем в RabbitMQ
-            process_orders_data(data, global_session_storage.session)
+async def fetch_orders_background():
+    """
+    Фоновая задача: выгружает архив заказов окнами от сохранённой границы
+    до текущего момента и отправляет детали в RabbitMQ. Граница сдвигается
+    только после того, как все заказы окна отправлены или отложены
+    в карантин, поэтому ни рестарт, ни долгий цикл не приводят к пропуску
+    заказов, а один «сломанный» заказ не держит окно вечно.
+    """
+    watermark = ArchiveWatermark(WATERMARK_FILE)
+    window_ms = INITIAL_WINDOW_MS
+    auth_failures = 0
 
-        else:
-            print(f"⚠️ Ошибка при получении заказов: {resp.status_code}, {resp.text}")
+    while True:
+        now_ms = int(datetime.datetime.now().timestamp() * 1000) - ARCHIVE_LAG_MS
+        from_date = watermark.load() or now_ms - INITIAL_WINDOW_MS
+        if now_ms - from_date < MIN_WINDOW_MS:
+            await asyncio.sleep((MIN_WINDOW_MS - (now_ms - from_date)) / 1000)
+            continue
+        to_date = min(from_date + window_ms, now_ms)
+
+        print(f"🔄 Запрашиваем заказы с {from_date} до {to_date}...")
+        try:
+            orders = await fetch_archive_window(from_date, to_date)
+        except KaspiAuthError as e:
+            # Kaspi не пускает — ждём всё дольше, но задачу не роняем
+            delay = min(AUTH_RETRY_SECONDS * 2**auth_failures, MAX_AUTH_BACKOFF_SECONDS)
+            auth_failures += 1
+            print(f"🔐 {e}. Повторим через {delay} секунд...")
+            await asyncio.sleep(delay)
+            continue
+        auth_failures = 0
+        if orders is None:
+            await asyncio.sleep(30)
+            continue
+        print(f"✅ Получено {len(orders)} заказов.")
+
+        # 📌 Обрабатываем заказы и отправляем в RabbitMQ
+        failed = await process_orders_data({"orders": orders})
+        if failed:
+            print(f"⚠️ Не отправлены {failed}, повторим окно через 30 секунд")
+            await asyncio.sleep(30)
+            continue
+
+        watermark.save(to_date)
+        window_ms = next_window_size(window_ms, len(orders), to_date - from_date)
 
-        await asyncio.sleep(120)  # ⏳ Спим 2 минуты, затем повторяем
+        if to_date >= now_ms:
+            # догнали текущее время — ждём новых заказов
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
 
 
 # ------------------------------------------------------------------------------------
@@ -236,6 +461,9 @@ async def lifespan(app: FastAPI):
     - до yield: код, выполняющийся "при старте" приложения
     - после yield: код, выполняющийся "при завершении" приложения
     """
+    # Индекс отправленных заказов открываем при старте, а не при импорте
+    get_published_index()
+
     # Запускаем авторизацию (обязательная задача)
     auth_task = asyncio.create_task(auth_loop_background())
 
@@ -248,6 +476,7 @@ async def lifespan(app: FastAPI):
     # Когда приложение останавливается, завершаем задачи
     auth_task.cancel()
     fetch_task.cancel()
+    await kaspi_auth.close()
 
 
 # ------------------------------------------------------------------------------------
@@ -268,97 +497,162 @@ def publish_to_rabbitmq(
     password: str = "guest",
 ):
     """
-    Подключаемся к RabbitMQ, создаём/объявляем очередь (если нужно),
-    и отправляем туда сообщение (message_body).
-
-    В реальном проекте лучше держать connection/channel открытыми
-    или использовать пул соединений, а не открывать/закрывать
-    при каждом сообщении.
+    Отправляем сообщение (message_body) в очередь через общий издатель:
+    соединение с RabbitMQ держится открытым между сообщениями,
+    очередь объявляется один раз, доставка подтверждается брокером.
     """
-    credentials = pika.PlainCredentials(username, password)
-    connection_params = pika.ConnectionParameters(
-        host=host, port=port, credentials=credentials
+    publisher = get_publisher(
+        host=host, port=port, username=username, password=password
     )
+    publisher.publish(message_body, queue_name)
 
-    # Открываем соединение
-    connection = pika.BlockingConnection(connection_params)
-    channel = connection.channel()
-
-    # Объявляем очередь (idempotent)
-    channel.queue_declare(queue=queue_name, durable=True)
-
-    # Публикуем сообщение:
-    body_str = json.dumps(message_body, ensure_ascii=False)
-    channel.basic_publish(
-        exchange="",  # Используем default exchange
-        routing_key=queue_name,  # В какой queue шлём
-        body=body_str,
-        properties=pika.BasicProperties(
-            delivery_mode=2  # Сохранение сообщения на диске (persistent)
-        ),
-    )
 
-    # Закрываем соединение
-    connection.close()
+# Сколько запросов деталей заказов держим одновременно и сколько раз повторяем
+DETAIL_CONCURRENCY = 8
+DETAIL_RETRIES = 3
+DETAIL_BACKOFF_SECONDS = 1.0
+# Ответы, которые имеет смысл повторить; остальные 4xx — ошибка самого заказа
+RETRYABLE_STATUSES = {401, 408, 429}
+
+# Заказы, детали которых не получить повтором: для ручного разбора
+QUARANTINE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "quarantined_orders.jsonl"
+)
+
 
+class PermanentOrderError(Exception):
+    """Kaspi отвечает на запрос деталей так, что повтор не поможет."""
 
-def fetch_order_details(order_code: str, session: requests.Session) -> dict:
+
+def quarantine_order(order: dict, reason: str):
+    """
+    Дописывает строку заказа из архива в QUARANTINE_FILE, чтобы окно
+    архива можно было закрыть, не теряя заказ насовсем.
+    """
+    print(f"[!] Заказ {order.get('orderCode')} отложен в карантин: {reason}")
+    record = {
+        "orderCode": order.get("orderCode"),
+        "reason": reason,
+        "quarantinedAt": datetime.datetime.now().isoformat(timespec="seconds"),
+        "order": order,
+    }
+    with open(QUARANTINE_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+DETAIL_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/132.0.0.0 Safari/537.36"
+    ),
+    "Referer": "https://kaspi.kz/mc/",
+    "Accept": "application/json",
+}
+
+
+async def fetch_order_details(
+    order_code: str,
+    semaphore: asyncio.Semaphore,
+    list_fp: Optional[str] = None,
+) -> dict:
     """
     Делаем дополнительный запрос, чтобы получить детальную информацию
-    для заказа с кодом order_code.
+    для заказа с кодом order_code, и сразу отправляем её в RabbitMQ
+    (если детали изменились с прошлой отправки).
+    Сетевые ошибки, 401, 408, 429 и 5xx повторяем с экспоненциальной задержкой
+    и джиттером; если попытки кончились — возвращаем {}.
+    Прочие 4xx и ответ, который не разобрать как JSON-объект, повтором
+    не исправить: для них бросаем PermanentOrderError.
     """
     detail_url = f"https://mc.shop.kaspi.kz/mc/api/order/{order_code}?_m=BUGA"
 
-    # При желании, можно добавить те же заголовки, что и при работе с archive:
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/132.0.0.0 Safari/537.36"
-        ),
-        "Referer": "https://kaspi.kz/mc/",
-        "Accept": "application/json",
-    }
-
-    resp = session.get(detail_url, headers=headers)
-    if resp.status_code == 200:
-        details = resp.json()
-        # Отправляем в RabbitMQ (указываем очередь, хост, порт, если нужно):
-        publish_to_rabbitmq(message_body=details)
-        return details
+    for attempt in range(DETAIL_RETRIES + 1):
+        try:
+            async with semaphore:
+                async with kaspi_auth.get(detail_url, headers=DETAIL_HEADERS) as resp:
+                    if resp.status == 200:
+                        try:
+                            details = await resp.json(content_type=None)
+                        except ValueError as e:
+                            raise PermanentOrderError(f"не JSON: {e}") from e
+                        if not isinstance(details, dict) or not details:
+                            raise PermanentOrderError(f"пустой ответ: {details!r}")
+                        break
+                    error = f"HTTP {resp.status}"
+                    if resp.status not in RETRYABLE_STATUSES and resp.status < 500:
+                        raise PermanentOrderError(error)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = repr(e)
+
+        if attempt < DETAIL_RETRIES:
+            # «full jitter»: случайная пауза в пределах растущего окна
+            await asyncio.sleep(random.uniform(0, DETAIL_BACKOFF_SECONDS * 2**attempt))
     else:
-        print(
-            f"[!] Ошибка при получении деталей заказа {order_code}: {resp.status_code}"
-        )
+        print(f"[!] Не удалось получить детали заказа {order_code}: {error}")
         return {}
 
+    detail_fp = detail_fingerprint(details)
+    if get_published_index().details_unchanged(order_code, detail_fp):
+        print(f"[=] Заказ {order_code} не изменился, не отправляем")
+    else:
+        # Отправляем в RabbitMQ, не дожидаясь остальных заказов
+        try:
+            await asyncio.to_thread(publish_to_rabbitmq, message_body=details)
+        except Exception as e:
+            print(f"[!] Не удалось отправить заказ {order_code} в RabbitMQ: {e!r}")
+            return {}
+    get_published_index().remember(order_code, list_fp, detail_fp)
+    return details
+
 
-def process_orders_data(orders_data: dict, session: requests.Session):
+async def process_orders_data(orders_data: dict):
     """
     Принимает результат основного запроса (dict с полями "total" и "orders"),
-    и для каждого заказа делает запрос fetch_order_details(...).
-    Результаты выводит в консоль.
+    и для каждого заказа параллельно (не более DETAIL_CONCURRENCY сразу)
+    запрашивает детали через fetch_order_details(...).
+    Заказы с постоянной ошибкой откладываются в карантин (quarantine_order).
+    Возвращает коды заказов, которые стоит запросить повторно.
     """
     orders_list = orders_data.get("orders", [])
     print(f"Всего заказов в ответе: {len(orders_list)}")
 
+    semaphore = asyncio.Semaphore(DETAIL_CONCURRENCY)
+    to_fetch = []
     for order in orders_list:
         order_code = order.get("orderCode")
         if not order_code:
             continue  # вдруг нет кода?
-
-        print(f"--- Получаем детали для заказа {order_code} ---")
-        details = fetch_order_details(order_code, session)
-        print(f"Детали заказа {order_code}:")
-        print(details)
-        print("-----\n")
+        list_fp = content_hash(order)
+        if get_published_index().list_unchanged(order_code, list_fp):
+            continue  # уже отправляли в таком виде
+        to_fetch.append((order, list_fp))
+    print(f"Новых или изменённых: {len(to_fetch)}")
+
+    async def fetch(order, list_fp):
+        order_code = order["orderCode"]
+        try:
+            details = await fetch_order_details(order_code, semaphore, list_fp)
+        except PermanentOrderError as e:
+            quarantine_order(order, str(e))
+            return order_code, None
+        return order_code, details
+
+    failed = []
+    for next_done in asyncio.as_completed([fetch(*item) for item in to_fetch]):
+        order_code, details = await next_done
+        if details:
+            print(f"--- Детали заказа {order_code} отправлены ---")
+        elif details is not None:
+            failed.append(order_code)
+    return failed
 
 
 # ------------------------------------------------------------------------------------
 # 6) Пример эндпоинта /orders для ручного запроса архива
 # ------------------------------------------------------------------------------------
 @app.get("/orders")
-def get_archived_orders(
+async def get_archived_orders(
     from_date: int = Query(..., description="fromDate (timestamp в мс)"),
     to_date: int = Query(..., description="toDate (timestamp в мс)"),
     count: int = 100,
@@ -369,11 +663,6 @@ def get_archived_orders(
     Пример запроса:
     GET /orders?fromDate=1741719600000&toDate=1741781941722
     """
-    if not global_session_storage.session:
-        return {
-            "error": "Сессия ещё не готова. Подождите авторизации или проверьте логи."
-        }
-
     url = (
         "https://mc.shop.kaspi.kz/mc/api/orderTabs/archive"
         f"?start=0&count={count}"
@@ -413,17 +702,21 @@ def get_archived_orders(
         "Referer": "https://kaspi.kz/mc/",
     }
 
-    resp = global_session_storage.session.get(url, headers=headers)
-    if resp.status_code == 200:
-        data = resp.json()
-        # Вызовим нашу функцию, чтобы для каждого "order" сделать запрос деталей
-        process_orders_data(data, global_session_storage.session)
-        return data
-    else:
-        return {
-            "error": f"Не удалось получить архивные заказы: {resp.status_code}",
-            "text": resp.text,
-        }
+    try:
+        async with kaspi_auth.get(url, headers=headers) as resp:
+            if resp.status == 200:
+                data = await resp.json(content_type=None)
+            else:
+                return {
+                    "error": f"Не удалось получить архивные заказы: {resp.status}",
+                    "text": await resp.text(),
+                }
+    except KaspiAuthError:
+        return {"error": "Не удалось авторизоваться в Kaspi. Проверьте логи."}
+
+    # Вызовим нашу функцию, чтобы для каждого "order" сделать запрос деталей
+    await process_orders_data(data)
+    return data
 
 
 # ------------------------------------------------------------------------------------